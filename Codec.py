@@ -0,0 +1,184 @@
+import struct
+from operator import itemgetter
+
+struct_format_string = {"null": "x", "tinyint": 'b', "smallint": 'h', "int": 'i', "bigint": "q", "long": "q",
+                        "float": "f", "double": "d", "year": "i", "time": "I", "datetime": "I", "date": "I"}
+
+TEXT_TERMINATOR = b'>x'
+TEXT_LENGTH = struct.Struct(">H")
+NULL_TEXT_LENGTH = 0xFFFF
+
+# version 1 is the original sentinel terminated layout, version 2 the length prefixed one
+RECORD_FORMAT_VERSION = 2
+
+
+# Record encoder/decoder for format version 1, compiled once per table schema. The leading run of fixed
+# width columns is handled by a single struct.Struct, the remaining columns by precompiled per-column
+# steps. The byte layout is the one struct.pack produces for the schema in native alignment, with text
+# values terminated by TEXT_TERMINATOR. Only kept around to read tables that still need migrating.
+class SentinelRecordCodec:
+
+    def __init__(self, col_dtype):
+        self.col_dtype = tuple(col_dtype)
+        prefix = ""
+        position = 0
+        while position < len(self.col_dtype) and self.col_dtype[position] not in ("text", "null"):
+            prefix += struct_format_string[self.col_dtype[position]]
+            position += 1
+        self.prefix = struct.Struct("@" + prefix)
+        self.prefix_columns = position
+        # (column index, Struct or None for text, alignment) for every column after the prefix
+        self.steps = []
+        for index in range(position, len(self.col_dtype)):
+            dtype = self.col_dtype[index]
+            if dtype == "text":
+                self.steps.append((index, None, 1))
+            elif dtype == "null":
+                self.steps.append((index, False, 1))
+            else:
+                fixed = struct.Struct("=" + struct_format_string[dtype])
+                self.steps.append((index, fixed, fixed.size))
+
+    def encode(self, row):
+        record = bytearray(self.prefix.pack(*row[:self.prefix_columns]))
+        for index, fixed, align in self.steps:
+            if fixed is None:
+                record += row[index].encode("utf-8") + TEXT_TERMINATOR
+            elif fixed:
+                record += bytes(-len(record) % align)
+                record += fixed.pack(row[index])
+        return bytes(record)
+
+    # Decode the record starting at offset of buf, returns the row and the offset right after it
+    def decode(self, buf, offset):
+        row = list(self.prefix.unpack_from(buf, offset))
+        position = self.prefix.size
+        for index, fixed, align in self.steps:
+            if fixed is None:
+                text_end = buf.find(TEXT_TERMINATOR, offset + position)
+                if text_end < 0:
+                    raise ValueError("Unterminated text value in record")
+                row.append(buf[offset + position:text_end].decode("utf-8"))
+                position = text_end - offset + len(TEXT_TERMINATOR)
+            elif fixed:
+                position += -position % align
+                row.append(fixed.unpack_from(buf, offset + position)[0])
+                position += fixed.size
+            else:
+                row.append(None)
+        return row, offset + position
+
+    def size(self, row):
+        position = self.prefix.size
+        for index, fixed, align in self.steps:
+            if fixed is None:
+                position += len(row[index].encode("utf-8")) + len(TEXT_TERMINATOR)
+            elif fixed:
+                position += (-position % align) + fixed.size
+        return position
+
+
+# Record encoder/decoder for format version 2. All fixed width columns are packed big-endian, without
+# padding, into one struct.Struct at the start of the record. Text columns follow in schema order, each
+# one a 2 byte length and the utf-8 bytes, so a reader can step over a text value without scanning it.
+# A length of NULL_TEXT_LENGTH stores a NULL text value.
+class RecordCodec:
+
+    def __init__(self, col_dtype):
+        self.col_dtype = tuple(col_dtype)
+        self.fixed_columns = [index for index, dtype in enumerate(self.col_dtype) if dtype not in ("text", "null")]
+        self.text_columns = [index for index, dtype in enumerate(self.col_dtype) if dtype == "text"]
+        self.fixed = struct.Struct(">" + "".join(struct_format_string[self.col_dtype[index]]
+                                                 for index in self.fixed_columns))
+        if len(self.fixed_columns) == 1:
+            column = self.fixed_columns[0]
+            self.fixed_values = lambda row: (row[column],)
+        elif self.fixed_columns:
+            self.fixed_values = itemgetter(*self.fixed_columns)
+        else:
+            self.fixed_values = lambda row: ()
+        self.column_decoders = {}
+
+    def encode(self, row):
+        record = self.fixed.pack(*self.fixed_values(row))
+        for index in self.text_columns:
+            value = row[index]
+            if value is None:
+                record += TEXT_LENGTH.pack(NULL_TEXT_LENGTH)
+            else:
+                value = value.encode("utf-8")
+                record += TEXT_LENGTH.pack(len(value)) + value
+        return record
+
+    # Decode the record starting at offset of buf, returns the row and the offset right after it
+    def decode(self, buf, offset):
+        row = [None] * len(self.col_dtype)
+        for index, value in zip(self.fixed_columns, self.fixed.unpack_from(buf, offset)):
+            row[index] = value
+        position = offset + self.fixed.size
+        for index in self.text_columns:
+            length = TEXT_LENGTH.unpack_from(buf, position)[0]
+            position += 2
+            if length != NULL_TEXT_LENGTH:
+                row[index] = buf[position:position + length].decode("utf-8")
+                position += length
+        return row, position
+
+    # Decoder for only the columns in columns (a frozenset of column indexes), compiled once per set. The
+    # wanted fixed width columns are read by one Struct that steps over the others as pad bytes, text
+    # columns are stepped over by their length and nothing after the last wanted one is looked at. The
+    # decoder takes the buffer and the offset of a record and returns its row, other values left None.
+    def column_decoder(self, columns):
+        decoder = self.column_decoders.get(columns)
+        if decoder is not None:
+            return decoder
+        fixed_format = ">"
+        fixed_columns = []
+        for index in self.fixed_columns:
+            code = struct_format_string[self.col_dtype[index]]
+            if index in columns:
+                fixed_format += code
+                fixed_columns.append(index)
+            else:
+                fixed_format += str(struct.calcsize(">" + code)) + "x"
+        fixed = struct.Struct(fixed_format)
+        text_columns = [(index, index in columns) for index in self.text_columns]
+        while text_columns and not text_columns[-1][1]:
+            text_columns.pop()
+        width = len(self.col_dtype)
+
+        def decode(buf, offset):
+            row = [None] * width
+            for index, value in zip(fixed_columns, fixed.unpack_from(buf, offset)):
+                row[index] = value
+            position = offset + fixed.size
+            for index, wanted in text_columns:
+                length = TEXT_LENGTH.unpack_from(buf, position)[0]
+                position += 2
+                if length != NULL_TEXT_LENGTH:
+                    if wanted:
+                        row[index] = buf[position:position + length].decode("utf-8")
+                    position += length
+            return row
+
+        self.column_decoders[columns] = decode
+        return decode
+
+    def size(self, row):
+        size = self.fixed.size + 2 * len(self.text_columns)
+        for index in self.text_columns:
+            if row[index] is not None:
+                size += len(row[index].encode("utf-8"))
+        return size
+
+
+codecs = {}
+
+
+def get_codec(col_dtype, version=RECORD_FORMAT_VERSION):
+    key = (tuple(col_dtype), version)
+    codec = codecs.get(key)
+    if codec is None:
+        codec = RecordCodec(key[0]) if version == RECORD_FORMAT_VERSION else SentinelRecordCodec(key[0])
+        codecs[key] = codec
+    return codec
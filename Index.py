@@ -1,9 +1,11 @@
 import bisect
 import os
 import pickle
+import struct
 
+from Pager import get_pager, pagers
+from Wal import get_wal
 
-page_size = 512
 
 class _NodeInTree(object):
     __buckets__ = ["tree", "value", "children"]
@@ -23,6 +25,7 @@ class _NodeInTree(object):
     def lateral(self, parent, parent_ind, dest, dest_ind):
         if parent_ind > dest_ind:
             dest.value.append(parent.value[dest_ind])
+            parent.value[dest_ind] = self.value.pop(0)
             if self.children:
                 dest.children.append(self.children.pop(0))
         else:
@@ -150,7 +153,7 @@ class _NodeInTree(object):
                 descendent = descendent.children[-1]
             predecessor.extend(add_ancestors)
             self.value[ind] = descendent.value[-1]
-            descendent.remove(len(descendent.children) - 1, predecessor)
+            descendent.remove(len(descendent.value) - 1, predecessor)
         else:
             self.value.pop(ind)
             if len(self.value) < minm and predecessor:
@@ -159,10 +162,15 @@ class _NodeInTree(object):
 
 class Index_Btree(object):
     BRANCH = LEAF = _NodeInTree
+    # generation of the index file the tree was last written to, see write_tree_to_file
+    generation = 0
 
     def __init__(self, order):
         self.order = order
         self._root = self._bottom = self.LEAF(self)
+        # number of elements and of distinct keys, the statistics the query planner works with
+        self.entries = 0
+        self.keys = 0
 
     def _path_to(self, element):
         curr = self._root
@@ -188,6 +196,8 @@ class Index_Btree(object):
         return ind < len(last.value) and last.value[ind] == element
 
     def insert(self, element, ):
+        if not self.has_key(element[0]):
+            self.keys += 1
         curr = self._root
         predecessor = self._path_to(element)
         node, ind = predecessor[-1]
@@ -197,18 +207,13 @@ class Index_Btree(object):
             predecessor.append((node, ind))
         node, ind = predecessor.pop()
         node.insert(ind, element, predecessor)
+        self.entries += 1
 
-    def search(self, element):
-        curr = self._root
-        if element in dict(self):
-            return dict(self)[element]
-        return None
+    # values stored under key, an empty list when there are none
+    def search(self, key):
+        return [element[1] for element in self.range(key, key)]
 
     def remove(self, element):
-        if self.search(element):
-            element = [element, (self.search(element))]
-        else:
-            element = [element, None]
         curr = self._root
         predecessor = self._path_to(element)
         if self._current(element, predecessor):
@@ -216,8 +221,59 @@ class Index_Btree(object):
             node.remove(ind, predecessor)
         else:
             raise ValueError("%r not in %s" % (element, self.__class__.__name__))
+        self.entries -= 1
+        if not self.has_key(element[0]):
+            self.keys -= 1
+
+    def has_key(self, key):
+        node = self._root
+        while True:
+            ind = bisect.bisect_left(node.value, [key])
+            if ind < len(node.value) and node.value[ind][0] == key:
+                return True
+            if not node.children:
+                return False
+            node = node.children[ind]
 
-    
+    # [key, value] elements with low <= key <= high in order (None leaves a bound open). Only the
+    # nodes that can hold such keys are visited.
+    def range(self, low=None, high=None):
+        def _recurse(node):
+            start = 0 if low is None else bisect.bisect_left(node.value, [low])
+            for ind in range(start, len(node.value)):
+                if node.children and (yield from _recurse(node.children[ind])):
+                    return True
+                if high is not None and node.value[ind][0] > high:
+                    return True
+                yield node.value[ind]
+            if node.children:
+                return (yield from _recurse(node.children[-1]))
+            return False
+
+        return _recurse(self._root)
+
+    def first_element(self):
+        node = self._root
+        while node.children:
+            node = node.children[0]
+        return node.value[0] if node.value else None
+
+    def last_element(self):
+        node = self._root
+        while node.children:
+            node = node.children[-1]
+        return node.value[-1] if node.value else None
+
+    # statistics of the indexed column, in the form the query planner takes them
+    def statistics(self):
+        first, last = self.first_element(), self.last_element()
+        return {"rows": self.entries, "distinct": self.keys, "min": first and first[0], "max": last and last[0]}
+
+    def depth(self):
+        node, depth = self._root, 1
+        while node.children:
+            node, depth = node.children[0], depth + 1
+        return depth
 
     def __contains__(self, element):
         return self._current(element, self._path_to(element))
@@ -251,81 +307,211 @@ class Index_Btree(object):
         return "\n".join(accum)
 
 
-def insert_index_entry(table_name, column_name, key, value):
-    file_list = os.listdir(data_dir)
-    filename = str(table_name) + "_" + str(column_name) + ".ndx"
+# Elements are [key, row_id] lists, so a key may be stored for many rows. Index files are kept next to the
+# table file as <table>_<column>.ndx, a pickled tree, each with a log <table>_<column>.ndx.log of the changes
+# made to the tree since the file was written. The log is written through a pager on the write-ahead log of
+# the table, so the changes of a statement are committed in the same transaction as the pages of its rows,
+# and a tree is read back by replaying its log onto it. Once a log outgrows its tree file (and MIN_LOG_SIZE)
+# the tree is written out again and the log starts over, so writing an index costs in proportion to the
+# changes made to it. Loaded trees are cached.
+INDEX_ORDER = 64
+# The log starts with the generation of the tree file it belongs to and the length of the changes, followed
+# by a pickled list of (removed, key, row_id) changes for every commit, each preceded by its length. A log of
+# another generation than its tree file is left over from before the file was written and holds nothing.
+LOG_HEADER = struct.Struct(">QQ")
+LOG_RECORD = struct.Struct(">I")
+MIN_LOG_SIZE = 64 * 1024
+trees = {}
+# (table_dir, table_name, column_name) -> changes made to the tree that are not in its log yet
+pending_changes = {}
+# indexes whose log has outgrown their tree file
+full_logs = set()
+
+
+def index_file_path(table_dir, table_name, column_name):
+    return os.path.join(table_dir, str(table_name) + "_" + str(column_name) + ".ndx")
+
+
+def log_file_path(table_dir, table_name, column_name):
+    return index_file_path(table_dir, table_name, column_name) + ".log"
+
+
+# Names of the indexed columns of a table
+def index_columns(table_dir, table_name):
+    prefix = str(table_name) + "_"
+    if not os.path.isdir(table_dir):
+        return []
+    return sorted(filename[len(prefix):-len(".ndx")] for filename in os.listdir(table_dir)
+                  if filename.startswith(prefix) and filename.endswith(".ndx"))
+
+
+# The pager of the log of an index, on the write-ahead log of its table. Opening the write-ahead log first
+# replays whatever a crash left in it, the log included.
+def log_pager(table_dir, table_name, column_name):
+    file_path = log_file_path(table_dir, table_name, column_name)
+    pager = pagers.get(file_path)
+    if pager is None:
+        wal_file_path = os.path.join(table_dir, str(table_name) + ".wal")
+        get_wal(wal_file_path)
+        if not os.path.exists(file_path):
+            open(file_path, "wb").close()
+        pager = get_pager(file_path, wal_file_path=wal_file_path)
+    return pager
+
+
+# Generation and length of the changes of a log, (None, 0) for a log that was never written
+def read_log_header(pager):
+    if pager.file_size < LOG_HEADER.size:
+        return None, 0
+    return LOG_HEADER.unpack(pager.read(0, LOG_HEADER.size))
+
+
+def read_log_changes(pager, length):
+    data = pager.read(LOG_HEADER.size, length)
+    changes = []
+    position = 0
+    while position < length:
+        size, = LOG_RECORD.unpack_from(data, position)
+        position += LOG_RECORD.size
+        changes += pickle.loads(data[position:position + size])
+        position += size
+    return changes
+
+
+def apply_changes(tree, changes):
+    for removed, key, value in changes:
+        if removed:
+            tree.remove([key, value])
+        else:
+            tree.insert([key, value])
+
 
-    if filename not in file_list:
-    	dicti = {}
-    	dicti[key] = value
-    	initialize_tree(table_name, column_name, dicti)
+def insert_index_entry(table_dir, table_name, column_name, key, value):
+    filename = index_file_path(table_dir, table_name, column_name)
+    if not os.path.exists(filename):
+        initialize_tree(table_dir, table_name, column_name, [(key, value)])
     else:
-        tree = read_tree_from_file(table_name, column_name)
-        tree.insert([key,value])
-        write_tree_to_file(filename, tree)
-    return 
+        tree = read_tree_from_file(table_dir, table_name, column_name)
+        tree.insert([key, value])
+        tree_changed(table_dir, table_name, column_name, [(False, key, value)])
+    return
 
-def remove_index_entry(table_name, column_name, key):
-    file_list = os.listdir(data_dir)
-    filename = str(table_name) + "_" + str(column_name) + ".ndx"
 
-    if filename not in file_list:
-    	return False
-    else:
-        tree = read_tree_from_file(table_name, column_name)
-        tree.remove(key)
-        write_tree_to_file(filename, tree)
+def remove_index_entry(table_dir, table_name, column_name, key, value):
+    filename = index_file_path(table_dir, table_name, column_name)
+    if not os.path.exists(filename):
+        return False
+    tree = read_tree_from_file(table_dir, table_name, column_name)
+    tree.remove([key, value])
+    tree_changed(table_dir, table_name, column_name, [(True, key, value)])
     return True
 
-def initialize_tree(table_name, column_name, tree_values):
-	new_tree = Index_Btree(5)
-	for key, value in tree_values:
-		new_tree.insert([key, value])
-	filename = str(table_name) + "_" + str(column_name) + ".ndx"
-	write_tree_to_file(filename, new_tree)
-	return
-
-def write_tree_to_file(filename, new_tree):
-    with open(filename, "wb") as f:
-        pickle.dump(new_tree, f)
+
+# Build a tree bottom up from elements already in order, level by level: the elements are cut into
+# nodes of equal size with one element between every two of them going up to the level above.
+def build_tree(elements, order=INDEX_ORDER):
+    tree = Index_Btree(order)
+    tree.entries = len(elements)
+    tree.keys = sum(1 for ind in range(len(elements)) if ind == 0 or elements[ind][0] != elements[ind - 1][0])
+    values, nodes = elements, None
+    while len(values) > order:
+        groups = -(-(len(values) + 1) // (order + 1))
+        base, extra = divmod(len(values) - groups + 1, groups)
+        new_values, new_nodes = [], []
+        position = 0
+        for ind in range(groups):
+            end = position + base + (ind < extra)
+            new_nodes.append(tree.BRANCH(tree, values[position:end], nodes[position:end + 1] if nodes else None))
+            if ind < groups - 1:
+                new_values.append(values[end])
+            position = end + 1
+        values, nodes = new_values, new_nodes
+    tree._root = tree.BRANCH(tree, list(values), nodes)
+    return tree
+
+
+def initialize_tree(table_dir, table_name, column_name, tree_values):
+    new_tree = build_tree(sorted([key, value] for key, value in tree_values))
+    write_tree_to_file(table_dir, table_name, column_name, new_tree)
+    return new_tree
+
+
+# Write a tree to its index file, replacing the file as a whole, and start its log over with the next
+# generation. The write-ahead log of the table is synced first, the file must not hold the changes of a
+# commit that a crash could still take back.
+def write_tree_to_file(table_dir, table_name, column_name, new_tree):
+    filename = index_file_path(table_dir, table_name, column_name)
+    pager = log_pager(table_dir, table_name, column_name)
+    generation, length = read_log_header(pager)
+    new_tree.generation = max(new_tree.generation, generation or 0) + 1
+    pager.wal.sync()
+    temporary_file_path = filename + ".tmp"
+    with open(temporary_file_path, "wb") as f:
+        pickle.dump(new_tree, f, pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_file_path, filename)
+    pager.write(0, LOG_HEADER.pack(new_tree.generation, 0))
+    pager.wal.commit()
+    trees[filename] = (file_stamp(filename), new_tree)
+    full_logs.discard((table_dir, table_name, column_name))
     return
 
 
-def read_tree_from_file(table_name, column_name):
-    filename = str(table_name) + "_" + str(column_name) + ".ndx"
+def read_tree_from_file(table_dir, table_name, column_name):
+    filename = index_file_path(table_dir, table_name, column_name)
+    cached = trees.get(filename)
+    if cached is not None and cached[0] == file_stamp(filename):
+        return cached[1]
     with open(filename, "rb") as f:
         tree = pickle.load(f)
+    pager = log_pager(table_dir, table_name, column_name)
+    generation, length = read_log_header(pager)
+    if generation == tree.generation:
+        apply_changes(tree, read_log_changes(pager, length))
+    trees[filename] = (file_stamp(filename), tree)
     return tree
 
-def search(table_name, column_name, key):
-    tree = read_tree_from_file(table_name, column_name)
+
+# Append the changes made to the trees since the last commit to their logs, ahead of the commit of the
+# pages of the tables
+def log_index_changes():
+    for key, changes in list(pending_changes.items()):
+        del pending_changes[key]
+        if not changes:
+            continue
+        filename = index_file_path(*key)
+        stamp, tree = trees[filename]
+        pager = log_pager(*key)
+        generation, length = read_log_header(pager)
+        if generation != tree.generation:
+            length = 0
+        record = pickle.dumps(changes, pickle.HIGHEST_PROTOCOL)
+        pager.write(LOG_HEADER.size + length, LOG_RECORD.pack(len(record)) + record)
+        length += LOG_RECORD.size + len(record)
+        pager.write(0, LOG_HEADER.pack(tree.generation, length))
+        if length > max(MIN_LOG_SIZE, stamp[1]):
+            full_logs.add(key)
+
+
+# Write out again the trees whose log has outgrown their file, once their changes are committed
+def compact_index_logs():
+    for key in list(full_logs):
+        write_tree_to_file(*key, trees[index_file_path(*key)][1])
+
+
+def file_stamp(filename):
+    stat = os.stat(filename)
+    return stat.st_mtime_ns, stat.st_size
+
+
+# Note changes ((removed, key, row_id) tuples) made to a tree read by read_tree_from_file, so that
+# log_index_changes appends them to its log
+def tree_changed(table_dir, table_name, column_name, changes):
+    pending_changes.setdefault((table_dir, table_name, column_name), []).extend(changes)
+
+
+def search(table_dir, table_name, column_name, key):
+    tree = read_tree_from_file(table_dir, table_name, column_name)
     value = tree.search(key)
     return value
-
-# b = Index_Btree(5)
-# b.insert(['2', '5'])
-# b.insert(['7', '5'])
-# b.insert(['9', '5'])
-# b.insert(['3', '4'])
-# b.insert(['5', '4'])
-# b.insert(['1', '4'])
-# b.insert(['18', '4'])
-# b.insert(['11', '5'])
-# b.insert(['12', '5'])
-# b.insert(['13', '5'])
-# b.insert(['14', '4'])
-# b.insert(['15', '5'])
-# b.insert(['16', '5'])
-# b.insert(['17', '5'])
-# b.insert(['19', '4'])
-# print(b)
-# b.remove('17')
-# print(b)
-# print('\n\n')
-# value = b.search('11')
-# print(value)
-# print('\n\n\n')
-# initialize_tree('test', 'test', b)
-# tree = read_tree_from_file('test', 'test')
-# tree.insert(['22','22'])
-# print(tree)
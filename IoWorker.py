@@ -0,0 +1,72 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Optional pool of I/O threads used by the pagers and write-ahead logs: pages are read ahead of sequential
+# scans, pages evicted from a cache are written back and the log is synced off the calling thread. At most
+# max_pending jobs are queued; writers block until a slot frees up, read-ahead is simply skipped.
+class IoWorker:
+
+    def __init__(self, threads=2, max_pending=64):
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="davisbase-io")
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.pending = set()
+
+    # Queue function(*args), returns the future or None when no slot is free and wait is False
+    def submit(self, function, *args, wait=True):
+        if not self.slots.acquire(blocking=wait):
+            return None
+        future = self.executor.submit(function, *args)
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self.done)
+        return future
+
+    def done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+        self.slots.release()
+
+    # Wait for every queued job, re-raising the first error one of them ran into
+    def drain(self):
+        with self.lock:
+            futures = list(self.pending)
+        for future in futures:
+            future.result()
+
+    def shutdown(self):
+        self.drain()
+        self.executor.shutdown()
+
+
+def read_ahead(fd, offset, size):
+    os.pread(fd, size, offset)
+
+
+# Write (offset, data) ranges of one page to a file descriptor
+def write_ranges(fd, ranges):
+    for offset, data in ranges:
+        os.pwrite(fd, data, offset)
+
+
+io_worker = None
+
+
+def start_io_worker(threads=2, max_pending=64):
+    global io_worker
+    if io_worker is None:
+        io_worker = IoWorker(threads, max_pending)
+    return io_worker
+
+
+def stop_io_worker():
+    global io_worker
+    if io_worker is not None:
+        io_worker.shutdown()
+        io_worker = None
+
+
+def get_io_worker():
+    return io_worker
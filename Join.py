@@ -0,0 +1,95 @@
+import pickle
+import tempfile
+
+from Sort import SPILL_CHUNK_ROWS, row_size
+
+# partitioning rounds after which a partition is joined in memory whatever its size
+MAX_PARTITION_LEVELS = 4
+# most partitions, and so spill files per input, one partitioning round makes
+MAX_PARTITIONS = 64
+
+
+# Hash join of two inputs given as batches of rows (lists of rows), matching build rows and probe rows
+# whose values at build_key and probe_key are equal; NULL keys match nothing. The build input is loaded
+# into a hash table and the probe input streams past it, yielding (build row, probe row) pairs in probe
+# order. Once the build rows take up more than memory_limit bytes both inputs are split by key hash into
+# partitions spilled to temporary files in spill_directory, and the partitions are joined pair by pair.
+def hash_join(build_batches, probe_batches, build_key, probe_key, memory_limit, spill_directory, partitions=8,
+              level=0):
+    hash_table = {}
+    size = 0
+    build_batches = iter(build_batches)
+    for batch in build_batches:
+        for row in batch:
+            key = row[build_key]
+            if key is not None:
+                hash_table.setdefault(key, []).append(row)
+        size += sum(map(row_size, batch))
+        if size > memory_limit and level < MAX_PARTITION_LEVELS:
+            yield from partitioned_join(hash_table, build_batches, probe_batches, build_key, probe_key,
+                                        memory_limit, spill_directory, partitions, level)
+            return
+    # nothing can match, which spares reading a probe partition whose build partition is empty
+    if not hash_table:
+        return
+    for batch in probe_batches:
+        for row in batch:
+            build_rows = hash_table.get(row[probe_key])
+            if build_rows:
+                for build_row in build_rows:
+                    yield build_row, row
+
+
+def partitioned_join(hash_table, build_batches, probe_batches, build_key, probe_key, memory_limit,
+                     spill_directory, partitions, level):
+    # the build rows loaded so far go first, the row lists of the hash table serving as batches
+    build_files = partition(hash_table.values(), build_key, partitions, level, spill_directory)
+    hash_table.clear()
+    try:
+        partition(build_batches, build_key, partitions, level, spill_directory, build_files)
+        probe_files = partition(probe_batches, probe_key, partitions, level, spill_directory)
+        try:
+            for build_file, probe_file in zip(build_files, probe_files):
+                yield from hash_join(batches_of(build_file), batches_of(probe_file), build_key, probe_key,
+                                     memory_limit, spill_directory, partitions, level + 1)
+        finally:
+            for run in probe_files:
+                run.close()
+    finally:
+        for run in build_files:
+            run.close()
+
+
+# Spread the rows of batches over partitions temporary files by the hash of their key, salted with the
+# partitioning level so that a partition that is split again spreads out. Rows with a NULL key are dropped.
+# The rows go to files when given, which are left positioned at their start.
+def partition(batches, key_index, partitions, level, spill_directory, files=None):
+    if files is None:
+        files = [tempfile.TemporaryFile(dir=spill_directory) for i in range(partitions)]
+    buffers = [[] for i in range(partitions)]
+    for batch in batches:
+        for row in batch:
+            key = row[key_index]
+            if key is None:
+                continue
+            number = hash((level, key)) % partitions
+            buffers[number].append(row)
+            if len(buffers[number]) >= SPILL_CHUNK_ROWS:
+                files[number].seek(0, 2)
+                pickle.dump(buffers[number], files[number], pickle.HIGHEST_PROTOCOL)
+                buffers[number] = []
+    for run, buffer in zip(files, buffers):
+        run.seek(0, 2)
+        if buffer:
+            pickle.dump(buffer, run, pickle.HIGHEST_PROTOCOL)
+        run.seek(0)
+    return files
+
+
+# The chunks a spill file holds, each one a batch of rows
+def batches_of(run):
+    while True:
+        try:
+            yield pickle.load(run)
+        except EOFError:
+            return
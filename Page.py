@@ -1,121 +1,663 @@
 import os
 import struct
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from Codec import get_codec, struct_format_string
+from constants import MAX_PAGE_SIZE, MIN_PAGE_SIZE, TABLE_BTREE_INTERIOR_PAGE, TABLE_BTREE_LEAF_PAGE, \
+    TABLE_FILE_MAGIC
+from IoWorker import get_io_worker
+from Pager import discard_pager, get_pager, pagers
+from Wal import get_wal
+
 
 class Page:
+    # page size new table files get unless one is given when the table is created
     page_size = 512
     datePattern = "yyyy-MM-dd_HH:mm:ss"
+    # magic, format version, page number of the B+tree root, the last rowid handed out, the page size and
+    # the number of free pages, at the start of page 0 of every table file. A stored page size of 0 is a file
+    # written before the page size was recorded (512 bytes), 1 stands for 65536 which does not fit the field.
+    file_header = struct.Struct(">8sHiiHi8x")
+    # 1: no file header and sentinel terminated text, 2: length prefixed text, 3: slotted pages,
+    # 4: rowid keyed B+tree
+    format_version = 4
+    # page type, number of cells, start of the cell content area, right sibling page (leaf) or right most
+    # child page (interior), parent page
+    page_header = struct.Struct(">BxHHii2x")
+    # payload size and rowid in front of every leaf cell
+    cell_header = struct.Struct(">Hi")
+    # left child page and the largest rowid stored under it
+    interior_cell = struct.Struct(">ii")
+    cell_pointer = struct.Struct(">H")
+    # free space map entry of a page that is not part of the tree and can be handed out again
+    free_page_entry = 0xFF
+    # leaves a scan asks the I/O worker to read ahead
+    read_ahead_pages = 8
+    # NumPy dtypes of the fixed part of leaf cells by table schema
+    cell_dtypes = {}
 
     def __init__(self):
         pass
 
+    # The pager of a table file, opened with the page size recorded in the file header. Opening the
+    # write-ahead log of the table first replays whatever a crash left in it.
+    def pager(self, table_file_path):
+        pager = pagers.get(table_file_path)
+        if pager is None:
+            wal_file_path = self.wal_file_path(table_file_path)
+            get_wal(wal_file_path)
+            pager = get_pager(table_file_path, self.read_page_size(table_file_path), wal_file_path)
+        return pager
+
+    # The write-ahead log shared by a table file and its free space map
+    def wal_file_path(self, table_file_path):
+        return os.path.splitext(table_file_path)[0] + ".wal"
+
+    # Page size recorded in the header of a table file, the default page size for an empty or older file
+    def read_page_size(self, table_file_path):
+        with open(table_file_path, "rb") as fh:
+            data = fh.read(self.file_header.size)
+        if len(data) < self.file_header.size:
+            return self.page_size
+        magic, version, root_page, last_rowid, page_size, free_pages = self.file_header.unpack(data)
+        if magic != TABLE_FILE_MAGIC or version != self.format_version:
+            return self.page_size
+        if page_size == 0:
+            return MIN_PAGE_SIZE
+        return MAX_PAGE_SIZE if page_size == 1 else page_size
+
+    def get_page_size(self, table_file_path):
+        return self.pager(table_file_path).page_size
+
+    def valid_page_size(self, page_size):
+        return MIN_PAGE_SIZE <= page_size <= MAX_PAGE_SIZE and page_size & (page_size - 1) == 0
+
+    # Write the file header and an empty root leaf into an empty table file
+    def init_table_file(self, table_file_path, page_size=None):
+        pager = get_pager(table_file_path, page_size or self.page_size, self.wal_file_path(table_file_path))
+        header = self.file_header.pack(TABLE_FILE_MAGIC, self.format_version, 1, 0,
+                                       pager.page_size % MAX_PAGE_SIZE or 1, 0)
+        pager.write(0, header + bytes(pager.page_size - len(header)))
+        self.init_page(table_file_path, 1)
+
+    # (root page, last rowid, free pages) from the file header. An empty table file gets its header and an
+    # empty leaf page as root first.
+    def read_file_header(self, table_file_path):
+        pager = self.pager(table_file_path)
+        if pager.file_size == 0:
+            self.init_table_file(table_file_path, pager.page_size)
+        magic, version, root_page, last_rowid, page_size, free_pages = self.file_header.unpack_from(
+            pager.get_page(0), 0)
+        if magic != TABLE_FILE_MAGIC or version != self.format_version:
+            raise ValueError(table_file_path + " uses an older file format, upgrade it with migrate.py")
+        return root_page, last_rowid, free_pages
+
+    # Returns (root page, last rowid) from the file header
     def get_root_node(self, table_file_path):
-        if os.stat(table_file_path).st_size == 0:
-            table_root_node = [1, 0, 0]
-            with open(table_file_path, "wb") as fh:
-                root_node_size = len(table_root_node)
-                root_node = struct.pack('i' * root_node_size, *table_root_node)
-                fh.write(root_node)
+        return self.read_file_header(table_file_path)[:2]
+
+    def update_root_node(self, table_file_path, root_page=None, last_rowid=None, free_pages=None):
+        current_root_page, current_last_rowid, current_free_pages = self.read_file_header(table_file_path)
+        if root_page is None:
+            root_page = current_root_page
+        if last_rowid is None:
+            last_rowid = current_last_rowid
+        if free_pages is None:
+            free_pages = current_free_pages
+        if (root_page, last_rowid, free_pages) == (current_root_page, current_last_rowid, current_free_pages):
+            return
+        pager = self.pager(table_file_path)
+        header = self.file_header.pack(TABLE_FILE_MAGIC, self.format_version, root_page, last_rowid,
+                                       pager.page_size % MAX_PAGE_SIZE or 1, free_pages)
+        pager.write(0, header)
+
+    # The free space map of a table file lives next to it in a .fsm file holding one byte per page: the free
+    # bytes of the page in 1/256ths of the page size (at most 254), or free_page_entry for a page that is not
+    # in use. It is only a hint and is rebuilt from the table file when it is missing.
+    def fsm_file_path(self, table_file_path):
+        return os.path.splitext(table_file_path)[0] + ".fsm"
+
+    def fsm_pager(self, table_file_path):
+        fsm_file_path = self.fsm_file_path(table_file_path)
+        pager = pagers.get(fsm_file_path)
+        if pager is None:
+            page_size = self.get_page_size(table_file_path)
+            if os.path.exists(fsm_file_path):
+                return get_pager(fsm_file_path, page_size, self.wal_file_path(table_file_path))
+            open(fsm_file_path, 'wb').close()
+            pager = get_pager(fsm_file_path, page_size, self.wal_file_path(table_file_path))
+            self.rebuild_fsm(table_file_path)
+        return pager
+
+    def rebuild_fsm(self, table_file_path):
+        table_pager = self.pager(table_file_path)
+        for page_number in range(1, -(-table_pager.file_size // table_pager.page_size)):
+            page_type, cells, content_start, right_sibling, parent = self.read_page_header(table_file_path,
+                                                                                          page_number)
+            if page_type in (TABLE_BTREE_INTERIOR_PAGE, TABLE_BTREE_LEAF_PAGE):
+                self.set_free_space(table_file_path, page_number,
+                                    content_start - self.page_header.size - cells * self.cell_pointer.size)
+            else:
+                self.fsm_pager(table_file_path).write(page_number, bytes([self.free_page_entry]))
+
+    def set_free_space(self, table_file_path, page_number, free_bytes):
+        entry = min(254, free_bytes * 256 // self.get_page_size(table_file_path))
+        pager = self.fsm_pager(table_file_path)
+        if page_number >= pager.file_size or pager.read(page_number, 1)[0] != entry:
+            pager.write(page_number, bytes([entry]))
+
+    # Approximate free bytes of a page according to the free space map, None for a page not in use
+    def fsm_free_space(self, table_file_path, page_number):
+        pager = self.fsm_pager(table_file_path)
+        if page_number >= pager.file_size:
+            return None
+        entry = pager.read(page_number, 1)[0]
+        if entry == self.free_page_entry:
+            return None
+        return entry * self.get_page_size(table_file_path) // 256
+
+    # Take a page out of the tree: it is zeroed, marked free in the free space map and counted in the file
+    # header so that the next page allocation reuses it
+    def free_page(self, table_file_path, page_number):
+        pager = self.pager(table_file_path)
+        pager.write(page_number * pager.page_size, bytes(pager.page_size))
+        self.fsm_pager(table_file_path).write(page_number, bytes([self.free_page_entry]))
+        self.update_root_node(table_file_path, free_pages=self.read_file_header(table_file_path)[2] + 1)
+
+    def init_page(self, table_file_path, page_number, page_type=TABLE_BTREE_LEAF_PAGE, right_sibling=-1, parent=-1):
+        pager = self.pager(table_file_path)
+        page = bytearray(pager.page_size)
+        self.page_header.pack_into(page, 0, page_type, 0, pager.page_size % MAX_PAGE_SIZE, right_sibling, parent)
+        pager.write(page_number * pager.page_size, page)
+        self.set_free_space(table_file_path, page_number, pager.page_size - self.page_header.size)
+
+    # Page number for a new page: a free page listed in the free space map when there is one, the next page
+    # at the end of the table file otherwise. The caller initialises the page right away.
+    def new_page_number(self, table_file_path):
+        pager = self.pager(table_file_path)
+        free_pages = self.read_file_header(table_file_path)[2]
+        if free_pages > 0:
+            fsm_pager = self.fsm_pager(table_file_path)
+            page_number = fsm_pager.read(0, fsm_pager.file_size).find(bytes([self.free_page_entry]), 1)
+            if page_number > 0:
+                fsm_pager.write(page_number, bytes([0]))
+                self.update_root_node(table_file_path, free_pages=free_pages - 1)
+                return page_number
+        return self.page_count(table_file_path)
+
+    # Pages in the table file, the file header page and free pages included
+    def page_count(self, table_file_path):
+        pager = self.pager(table_file_path)
+        return -(-pager.file_size // pager.page_size)
+
+    # (page type, number of cells, cell content start, right sibling, parent) of a page. The content start
+    # of an empty 64 KiB page is stored as 0.
+    def read_page_header(self, table_file_path, page_number):
+        buffer, page_offset = self.pager(table_file_path).page_buffer(page_number)
+        page_type, cells, content_start, right_sibling, parent = self.page_header.unpack_from(buffer, page_offset)
+        return page_type, cells, content_start or MAX_PAGE_SIZE, right_sibling, parent
+
+    def write_page_header(self, table_file_path, page_number, page_type, cells, content_start, right_sibling,
+                          parent):
+        pager = self.pager(table_file_path)
+        header = self.page_header.pack(page_type, cells, content_start % MAX_PAGE_SIZE, right_sibling, parent)
+        pager.write(page_number * pager.page_size, header)
+
+    def set_parent(self, table_file_path, page_number, parent):
+        page_type, cells, content_start, right_sibling, old_parent = self.read_page_header(table_file_path,
+                                                                                          page_number)
+        if old_parent == parent:
+            return
+        self.write_page_header(table_file_path, page_number, page_type, cells, content_start, right_sibling, parent)
+
+    # Bytes left between the cell pointer array and the cell content area
+    def page_free_space(self, table_file_path, page_number):
+        page_type, cells, content_start, right_sibling, parent = self.read_page_header(table_file_path, page_number)
+        return content_start - self.page_header.size - cells * self.cell_pointer.size
+
+    # Space a record takes up in a leaf page: cell pointer, cell header and the record itself
+    def cell_size(self, record_size):
+        return self.cell_pointer.size + self.cell_header.size + record_size
+
+    # Largest record a single empty page of the table file can hold
+    def max_record_size(self, table_file_path):
+        return self.get_page_size(table_file_path) - self.page_header.size - self.cell_size(0)
+
+    def leaf_cell(self, row_id, record):
+        return self.cell_header.pack(len(record), row_id) + record
+
+    # Append a raw cell to the page, growing the content area down and the pointer array up. A new right
+    # sibling (or right most child) can be set along with the header.
+    def insert_cell(self, table_file_path, page_number, cell, new_right_sibling=None):
+        page_type, cells, content_start, right_sibling, parent = self.read_page_header(table_file_path, page_number)
+        if new_right_sibling is not None:
+            right_sibling = new_right_sibling
+        cell_start = content_start - len(cell)
+        if cell_start < self.page_header.size + (cells + 1) * self.cell_pointer.size:
+            return False
+        pager = self.pager(table_file_path)
+        page_offset = page_number * pager.page_size
+        pager.write(page_offset + cell_start, cell)
+        pager.write(page_offset + self.page_header.size + cells * self.cell_pointer.size,
+                    self.cell_pointer.pack(cell_start))
+        pager.write(page_offset, self.page_header.pack(page_type, cells + 1, cell_start % MAX_PAGE_SIZE, right_sibling,
+                                                       parent))
+        self.set_free_space(table_file_path, page_number,
+                            cell_start - self.page_header.size - (cells + 1) * self.cell_pointer.size)
+        return True
+
+    # Replace all cells of a page with the given raw cells, keeping the page type and the page links unless
+    # a new right sibling (or right most child) is given. Leaves the page untouched when the cells do not fit.
+    def rewrite_page(self, table_file_path, page_number, cells, right_sibling=None):
+        return self.write_page_image(table_file_path, page_number, cells, right_sibling)
+
+    # Build the image of a page holding the given raw cells in order, None when they do not fit
+    def page_image(self, page_type, cells, right_sibling, parent, page_size=None):
+        page_size = page_size or self.page_size
+        page = bytearray(page_size)
+        content_start = page_size
+        pointer_offset = self.page_header.size
+        for cell in cells:
+            content_start -= len(cell)
+            if content_start < pointer_offset + self.cell_pointer.size:
+                return None
+            page[content_start:content_start + len(cell)] = cell
+            self.cell_pointer.pack_into(page, pointer_offset, content_start)
+            pointer_offset += self.cell_pointer.size
+        self.page_header.pack_into(page, 0, page_type, len(cells), content_start % MAX_PAGE_SIZE, right_sibling, parent)
+        return page
+
+    # Byte range [low, high) in which two page images differ, None when they are equal. Slices are compared
+    # halving the range each time so the work stays in C.
+    def changed_range(self, old, new):
+        if old == new:
+            return None
+        low, high = 0, len(new)
+        while low < high:
+            middle = (low + high) // 2
+            if old[:middle + 1] == new[:middle + 1]:
+                low = middle + 1
+            else:
+                high = middle
+        first = low
+        low, high = first, len(new)
+        while low < high:
+            middle = (low + high) // 2
+            if old[middle:] == new[middle:]:
+                high = middle
+            else:
+                low = middle + 1
+        return first, low
+
+    # Write a page holding the given raw cells, keeping the page type, parent and, unless a new one is
+    # given, the right sibling. The image is built in memory and only the byte range that differs from the
+    # current page is written, with a single write; nothing is written for an unchanged page.
+    def write_page_image(self, table_file_path, page_number, cells, right_sibling=None):
+        page_type, page_cells, content_start, page_right_sibling, parent = self.read_page_header(table_file_path,
+                                                                                                page_number)
+        if right_sibling is None:
+            right_sibling = page_right_sibling
+        pager = self.pager(table_file_path)
+        page = self.page_image(page_type, cells, right_sibling, parent, pager.page_size)
+        if page is None:
+            return False
+        buffer, page_offset = pager.page_buffer(page_number)
+        changed = self.changed_range(buffer[page_offset:page_offset + pager.page_size], page)
+        if changed is None:
+            return True
+        low, high = changed
+        pager.write(page_number * pager.page_size + low, page[low:high])
+        self.set_free_space(table_file_path, page_number, pager.page_size - self.page_header.size -
+                            sum(self.cell_pointer.size + len(cell) for cell in cells))
+        return True
+
+    # Raw cells of a page in pointer order
+    def read_cells(self, table_file_path, page_number):
+        buffer, page_offset = self.pager(table_file_path).page_buffer(page_number)
+        page_type, cells, content_start, right_sibling, parent = self.page_header.unpack_from(buffer, page_offset)
+        raw_cells = []
+        for i in range(0, cells):
+            pointer = self.cell_pointer.unpack_from(buffer, page_offset + self.page_header.size +
+                                                    i * self.cell_pointer.size)[0]
+            cell_offset = page_offset + pointer
+            if page_type == TABLE_BTREE_INTERIOR_PAGE:
+                cell_end = cell_offset + self.interior_cell.size
+            else:
+                cell_end = cell_offset + self.cell_header.size + self.cell_header.unpack_from(buffer, cell_offset)[0]
+            raw_cells.append(bytes(buffer[cell_offset:cell_end]))
+        return raw_cells
+
+    # Rowid of the last cell of a leaf page, None for an empty page
+    def last_row_id(self, table_file_path, page_number):
+        buffer, page_offset = self.pager(table_file_path).page_buffer(page_number)
+        page_type, cells, content_start, right_sibling, parent = self.page_header.unpack_from(buffer, page_offset)
+        if cells == 0:
+            return None
+        pointer = self.cell_pointer.unpack_from(buffer, page_offset + self.page_header.size +
+                                                (cells - 1) * self.cell_pointer.size)[0]
+        return self.cell_header.unpack_from(buffer, page_offset + pointer)[1]
+
+    def cell_row_id(self, cell):
+        return self.cell_header.unpack_from(cell, 0)[1]
+
+    # Interior cell i of a page as (left child, key)
+    def read_interior_cell(self, buffer, page_offset, i):
+        pointer = self.cell_pointer.unpack_from(buffer, page_offset + self.page_header.size +
+                                                i * self.cell_pointer.size)[0]
+        return self.interior_cell.unpack_from(buffer, page_offset + pointer)
+
+    # Descend from the root to the leaf page that holds (or would hold) row_id. Returns the leaf page
+    # number and the path of (interior page, child index) pairs that led to it.
+    def find_leaf(self, table_file_path, row_id):
+        pager = self.pager(table_file_path)
+        page_number, last_rowid = self.get_root_node(table_file_path)
+        path = []
+        while True:
+            buffer, page_offset = pager.page_buffer(page_number)
+            page_type, cells, content_start, right_sibling, parent = self.page_header.unpack_from(buffer, page_offset)
+            if page_type != TABLE_BTREE_INTERIOR_PAGE:
+                return page_number, path
+            low, high = 0, cells
+            while low < high:
+                middle = (low + high) // 2
+                if self.read_interior_cell(buffer, page_offset, middle)[1] < row_id:
+                    low = middle + 1
+                else:
+                    high = middle
+            path.append((page_number, low))
+            if low < cells:
+                page_number = self.read_interior_cell(buffer, page_offset, low)[0]
+            else:
+                page_number = right_sibling
+
+    # Leaf page numbers in rowid order, following the right sibling links. With rowid bounds the walk starts
+    # at the leaf holding low_row_id and stops after the leaf that reaches high_row_id. With an I/O worker
+    # running, the next read_ahead_pages leaves listed in the parent page are read ahead of the walk.
+    def leaf_pages(self, table_file_path, low_row_id=None, high_row_id=None):
+        page_number, path = self.find_leaf(table_file_path, -2 ** 31 if low_row_id is None else low_row_id)
+        pager = self.pager(table_file_path)
+        read_ahead = get_io_worker() is not None
+        directory_page, directory, position, requested = None, [], 0, 0
+        while page_number != -1:
+            buffer, page_offset = pager.page_buffer(page_number)
+            page_type, cells, content_start, right_sibling, parent = self.page_header.unpack_from(buffer, page_offset)
+            if read_ahead:
+                if parent != directory_page:
+                    directory_page = parent
+                    directory = self.child_pages(table_file_path, parent) if parent != -1 else []
+                    position = directory.index(page_number) + 1 if page_number in directory else len(directory)
+                    requested = position
+                else:
+                    position += 1
+                while requested < min(len(directory), position + self.read_ahead_pages):
+                    pager.prefetch(directory[requested])
+                    requested += 1
+            yield page_number
+            buffer, page_offset = pager.page_buffer(page_number)
+            page_type, cells, content_start, right_sibling, parent = self.page_header.unpack_from(buffer, page_offset)
+            if high_row_id is not None and cells > 0 and \
+                    self.last_row_id(table_file_path, page_number) >= high_row_id:
+                break
+            page_number = right_sibling
+
+    # Insert a record into the leaf that covers row_id, splitting pages up to the root when it is full
+    def insert_row(self, table_file_path, row_id, record):
+        cell = self.leaf_cell(row_id, record)
+        page_number, path = self.find_leaf(table_file_path, row_id)
+        last_row_id = self.last_row_id(table_file_path, page_number)
+        is_append = last_row_id is None or last_row_id < row_id
+        if is_append:
+            if self.insert_cell(table_file_path, page_number, cell):
+                return True
+            # appending past the last rowid: start a fresh right most leaf instead of splitting in half
+            left_row_id, right_cells = last_row_id, [cell]
+        else:
+            cells = self.read_cells(table_file_path, page_number)
+            position = 0
+            while position < len(cells) and self.cell_row_id(cells[position]) < row_id:
+                position += 1
+            cells.insert(position, cell)
+            if self.rewrite_page(table_file_path, page_number, cells):
+                return True
+            left_cells, right_cells = self.split_cells(cells)
+            left_row_id = self.cell_row_id(left_cells[-1])
+        page_type, page_cells, content_start, right_sibling, parent = self.read_page_header(table_file_path,
+                                                                                           page_number)
+        new_page_number = self.new_page_number(table_file_path)
+        self.init_page(table_file_path, new_page_number, TABLE_BTREE_LEAF_PAGE, right_sibling, parent)
+        self.rewrite_page(table_file_path, new_page_number, right_cells)
+        if is_append:
+            self.write_page_header(table_file_path, page_number, page_type, page_cells, content_start,
+                                   new_page_number, parent)
         else:
-            table_root_node = []
-
-            with open(table_file_path, 'rb') as f:
-                f.seek(0, 0)
-                i = 0
-                node_value = f.read(4)
-                while node_value != b'\x00\x00\x00\x00' and i < self.page_size:
-                    table_root_node.append(struct.unpack('i', node_value)[0])
-                    node_value = f.read(4)
-                    i += 4
-        return table_root_node
-
-    def check_page_size(self, table_file_path, page_number):
-
-        with open(table_file_path, 'rb') as f:
-            f.seek((page_number * self.page_size), 0)
-            page_size = 0
-            while page_size < 512:
-                bytes1 = f.read(1)
-                if bytes1 == b'':
-                    break
-                page_size += 1
-        return page_size
-
-    def write_to_page(self, table_file_path, page_number, start_byte, record_values, fstring, record_payload=0):
-
-        with open(table_file_path, "r+b") as fh:
-            page_offset = start_byte
-            #print("printing to the page at offset",page_offset)
-            fh.seek(page_offset, 0)
-            record = struct.pack(fstring, *record_values)
-            fh.write(record)
-            return True,fh.tell()
-        return False
-    
-    def write_to_del_page(self, table_file_path, page_number, start_byte, record_values, fstring, record_payload=0):
-
-        with open(table_file_path, "r+b") as fh:
-            page_offset = start_byte
-            fh.seek(page_offset, 0)
-            record = struct.pack(fstring, *record_values)
-            fh.write(record)
-            return True,fh.tell()
-        return False
-    
-    def page_clean_bytes(self, table_file_path, page_no):
-        page_offset = page_no * self.page_size
-        with open(table_file_path, "r+b") as fh:
-            fh.seek(page_offset, 0)
-            for i in range(0, self.page_size):
-                fh.write(b'0')
+            self.rewrite_page(table_file_path, page_number, left_cells, new_page_number)
+        self.insert_into_parent(table_file_path, path, page_number, left_row_id, new_page_number)
         return True
 
-    def read_page(self, table_file_path, column_dtype, page_number, record_fstring, no_of_records):
-        fstring_value = {"x": 0, "h": 2, "i": 4, "q": 8, "f": 4, "d": 8, "Q": 8, "B": 1, "b": 1, "H": 2, "s": 1,"I":4}
-        with open(table_file_path, 'rb') as fh:
-            page_offset = page_number * self.page_size
-            page_end = page_offset + self.page_size
-            page_records = []
-            for i in range(0, no_of_records):
-                record = []
-                for f_str in record_fstring:
-                    fh.seek(page_offset, 0)
-                    read_bytes = fstring_value[f_str]
-                    if f_str != "s":
-                        rec_value = fh.read(read_bytes)
-                        record.append(struct.unpack(f_str, rec_value)[0])
-                    else:
-                        counter = 0
-                        read_bytes = fstring_value[f_str]
-                        text_val = ''
-                        text_pg_offset = page_offset
-                        while True:
-                            if fh.read(2) != b'>x':
-                                fh.seek(text_pg_offset, 0)
-                                text_val += (struct.unpack(f_str, fh.read(read_bytes))[0]).decode("utf-8")
-                                text_pg_offset += 1
-                                counter += 1
-                            else:
-                                counter += 2
-                                break
-                        if counter % 4 != 0:
-                            read_bytes = counter + (4 - (counter % 4))
-                        else:
-                            read_bytes = counter
-                        record.append(text_val)
-                    page_offset += read_bytes
-                page_records.append(record)
-
-        if len(record) < 1:
+    # Split a cell list roughly in half by bytes, leaving at least one cell on each side
+    def split_cells(self, cells):
+        total = sum(len(cell) for cell in cells)
+        size = 0
+        for position in range(len(cells) - 1):
+            size += len(cells[position])
+            if size >= total // 2:
+                return cells[:position + 1], cells[position + 1:]
+        return cells[:-1], cells[-1:]
+
+    # Register new_page_number, holding the rowids above key, right next to page_number in its parent.
+    # A full parent is split around its middle key, which moves up a level; a split root grows the tree.
+    def insert_into_parent(self, table_file_path, path, page_number, key, new_page_number):
+        if not path:
+            root_page = self.new_page_number(table_file_path)
+            self.init_page(table_file_path, root_page, TABLE_BTREE_INTERIOR_PAGE, new_page_number)
+            self.insert_cell(table_file_path, root_page, self.interior_cell.pack(page_number, key))
+            self.set_parent(table_file_path, page_number, root_page)
+            self.set_parent(table_file_path, new_page_number, root_page)
+            self.update_root_node(table_file_path, root_page=root_page)
+            return
+        parent, index = path.pop()
+        page_type, cells, content_start, right_most_child, grand_parent = self.read_page_header(table_file_path,
+                                                                                               parent)
+        if index == cells and self.insert_cell(table_file_path, parent, self.interior_cell.pack(page_number, key),
+                                               new_page_number):
+            # page_number was the right most child: its key is appended and new_page_number takes its place
+            self.set_parent(table_file_path, new_page_number, parent)
+            return
+        parent_cells = self.read_cells(table_file_path, parent)
+        parent_cells.insert(index, self.interior_cell.pack(page_number, key))
+        if index + 1 < len(parent_cells):
+            left_child, next_key = self.interior_cell.unpack(parent_cells[index + 1])
+            parent_cells[index + 1] = self.interior_cell.pack(new_page_number, next_key)
+        else:
+            right_most_child = new_page_number
+        self.set_parent(table_file_path, new_page_number, parent)
+        if self.rewrite_page(table_file_path, parent, parent_cells, right_most_child):
+            return
+        middle = len(parent_cells) // 2
+        middle_child, middle_key = self.interior_cell.unpack(parent_cells[middle])
+        right_cells = parent_cells[middle + 1:]
+        new_parent = self.new_page_number(table_file_path)
+        self.init_page(table_file_path, new_parent, TABLE_BTREE_INTERIOR_PAGE, right_most_child, grand_parent)
+        self.rewrite_page(table_file_path, new_parent, right_cells)
+        self.rewrite_page(table_file_path, parent, parent_cells[:middle], middle_child)
+        for cell in right_cells:
+            self.set_parent(table_file_path, self.interior_cell.unpack(cell)[0], new_parent)
+        self.set_parent(table_file_path, right_most_child, new_parent)
+        self.insert_into_parent(table_file_path, path, parent, middle_key, new_parent)
+
+    # Child pages of an interior page in key order
+    def child_pages(self, table_file_path, page_number):
+        buffer, page_offset = self.pager(table_file_path).page_buffer(page_number)
+        page_type, cells, content_start, right_most_child, parent = self.page_header.unpack_from(buffer, page_offset)
+        return [self.read_interior_cell(buffer, page_offset, i)[0] for i in range(cells)] + [right_most_child]
+
+    # Child page at position index of an interior page, index == number of cells being the right most child
+    def child_page(self, table_file_path, page_number, index):
+        buffer, page_offset = self.pager(table_file_path).page_buffer(page_number)
+        page_type, cells, content_start, right_most_child, parent = self.page_header.unpack_from(buffer, page_offset)
+        if index < cells:
+            return self.read_interior_cell(buffer, page_offset, index)[0]
+        return right_most_child
+
+    # The leaf right before the one reached through path (as returned by find_leaf), -1 for the left most leaf
+    def left_leaf(self, table_file_path, path):
+        for depth in range(len(path) - 1, -1, -1):
+            page_number, index = path[depth]
+            if index > 0:
+                page_number = self.child_page(table_file_path, page_number, index - 1)
+                page_type, cells, content_start, right_most_child, parent = self.read_page_header(table_file_path,
+                                                                                                 page_number)
+                while page_type == TABLE_BTREE_INTERIOR_PAGE:
+                    page_number = right_most_child
+                    page_type, cells, content_start, right_most_child, parent = self.read_page_header(
+                        table_file_path, page_number)
+                return page_number
+        return -1
+
+    # Unlink an empty leaf from its parent and from the leaf chain and free its page. The root leaf and the
+    # only child of a parent stay in place.
+    def free_leaf(self, table_file_path, page_number, path):
+        if not path:
+            return False
+        parent, index = path[-1]
+        page_type, cells, content_start, right_most_child, grand_parent = self.read_page_header(table_file_path,
+                                                                                               parent)
+        if cells == 0:
+            return False
+        parent_cells = self.read_cells(table_file_path, parent)
+        if index < cells:
+            del parent_cells[index]
+        else:
+            right_most_child = self.interior_cell.unpack(parent_cells.pop())[0]
+        left_leaf = self.left_leaf(table_file_path, path)
+        if left_leaf != -1:
+            right_sibling = self.read_page_header(table_file_path, page_number)[3]
+            left_type, left_cells, left_content_start, left_right_sibling, left_parent = self.read_page_header(
+                table_file_path, left_leaf)
+            self.write_page_header(table_file_path, left_leaf, left_type, left_cells, left_content_start,
+                                   right_sibling, left_parent)
+        self.rewrite_page(table_file_path, parent, parent_cells, right_most_child)
+        self.free_page(table_file_path, page_number)
+        return True
+
+    # Append raw leaf cells, in rising rowid order and above every rowid in the table, behind the last leaf.
+    # Cells are packed into page images in memory and every filled page is written with a single write.
+    # Returns the rowid of the last cell written, None when there were no cells.
+    def append_cells(self, table_file_path, cells):
+        page_size = self.get_page_size(table_file_path)
+        page_number, path = self.find_leaf(table_file_path, 2 ** 31 - 1)
+        page_cells = self.read_cells(table_file_path, page_number)
+        used = self.page_header.size + sum(self.cell_pointer.size + len(cell) for cell in page_cells)
+        row_id = None
+        for cell in cells:
+            row_id = self.cell_row_id(cell)
+            if used + self.cell_pointer.size + len(cell) > page_size and page_cells:
+                page_type, cell_count, content_start, right_sibling, parent = self.read_page_header(
+                    table_file_path, page_number)
+                new_page_number = self.new_page_number(table_file_path)
+                self.init_page(table_file_path, new_page_number, page_type, right_sibling, parent)
+                self.write_page_image(table_file_path, page_number, page_cells, new_page_number)
+                self.insert_into_parent(table_file_path, path, page_number, self.cell_row_id(page_cells[-1]),
+                                        new_page_number)
+                page_number, path = self.find_leaf(table_file_path, row_id)
+                page_cells = []
+                used = self.page_header.size
+            page_cells.append(cell)
+            used += self.cell_pointer.size + len(cell)
+        self.write_page_image(table_file_path, page_number, page_cells)
+        return row_id
+
+    # Move a rebuilt table file (and its free space map) in place of another one. Closing the pagers
+    # checkpoints and removes the write-ahead logs of both. The old free space map goes first so that a crash
+    # half way leaves no stale map behind, a missing one is rebuilt.
+    def replace_table_file(self, source_file_path, table_file_path):
+        for file_path in (source_file_path, table_file_path, self.fsm_file_path(source_file_path),
+                          self.fsm_file_path(table_file_path)):
+            discard_pager(file_path)
+        if os.path.exists(self.fsm_file_path(table_file_path)):
+            os.remove(self.fsm_file_path(table_file_path))
+        os.replace(source_file_path, table_file_path)
+        if os.path.exists(self.fsm_file_path(source_file_path)):
+            os.replace(self.fsm_file_path(source_file_path), self.fsm_file_path(table_file_path))
+
+    # Decoded rows ([row_id] + values) of a leaf page. With columns (schema indexes, 0 being the row_id) only
+    # those columns are decoded, the other values are left None. With cell_indexes only those cells are read.
+    def read_page(self, table_file_path, column_dtype, page_number, columns=None, cell_indexes=None):
+        buffer, page_offset = self.pager(table_file_path).page_buffer(page_number)
+        return self.decode_page(buffer, page_offset, column_dtype, columns, cell_indexes)
+
+    # read_page on a leaf page at page_offset of any buffer holding it
+    def decode_page(self, buffer, page_offset, column_dtype, columns=None, cell_indexes=None):
+        codec = get_codec(column_dtype[1:])
+        if columns is not None:
+            decode_columns = codec.column_decoder(frozenset(column - 1 for column in columns if column > 0))
+        page_type, cells, content_start, right_sibling, parent = self.page_header.unpack_from(buffer, page_offset)
+        pointers_offset = page_offset + self.page_header.size
+        page_records = []
+        try:
+            for i in range(0, cells) if cell_indexes is None else cell_indexes:
+                cell_offset = page_offset + self.cell_pointer.unpack_from(buffer, pointers_offset +
+                                                                          i * self.cell_pointer.size)[0]
+                record_size, row_id = self.cell_header.unpack_from(buffer, cell_offset)
+                if columns is None:
+                    record, record_end = codec.decode(buffer, cell_offset + self.cell_header.size)
+                else:
+                    record = decode_columns(buffer, cell_offset + self.cell_header.size)
+                page_records.append([row_id] + record)
+        except (ValueError, struct.error):
             print("Error while reading the page")
             return False, page_records
-        else:
-            #print("Page read successful")
-            return True, page_records
-
-    def update_root_node(self, table_file_path, updated_root,root_offset):
-        with open(table_file_path, "r+b") as fh:
-            fh.seek(root_offset, 0)
-            root_node_size = len(updated_root)
-            root_node = struct.pack('i' * root_node_size, *updated_root)
-            fh.write(root_node)
+        return True, page_records
+
+    # Structured NumPy dtype of the rowid and the fixed width columns at the start of every leaf cell,
+    # in the byte order the cells are written in
+    def cell_dtype(self, column_dtype):
+        dtype = self.cell_dtypes.get(tuple(column_dtype))
+        if dtype is None:
+            codec = get_codec(column_dtype[1:])
+            fields = [("row_id", ">" + self.cell_header.format[-1])]
+            for index in codec.fixed_columns:
+                fields.append(("c" + str(index + 1), ">" + struct_format_string[codec.col_dtype[index]]))
+            dtype = np.dtype(fields)
+            self.cell_dtypes[tuple(column_dtype)] = dtype
+        return dtype
+
+    # The given columns of every cell of a leaf page as NumPy arrays keyed by schema index. The rowid and the
+    # fixed width columns of all cells are gathered out of a copy of the page in one step and viewed through
+    # cell_dtype, text columns become object arrays decoded cell by cell.
+    def read_page_arrays(self, table_file_path, column_dtype, page_number, columns):
+        pager = self.pager(table_file_path)
+        buffer, page_offset = pager.page_buffer(page_number)
+        page = np.frombuffer(bytes(buffer[page_offset:page_offset + pager.page_size]), np.uint8)
+        page_type, cells, content_start, right_sibling, parent = self.page_header.unpack_from(page, 0)
+        dtype = self.cell_dtype(column_dtype)
+        pointers = np.frombuffer(page, ">u2", cells, self.page_header.size).astype(np.intp)
+        # the rowid sits right after the payload size in the cell header
+        row_id_offset = self.cell_header.size - dtype["row_id"].itemsize
+        try:
+            fixed = page[(pointers + row_id_offset)[:, None] + np.arange(dtype.itemsize)].view(dtype).ravel()
+        except IndexError:
+            print("Error while reading the page")
+            return False, {}
+        arrays = {}
+        for column in columns:
+            name = "row_id" if column == 0 else "c" + str(column)
+            if name in dtype.names:
+                # widened to native types so comparisons behave as they do on the decoded Python values
+                arrays[column] = fixed[name].astype(np.float64 if dtype[name].kind == "f" else np.int64)
+        text_columns = [column for column in columns if column not in arrays]
+        if text_columns:
+            ret_val, records = self.read_page(table_file_path, column_dtype, page_number, text_columns)
+            if not ret_val:
+                return False, {}
+            for column in text_columns:
+                arrays[column] = np.array([record[column] for record in records], object)
+        return True, arrays
+
+    # Write every dirty cached page of the table file back to disk
+    def flush(self, table_file_path):
+        self.pager(table_file_path).flush()
@@ -0,0 +1,317 @@
+import atexit
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+from IoWorker import get_io_worker, read_ahead, stop_io_worker, write_ranges
+from Wal import get_wal, wals
+
+
+# Buffer pool sitting in front of a single table file. Keeps one long-lived file handle,
+# caches fixed-size pages in memory with LRU eviction and writes dirty pages back on flush.
+# Only the byte ranges of a page that were written to are tracked, logged and written back.
+# A pager with a write-ahead log never writes a page changed since the last commit to its file;
+# committed pages are written back once the log holding them is durable. With an I/O worker running,
+# evicted pages are written back by the worker; until a write lands the page is served from its copy.
+class Pager:
+    cache_pages = 256
+
+    def __init__(self, file_path, page_size=512, cache_pages=None, wal=None):
+        self.file_path = file_path
+        self.page_size = page_size
+        self.cache_pages = cache_pages or Pager.cache_pages
+        # unbuffered: the pager is the buffer, and I/O worker threads write to the same file
+        self.fh = open(file_path, "r+b", buffering=0)
+        self.fh.seek(0, 2)
+        # logical end of the table file, including bytes that are only written to the cache yet
+        self.file_size = self.fh.tell()
+        self.pages = OrderedDict()
+        self.pins = {}
+        # page number -> changed byte ranges of the page, since the last commit
+        self.dirty = {}
+        # page number -> byte ranges committed to the write-ahead log but not written back to the file yet
+        self.logged = {}
+        self.map = None
+        self.mapped_size = 0
+        # page number -> image of a page being written back by the I/O worker
+        self.writing = {}
+        self.writing_lock = threading.Lock()
+        self.wal = wal
+        if wal is not None:
+            wal.attach(self)
+
+    # Return the cached image of a page, reading it from disk on a miss
+    def get_page(self, page_number):
+        page = self.pages.get(page_number)
+        if page is not None:
+            self.pages.move_to_end(page_number)
+            return page
+        page = self.writing.get(page_number)
+        if page is not None:
+            page = bytearray(page)
+        else:
+            self.fh.seek(page_number * self.page_size, 0)
+            page = bytearray(self.fh.read(self.page_size))
+        if len(page) < self.page_size:
+            page += bytes(self.page_size - len(page))
+        self.pages[page_number] = page
+        self.evict()
+        return page
+
+    # Return (buffer, offset) from which a page can be decoded in place. Pages held in the cache are
+    # served from their bytearray, everything else straight from a read-only mmap of the file.
+    def page_buffer(self, page_number):
+        page = self.pages.get(page_number)
+        if page is None:
+            page = self.writing.get(page_number)
+        if page is not None:
+            return page, 0
+        page_end = (page_number + 1) * self.page_size
+        if page_end > self.mapped_size:
+            self.remap()
+        if page_end > self.mapped_size:
+            return self.get_page(page_number), 0
+        return self.map, page_number * self.page_size
+
+    # Ask the I/O worker to read a page into the operating system cache ahead of a scan
+    def prefetch(self, page_number):
+        worker = get_io_worker()
+        if worker is None or page_number in self.pages or page_number in self.writing:
+            return
+        if page_number * self.page_size < self.file_size:
+            worker.submit(read_ahead, self.fh.fileno(), page_number * self.page_size, self.page_size, wait=False)
+
+    def remap(self):
+        disk_size = os.fstat(self.fh.fileno()).st_size
+        if disk_size == self.mapped_size:
+            return
+        # the old mapping is not closed here, callers may still be decoding from it; it goes away with
+        # its last reference
+        self.map = None
+        self.mapped_size = 0
+        if disk_size > 0:
+            self.map = mmap.mmap(self.fh.fileno(), disk_size, access=mmap.ACCESS_READ)
+            self.mapped_size = disk_size
+
+    def pin(self, page_number):
+        page = self.get_page(page_number)
+        self.pins[page_number] = self.pins.get(page_number, 0) + 1
+        return page
+
+    def unpin(self, page_number, is_dirty=False):
+        if is_dirty:
+            self.mark_dirty(page_number, 0, self.page_size)
+        count = self.pins.get(page_number, 0) - 1
+        if count > 0:
+            self.pins[page_number] = count
+        else:
+            self.pins.pop(page_number, None)
+            self.evict()
+
+    def mark_dirty(self, page_number, low, high):
+        ranges = self.dirty.get(page_number)
+        if ranges is None:
+            self.dirty[page_number] = [[low, high]]
+        else:
+            add_range(ranges, low, high)
+
+    # (file offset, bytes) of every range changed since the last commit, which from now on only waits to be
+    # written back
+    def take_dirty_ranges(self):
+        changes = []
+        for page_number in sorted(self.dirty):
+            page = self.pages[page_number]
+            logged = self.logged.setdefault(page_number, [])
+            for low, high in self.dirty[page_number]:
+                changes.append((page_number * self.page_size + low, bytes(page[low:high])))
+                add_range(logged, low, high)
+        self.dirty.clear()
+        return changes
+
+    # Drop least recently used unpinned pages until the cache fits, writing them back if dirty. Uncommitted
+    # pages of a pager with a write-ahead log stay in the cache on top of cache_pages.
+    def evict(self):
+        cache_pages = self.cache_pages
+        if self.wal is not None:
+            cache_pages += len(self.dirty)
+        if len(self.pages) <= cache_pages:
+            return
+        excess = len(self.pages) - cache_pages
+        victims = []
+        for page_number in self.pages:
+            if len(victims) == excess:
+                break
+            if page_number in self.pins or (self.wal is not None and page_number in self.dirty):
+                continue
+            victims.append(page_number)
+        worker = get_io_worker()
+        for page_number in victims:
+            if page_number in self.dirty or page_number in self.logged:
+                if worker is not None:
+                    self.write_back_in_background(worker, page_number)
+                else:
+                    self.write_back(page_number)
+            del self.pages[page_number]
+
+    def read(self, offset, size):
+        data = bytearray()
+        while size > 0:
+            page_number, page_offset = divmod(offset, self.page_size)
+            chunk = min(size, self.page_size - page_offset)
+            data += self.get_page(page_number)[page_offset:page_offset + chunk]
+            offset += chunk
+            size -= chunk
+        return bytes(data)
+
+    def write(self, offset, data):
+        end = offset + len(data)
+        position = 0
+        while position < len(data):
+            page_number, page_offset = divmod(offset + position, self.page_size)
+            chunk = min(len(data) - position, self.page_size - page_offset)
+            page = self.pin(page_number)
+            page[page_offset:page_offset + chunk] = data[position:position + chunk]
+            self.mark_dirty(page_number, page_offset, page_offset + chunk)
+            self.unpin(page_number)
+            position += chunk
+        self.file_size = max(self.file_size, end)
+        return end
+
+    # Write the changed ranges of a page to the file. Only the bytes below the logical end of file are
+    # written so the file never grows past it.
+    def write_back(self, page_number):
+        if page_number in self.writing:
+            get_io_worker().drain()
+        for offset, data in self.take_write_ranges(page_number):
+            self.fh.seek(offset, 0)
+            self.fh.write(data)
+
+    # (file offset, bytes) ranges of a page that still have to reach the file, once the log holding them
+    # is durable
+    def take_write_ranges(self, page_number):
+        if self.wal is not None:
+            self.wal.sync()
+        ranges = self.dirty.pop(page_number, [])
+        for low, high in self.logged.pop(page_number, []):
+            add_range(ranges, low, high)
+        page_offset = page_number * self.page_size
+        page = self.pages[page_number]
+        writes = []
+        for low, high in ranges:
+            high = min(high, self.file_size - page_offset)
+            if high > low:
+                writes.append((page_offset + low, bytes(page[low:high])))
+        return writes
+
+    def write_back_in_background(self, worker, page_number):
+        # two writes of one page in flight could land in either order
+        if page_number in self.writing:
+            worker.drain()
+        image = bytes(self.pages[page_number])
+        writes = self.take_write_ranges(page_number)
+        with self.writing_lock:
+            self.writing[page_number] = image
+        worker.submit(self.finish_write, page_number, image, writes)
+
+    def finish_write(self, page_number, image, writes):
+        try:
+            write_ranges(self.fh.fileno(), writes)
+        finally:
+            with self.writing_lock:
+                if self.writing.get(page_number) is image:
+                    del self.writing[page_number]
+
+    # Write the pages committed to the write-ahead log back to the file, without committing anything. Pages
+    # holding changes not committed yet are left alone.
+    def write_back_committed(self):
+        for page_number in sorted(self.logged):
+            if page_number not in self.dirty:
+                self.write_back(page_number)
+        if get_io_worker() is not None:
+            get_io_worker().drain()
+
+    # Write every changed page to the file, through the write-ahead log if the pager has one
+    def flush(self):
+        if self.wal is not None:
+            self.wal.commit()
+            self.wal.checkpoint()
+            return
+        for page_number in sorted(self.dirty):
+            self.write_back(page_number)
+        if get_io_worker() is not None:
+            get_io_worker().drain()
+
+    def close(self):
+        self.flush()
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.fh.close()
+        self.pages.clear()
+        self.pins.clear()
+        if self.wal is not None:
+            self.wal.detach(self)
+
+
+# Ranges closer than this many bytes are merged, one write of the gap is cheaper than another write call
+range_gap = 32
+
+
+# Add the byte range [low, high) to a sorted list of disjoint ranges
+def add_range(ranges, low, high):
+    position = 0
+    while position < len(ranges) and ranges[position][1] + range_gap < low:
+        position += 1
+    end = position
+    while end < len(ranges) and ranges[end][0] <= high + range_gap:
+        low = min(low, ranges[end][0])
+        high = max(high, ranges[end][1])
+        end += 1
+    ranges[position:end] = [[low, high]]
+
+
+pagers = {}
+
+
+def get_pager(file_path, page_size=512, wal_file_path=None):
+    pager = pagers.get(file_path)
+    if pager is None:
+        pager = Pager(file_path, page_size, wal=get_wal(wal_file_path) if wal_file_path else None)
+        pagers[file_path] = pager
+    return pager
+
+
+# Forget the pager of a file which is about to be recreated or removed
+def discard_pager(file_path):
+    pager = pagers.pop(file_path, None)
+    if pager is not None and not pager.fh.closed:
+        if os.path.exists(file_path):
+            pager.close()
+        else:
+            if get_io_worker() is not None:
+                get_io_worker().drain()
+            if pager.map is not None:
+                pager.map.close()
+            pager.fh.close()
+            if pager.wal is not None:
+                pager.wal.detach(pager)
+
+
+# Commit the changes of every table to its write-ahead log; pagers without a log write their pages back
+def commit_all():
+    for wal in list(wals.values()):
+        wal.commit()
+    for pager in pagers.values():
+        if pager.wal is None and not pager.fh.closed:
+            pager.flush()
+
+
+def flush_all():
+    stop_io_worker()
+    for pager in pagers.values():
+        if not pager.fh.closed:
+            pager.flush()
+
+
+atexit.register(flush_all)
@@ -0,0 +1,132 @@
+import math
+
+# Costs are counted in pages read in file order. A page read out of order costs RANDOM_PAGE_COST of those
+# and looking at one row ROW_COST.
+RANDOM_PAGE_COST = 4.0
+ROW_COST = 0.01
+# share of the rows a range is taken to match when the statistics of its column cannot tell
+DEFAULT_RANGE_SELECTIVITY = 1 / 3
+
+# Statistics of a column are a dict with "rows" (rows with a value), "distinct" (distinct values) and
+# "min" / "max", and once the table is analyzed "histogram", the bounds of an equi-depth histogram, and
+# "correlation", of the order of the values with the order of the rows in the table.
+
+
+# Index accesses a condition tree allows, one per condition on an indexed column ANDed in at the top level:
+#   ("lookup", column_index, keys)        for = and IN
+#   ("range", column_index, low, high)    for <, <=, >, >= and BETWEEN, None leaving a bound open
+# Keys and bounds are passed through convert(column_index, value) into their stored form. Ranges include
+# their bounds; the rows fetched are checked against the whole condition anyway.
+def index_accesses(condition, column_names, indexed_columns, convert):
+    if condition[0] == "and":
+        return index_accesses(condition[1], column_names, indexed_columns, convert) + \
+            index_accesses(condition[2], column_names, indexed_columns, convert)
+    if condition[0] not in ("compare", "in", "between") or condition[1] not in column_names:
+        return []
+    index = column_names.index(condition[1])
+    if index not in indexed_columns:
+        return []
+    if condition[0] == "in":
+        return [("lookup", index, sorted({convert(index, value) for value in condition[2]}))]
+    if condition[0] == "between":
+        return [("range", index, convert(index, condition[2]), convert(index, condition[3]))]
+    operator, value = condition[2], convert(index, condition[3])
+    if operator == "=":
+        return [("lookup", index, [value])]
+    if operator in ("<", "<="):
+        return [("range", index, None, value)]
+    if operator in (">", ">="):
+        return [("range", index, value, None)]
+    return []
+
+
+# Rows an index access is expected to fetch, from the statistics of its column
+def estimate_rows(access, statistics):
+    rows, distinct = statistics["rows"], statistics["distinct"]
+    if not rows:
+        return 0
+    if access[0] == "lookup":
+        return min(rows, len(access[2]) * rows / max(distinct, 1))
+    low, high = access[2], access[3]
+    smallest, largest = statistics["min"], statistics["max"]
+    if (low is not None and low > largest) or (high is not None and high < smallest) or \
+            (low is not None and high is not None and low > high):
+        return 0
+    if statistics.get("histogram"):
+        return rows * histogram_selectivity(statistics["histogram"], low, high)
+    if not all(isinstance(value, (int, float)) for value in (smallest, largest)):
+        return rows * DEFAULT_RANGE_SELECTIVITY
+    if largest == smallest:
+        return rows
+    low = smallest if low is None else max(low, smallest)
+    high = largest if high is None else min(high, largest)
+    # a range of whole numbers holds one value more than its width
+    width = high - low + (1 if isinstance(largest, int) else 0)
+    return min(rows, max(1, rows * width / (largest - smallest + (1 if isinstance(largest, int) else 0))))
+
+
+# Share of the rows between low and high (None leaving a bound open) by an equi-depth histogram, every bucket
+# holding the same share. Numbers are taken to spread evenly within a bucket, a bucket of other values that
+# the range only partly covers counts half.
+def histogram_selectivity(bounds, low, high):
+    if len(bounds) < 2:
+        return 1.0 if bounds and (low is None or low <= bounds[0]) and (high is None or bounds[0] <= high) else 0.0
+    covered = 0.0
+    for bucket_low, bucket_high in zip(bounds, bounds[1:]):
+        if (low is not None and low > bucket_high) or (high is not None and high < bucket_low):
+            continue
+        inside_low = low is None or low <= bucket_low
+        inside_high = high is None or high >= bucket_high
+        if inside_low and inside_high:
+            covered += 1
+        elif bucket_high == bucket_low:
+            covered += 1
+        elif isinstance(bucket_low, (int, float)) and isinstance(bucket_high, (int, float)):
+            start = bucket_low if inside_low else low
+            end = bucket_high if inside_high else high
+            covered += (end - start) / (bucket_high - bucket_low)
+        else:
+            covered += 0.5
+    return covered / (len(bounds) - 1)
+
+
+# Cost of reading scan_pages pages in order and looking at rows rows
+def sequential_scan_cost(scan_pages, rows):
+    return scan_pages + rows * ROW_COST
+
+
+# Cost of fetching rows rows through an index of the given depth from a table of table_rows rows in
+# table_pages pages. The rows are fetched in rowid order, so a leaf page is read once however many of its
+# rows match, and every row of the pages read is looked at. Rows spread all over the table are on as many
+# pages as rows picked at random would be (Cardenas' formula) and each page is sought; rows lying together
+# fill pages one after the other. The correlation of the column decides between the two, as its square.
+def index_scan_cost(rows, table_pages, table_rows, depth, correlation=0.0):
+    table_pages = max(table_pages, 1)
+    spread_pages = table_pages * (1 - (1 - 1 / table_pages) ** rows)
+    ordered_pages = min(table_pages, math.ceil(rows * table_pages / max(table_rows, 1)))
+    spread_cost = spread_pages * RANDOM_PAGE_COST
+    ordered_cost = RANDOM_PAGE_COST + max(ordered_pages - 1, 0) if ordered_pages else 0
+    weight = correlation ** 2
+    pages = spread_pages + weight * (ordered_pages - spread_pages)
+    return depth * RANDOM_PAGE_COST + spread_cost + weight * (ordered_cost - spread_cost) + \
+        pages * table_rows / table_pages * ROW_COST
+
+
+# Cheapest way to find the rows of a condition tree: an index access as given by index_accesses, or None
+# for a sequential scan of scan_pages of the table's table_pages pages. statistics and depths map the
+# indexed column indexes to the statistics and the depth of their index. Returns the access (or None), its
+# estimated rows and its cost.
+def choose_access(condition, column_names, statistics, depths, convert, table_pages, scan_pages, table_rows):
+    scan_rows = table_rows * scan_pages / max(table_pages, 1)
+    best = None, scan_rows, sequential_scan_cost(scan_pages, scan_rows)
+    for access in index_accesses(condition, column_names, set(statistics), convert):
+        rows = estimate_rows(access, statistics[access[1]])
+        cost = index_scan_cost(rows, table_pages, table_rows, depths[access[1]],
+                               statistics[access[1]].get("correlation", 0.0))
+        if access[0] == "lookup":
+            # one descent per key
+            cost += (len(access[2]) - 1) * depths[access[1]] * RANDOM_PAGE_COST
+        if cost < best[2]:
+            best = access, rows, cost
+    return best
+
@@ -0,0 +1,267 @@
+import re
+from operator import eq, ge, gt, le, lt, ne
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# WHERE clauses are kept as trees of tuples:
+#   ("compare", column, operator, value)   operator one of = <> < <= > >=
+#   ("in", column, values)
+#   ("between", column, low, high)
+#   ("null", column)
+#   ("not", condition), ("and", left, right), ("or", left, right)
+COMPARE_OPERATORS = {"=": "==", "<>": "!=", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+COMPARE_FUNCTIONS = {"=": eq, "<>": ne, "<": lt, "<=": le, ">": gt, ">=": ge}
+
+token_pattern = re.compile(r"\s*(?:('(?:[^']|'')*')|(\"[^\"]*\")|(<>|!=|<=|>=|=|<|>)|([(),])|([^\s(),=<>!'\"]+))")
+
+
+class ConditionSyntaxError(ValueError):
+    pass
+
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = token_pattern.match(text, position)
+        if match is None or match.end() == position:
+            raise ConditionSyntaxError("Unexpected character in condition: " + text[position:])
+        single_quoted, double_quoted, operator, punctuation, word = match.groups()
+        if single_quoted is not None:
+            tokens.append(("value", single_quoted[1:-1].replace("''", "'")))
+        elif double_quoted is not None:
+            tokens.append(("value", double_quoted[1:-1]))
+        elif operator is not None:
+            tokens.append(("operator", "<>" if operator == "!=" else operator))
+        elif punctuation is not None:
+            tokens.append((punctuation, punctuation))
+        else:
+            tokens.append(("word", word))
+        position = match.end()
+    return tokens
+
+
+# Value of an unquoted literal: an int or a float when it reads as one, the text itself otherwise
+def literal_value(word):
+    for convert in (int, float):
+        try:
+            return convert(word)
+        except ValueError:
+            pass
+    return word
+
+
+# Recursive descent parser, NOT binds tighter than AND which binds tighter than OR
+class ConditionParser:
+
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.position = 0
+
+    def parse(self):
+        condition = self.parse_or()
+        if self.position != len(self.tokens):
+            raise ConditionSyntaxError("Unexpected " + str(self.tokens[self.position][1]) + " in condition")
+        return condition
+
+    def peek_keyword(self, keyword):
+        if self.position < len(self.tokens):
+            kind, value = self.tokens[self.position]
+            return kind == "word" and value.lower() == keyword
+        return False
+
+    def accept_keyword(self, keyword):
+        if self.peek_keyword(keyword):
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, kind):
+        if self.position >= len(self.tokens) or self.tokens[self.position][0] != kind:
+            raise ConditionSyntaxError("Expected " + kind + " in condition")
+        value = self.tokens[self.position][1]
+        self.position += 1
+        return value
+
+    def parse_or(self):
+        condition = self.parse_and()
+        while self.accept_keyword("or"):
+            condition = ("or", condition, self.parse_and())
+        return condition
+
+    def parse_and(self):
+        condition = self.parse_not()
+        while self.accept_keyword("and"):
+            condition = ("and", condition, self.parse_not())
+        return condition
+
+    def parse_not(self):
+        if self.accept_keyword("not"):
+            return ("not", self.parse_not())
+        if self.position < len(self.tokens) and self.tokens[self.position][0] == "(":
+            self.position += 1
+            condition = self.parse_or()
+            self.expect(")")
+            return condition
+        return self.parse_predicate()
+
+    def parse_predicate(self):
+        column = self.expect("word").lower()
+        if self.accept_keyword("is"):
+            negate = self.accept_keyword("not")
+            if not self.accept_keyword("null"):
+                raise ConditionSyntaxError("Expected NULL after IS")
+            return ("not", ("null", column)) if negate else ("null", column)
+        negate = self.accept_keyword("not")
+        if self.accept_keyword("in"):
+            self.expect("(")
+            values = [self.parse_value()]
+            while self.position < len(self.tokens) and self.tokens[self.position][0] == ",":
+                self.position += 1
+                values.append(self.parse_value())
+            self.expect(")")
+            condition = ("in", column, values)
+        elif self.accept_keyword("between"):
+            low = self.parse_value()
+            if not self.accept_keyword("and"):
+                raise ConditionSyntaxError("Expected AND in BETWEEN")
+            condition = ("between", column, low, self.parse_value())
+        elif negate:
+            raise ConditionSyntaxError("Expected IN or BETWEEN after NOT")
+        else:
+            operator = self.expect("operator")
+            return ("compare", column, operator, self.parse_value())
+        return ("not", condition) if negate else condition
+
+    def parse_value(self):
+        if self.position >= len(self.tokens) or self.tokens[self.position][0] not in ("value", "word"):
+            raise ConditionSyntaxError("Expected a value in condition")
+        kind, value = self.tokens[self.position]
+        self.position += 1
+        return literal_value(value) if kind == "word" else value
+
+
+# Parse the text of a WHERE clause into a condition tree, None when it is not valid
+def parse_condition(text):
+    try:
+        return ConditionParser(text).parse()
+    except ConditionSyntaxError as e:
+        print(str(e))
+        return None
+
+
+# Condition tree of the single column condition the table methods have always taken
+def simple_condition(column, operator, value, is_not=False):
+    condition = ("compare", column, operator, value)
+    return ("not", condition) if is_not else condition
+
+
+# Copy of a condition tree with every column name passed through rename
+def rename_columns(condition, rename):
+    if condition[0] in ("and", "or"):
+        return (condition[0], rename_columns(condition[1], rename), rename_columns(condition[2], rename))
+    if condition[0] == "not":
+        return ("not", rename_columns(condition[1], rename))
+    return (condition[0], rename(condition[1])) + tuple(condition[2:])
+
+
+# Compile a condition tree into one function of a row ([row_id] + values) returning whether the row matches.
+# Column names are resolved to row indexes and every value is passed through convert(column_index, value),
+# turning it into its stored form, once. A comparison with a NULL value never matches. Returns the function
+# and the set of column indexes it reads.
+def compile_condition(condition, column_names, convert=lambda index, value: value):
+    constants = {}
+    columns = set()
+
+    def constant(value):
+        name = "c" + str(len(constants))
+        constants[name] = value
+        return name
+
+    def column_index(column):
+        if column not in column_names:
+            raise ConditionSyntaxError("Unknown column " + str(column) + " in condition")
+        index = column_names.index(column)
+        columns.add(index)
+        return index
+
+    def source(node):
+        kind = node[0]
+        if kind in ("and", "or"):
+            return "(" + source(node[1]) + " " + kind + " " + source(node[2]) + ")"
+        if kind == "not":
+            return "(not " + source(node[1]) + ")"
+        index = column_index(node[1])
+        value = "row[" + str(index) + "]"
+        if kind == "null":
+            return "(" + value + " is None)"
+        if kind == "in":
+            return "(" + value + " in " + constant(frozenset(convert(index, item) for item in node[2])) + ")"
+        if kind == "between":
+            return "(" + value + " is not None and " + constant(convert(index, node[2])) + " <= " + value + " <= " + \
+                constant(convert(index, node[3])) + ")"
+        if kind == "compare" and node[2] in COMPARE_OPERATORS:
+            return "(" + value + " is not None and " + value + " " + COMPARE_OPERATORS[node[2]] + " " + \
+                constant(convert(index, node[3])) + ")"
+        raise ConditionSyntaxError("Unsupported condition " + str(node[0]))
+
+    expression = source(condition)
+    return eval("lambda row: " + expression, constants), columns
+
+
+# Compare a column array with a value. Object arrays (text columns) are compared value by value so that a
+# NULL never matches, the same as in compiled row conditions.
+def compare_array(values, compare, value):
+    if values.dtype == object:
+        return np.fromiter((item is not None and compare(item, value) for item in values), bool, len(values))
+    return compare(values, value)
+
+
+# Compile a condition tree into one function of a dict of column arrays (keyed by row index, one entry per
+# row) returning a boolean mask of the matching rows. Matches exactly the rows the function returned by
+# compile_condition matches. Returns the function and the set of column indexes it reads.
+def compile_mask(condition, column_names, convert=lambda index, value: value):
+    columns = set()
+
+    def column_index(column):
+        if column not in column_names:
+            raise ConditionSyntaxError("Unknown column " + str(column) + " in condition")
+        index = column_names.index(column)
+        columns.add(index)
+        return index
+
+    def build(node):
+        kind = node[0]
+        if kind == "and":
+            left, right = build(node[1]), build(node[2])
+            return lambda arrays: left(arrays) & right(arrays)
+        if kind == "or":
+            left, right = build(node[1]), build(node[2])
+            return lambda arrays: left(arrays) | right(arrays)
+        if kind == "not":
+            inner = build(node[1])
+            return lambda arrays: ~inner(arrays)
+        index = column_index(node[1])
+        if kind == "null":
+            return lambda arrays: np.fromiter((item is None for item in arrays[index]), bool, len(arrays[index])) \
+                if arrays[index].dtype == object else np.zeros(len(arrays[index]), bool)
+        if kind == "in":
+            values = frozenset(convert(index, item) for item in node[2])
+            # only numbers can equal the values of a numeric column
+            numbers = [item for item in values if isinstance(item, (int, float))]
+            return lambda arrays: np.fromiter((item in values for item in arrays[index]), bool, len(arrays[index])) \
+                if arrays[index].dtype == object else np.isin(arrays[index], numbers)
+        if kind == "between":
+            low, high = convert(index, node[2]), convert(index, node[3])
+            return lambda arrays: compare_array(arrays[index], ge, low) & \
+                compare_array(arrays[index], le, high)
+        if kind == "compare" and node[2] in COMPARE_FUNCTIONS:
+            compare, value = COMPARE_FUNCTIONS[node[2]], convert(index, node[3])
+            return lambda arrays: compare_array(arrays[index], compare, value)
+        raise ConditionSyntaxError("Unsupported condition " + str(node[0]))
+
+    return build(condition), columns
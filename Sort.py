@@ -0,0 +1,105 @@
+import heapq
+import itertools
+import pickle
+import sys
+import tempfile
+
+# rows pickled together when a sorted run is written to a spill file
+SPILL_CHUNK_ROWS = 1000
+
+
+# Wraps a value so that it sorts in reverse, for the descending keys of a multi-key sort
+class Descending:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+# Sort key of rows on the values at indexes, descending[i] telling the direction of the i-th key. NULL
+# values sort after all others in either direction.
+def sort_key(indexes, descending):
+    def key(row):
+        values = []
+        for index, reverse in zip(indexes, descending):
+            value = row[index]
+            if reverse:
+                # numbers are negated, which is much cheaper than wrapping them
+                values.append((value is None, -value if isinstance(value, (int, float)) else Descending(value)))
+            else:
+                values.append((value is None, value))
+        return values
+    return key
+
+
+# Rough number of bytes a row takes up in memory
+def row_size(row):
+    return sys.getsizeof(row) + sum(map(sys.getsizeof, row))
+
+
+# The first count rows in key order, kept in a bounded heap rather than sorting every row
+def top_rows(rows, key, count):
+    return heapq.nsmallest(count, rows, key=key)
+
+
+# Sort rows arriving in batches (lists of rows). Rows are collected until they take up memory_limit
+# bytes, that much is sorted and written as a run to a temporary file in spill_directory, and the runs are
+# merged at the end. Rows that fit the memory limit are sorted in memory without touching the disk.
+# Equal rows keep their order, so the result is the one sorted() would give.
+def external_sort(batches, key, memory_limit, spill_directory):
+    runs = []
+    rows = []
+    size = 0
+    try:
+        for batch in batches:
+            rows += batch
+            size += sum(map(row_size, batch))
+            if size >= memory_limit:
+                rows.sort(key=key)
+                runs.append(spill_run(rows, spill_directory))
+                rows = []
+                size = 0
+        rows.sort(key=key)
+        if not runs:
+            yield from rows
+            return
+        runs.append(rows)
+        yield from heapq.merge(*[run if isinstance(run, list) else read_run(run) for run in runs], key=key)
+    finally:
+        for run in runs:
+            if not isinstance(run, list):
+                run.close()
+
+
+# Write sorted rows to an anonymous temporary file, removed as soon as it is closed
+def spill_run(rows, spill_directory):
+    run = tempfile.TemporaryFile(dir=spill_directory)
+    for start in range(0, len(rows), SPILL_CHUNK_ROWS):
+        pickle.dump(rows[start:start + SPILL_CHUNK_ROWS], run, pickle.HIGHEST_PROTOCOL)
+    run.seek(0)
+    return run
+
+
+def read_run(run):
+    while True:
+        try:
+            chunk = pickle.load(run)
+        except EOFError:
+            return
+        yield from chunk
+
+
+# Rows regrouped into lists of at most size rows, for the page at a time operators after a sort
+def batches(rows, size=SPILL_CHUNK_ROWS):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
@@ -0,0 +1,154 @@
+import json
+import math
+import os
+import random
+from operator import itemgetter
+
+# values of a column sampled for its histogram, and buckets of the histogram
+SAMPLE_SIZE = 10000
+HISTOGRAM_BUCKETS = 32
+# HyperLogLog registers are 2 ** HLL_PRECISION, for a standard error of about 1.6%
+HLL_PRECISION = 12
+MASK_64 = (1 << 64) - 1
+
+
+# Mix the bits of a 64 bit number (the splitmix64 finalizer), as Python hashes small ints to themselves
+def mix_64(x):
+    x = (x + 0x9E3779B97F4A7C15) & MASK_64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK_64
+    return x ^ (x >> 31)
+
+
+# Distinct count estimate in a fixed 2 ** precision bytes, whatever the number of values
+class HyperLogLog:
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, values):
+        registers, precision = self.registers, self.precision
+        shift = 64 - precision
+        for value in values:
+            x = mix_64(hash(value) & MASK_64)
+            index = x >> shift
+            rank = shift - (x & ((1 << shift) - 1)).bit_length() + 1
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is closer for small counts
+            estimate = m * math.log(m / zeros)
+        return estimate
+
+
+# Statistics of one column gathered in a single pass over batches of its values, in the order of the rows
+# in the table: the counts, a HyperLogLog sketch, min and max, and a reservoir sample (Li's algorithm L,
+# which skips over the values it does not take) of values and their row positions. The equi-depth
+# histogram and the correlation of the values with the row order are worked out from the sample.
+class ColumnStatistics:
+
+    def __init__(self, sample_size=SAMPLE_SIZE, seed=0):
+        self.rows = 0
+        self.nulls = 0
+        self.sketch = HyperLogLog()
+        self.min = None
+        self.max = None
+        self.sample = []
+        self.sample_size = sample_size
+        self.random = random.Random(seed)
+        self.weight = math.exp(math.log(self.random.random()) / sample_size)
+        self.next_sample = sample_size + self.skip()
+
+    def skip(self):
+        return int(math.log(self.random.random()) / math.log(1 - self.weight))
+
+    def add(self, values):
+        start = self.rows + self.nulls
+        present = [value for value in values if value is not None]
+        self.nulls += len(values) - len(present)
+        if not present:
+            return
+        self.sketch.add(present)
+        low, high = min(present), max(present)
+        if self.min is None or low < self.min:
+            self.min = low
+        if self.max is None or high > self.max:
+            self.max = high
+        seen = self.rows
+        self.rows += len(present)
+        if len(self.sample) >= self.sample_size and self.next_sample >= self.rows:
+            return
+        present = [(value, start + position) for position, value in enumerate(values) if value is not None]
+        if len(self.sample) < self.sample_size:
+            taken = present[:self.sample_size - len(self.sample)]
+            self.sample += taken
+            seen += len(taken)
+            present = present[len(taken):]
+        while self.next_sample < self.rows:
+            self.sample[self.random.randrange(self.sample_size)] = present[self.next_sample - seen]
+            self.weight *= math.exp(math.log(self.random.random()) / self.sample_size)
+            self.next_sample += self.skip() + 1
+
+    # Bucket boundaries of an equi-depth histogram: buckets + 1 values with about the same number of rows
+    # between every two of them, the first and last being the exact min and max
+    def histogram(self, buckets=HISTOGRAM_BUCKETS):
+        if not self.sample:
+            return []
+        sample = sorted(value for value, position in self.sample)
+        buckets = min(buckets, len(sample))
+        bounds = [sample[(len(sample) - 1) * i // buckets] for i in range(buckets + 1)]
+        bounds[0], bounds[-1] = self.min, self.max
+        return bounds
+
+    # Correlation of the order of the values with the order of their rows, from -1 to 1. Near 1 (or -1) the
+    # rows of a range of values lie together in the table, near 0 they are spread all over it.
+    def correlation(self):
+        positions = [position for value, position in sorted(self.sample, key=itemgetter(0))]
+        if len(positions) < 2:
+            return 1.0
+        middle_rank, middle_position = (len(positions) - 1) / 2, sum(positions) / len(positions)
+        covariance = sum((rank - middle_rank) * (position - middle_position)
+                         for rank, position in enumerate(positions))
+        rank_variance = sum((rank - middle_rank) ** 2 for rank in range(len(positions)))
+        position_variance = sum((position - middle_position) ** 2 for position in positions)
+        return covariance / math.sqrt(rank_variance * position_variance) if position_variance else 1.0
+
+    def result(self):
+        # the sketch cannot count more distinct values than there are rows
+        return {"rows": self.rows, "nulls": self.nulls, "distinct": min(self.rows, round(self.sketch.estimate())),
+                "min": self.min, "max": self.max, "histogram": self.histogram(), "correlation": self.correlation()}
+
+
+# The catalog keeps the statistics ANALYZE gathered, by table name, in a JSON file in the data directory
+def catalog_file_path(data_dir):
+    return os.path.join(data_dir, "catalog.json")
+
+
+def read_catalog(data_dir):
+    try:
+        with open(catalog_file_path(data_dir)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+# Statistics of a table, None when it has not been analyzed
+def table_statistics(data_dir, table_name):
+    return read_catalog(data_dir).get(table_name)
+
+
+# Store the statistics of a table in the catalog, the file being replaced as a whole
+def write_table_statistics(data_dir, table_name, statistics):
+    catalog = read_catalog(data_dir)
+    catalog[table_name] = statistics
+    temporary_file_path = catalog_file_path(data_dir) + ".tmp"
+    with open(temporary_file_path, "w") as f:
+        json.dump(catalog, f, indent=1)
+    os.replace(temporary_file_path, catalog_file_path(data_dir))
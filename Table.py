@@ -1,75 +1,92 @@
+import csv
+import itertools
 import math
+import mmap
 import os
+import struct
 import datetime
 import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 from tabulate import tabulate
+from Codec import get_codec, struct_format_string
 from Page import Page
+from Pager import commit_all, discard_pager
+from Planner import choose_access
+from Index import build_tree, compact_index_logs, index_columns, log_index_changes, read_tree_from_file, \
+    tree_changed, write_tree_to_file
+from Join import MAX_PARTITIONS, hash_join
+from Predicate import compile_condition, compile_mask, rename_columns, simple_condition
+from Sort import batches, external_sort, sort_key, top_rows
+from Statistics import ColumnStatistics, table_statistics, write_table_statistics
 
 
 class Table(Page):
-    page_size = 512
     datePattern = "yyyy-MM-dd_HH:mm:ss"
+    # filter SELECT scans a page at a time on NumPy column arrays instead of row by row, for every query of the
+    # session unless a query says otherwise
+    vectorized = False
+    # bytes of rows an ORDER BY sorts in memory, beyond that sorted runs are spilled to files under data/
+    sort_memory = 64 * 1024 * 1024
+    # bytes of build rows a join holds in memory, beyond that both sides are partitioned to files under data/
+    join_memory = 64 * 1024 * 1024
+    aggregate_functions = ("count", "sum", "min", "max", "avg")
+    numeric_dtypes = ("tinyint", "smallint", "int", "bigint", "long", "float", "double", "year")
+    # worker processes of a parallel scan, None for one per CPU and 1 to always scan serially. Scans of less
+    # than parallel_scan_min_size bytes of leaf pages run serially, as do vectorized scans.
+    scan_workers = None
+    parallel_scan_min_size = 8 * 1024 * 1024
+    # runs of leaf pages handed out per worker, more runs even out the work between the workers
+    parallel_scan_runs = 4
 
     def __init__(self, table_name):
         self.table_name = table_name
         self.data_dir = os.path.join(os.getcwd(), 'data')
         self.table_dir = self.data_dir + "/" + self.table_name
         self.table_file_path = self.table_dir + "/" + self.table_name + ".tbl"
-        self.dtype_bytes = {"null": 0, "tinyint": 2, "smallint": 2, "int": 4, "bigint": 8, "long": 8,
-                            "float": 4, "double": 8, "year": 4, "time": 4, "datetime": 4, "date": 4}
-        self.struct_format_string = {"null": "x", "tinyint": 'b', "smallint": 'h', "int": 'i',
-                                     "bigint": "q", "long": "q", "float": "f", "double": "d", "year": "i", "time": "I",
-                                     "datetime": "I", "date": "I"}
+        self.struct_format_string = struct_format_string
         self.accepted_operator = ["=", ">", ">=", "<", "<=", "<>"]
 
-    # Create a table if the table already didn't exists
-    def create_table(self, table_name):
+    # Create a table if the table already didn't exists. The page size of the table file is fixed here,
+    # any power of two from 512 bytes to 64 KiB.
+    def create_table(self, table_name, page_size=None):
         self.__init__(table_name)
+        page_size = page_size or self.page_size
+        if not self.valid_page_size(page_size):
+            print("Page size must be a power of two between 512 and 65536 bytes")
+            return None
         try:
             if not os.path.isdir(self.data_dir):
                 os.makedirs(self.table_dir)
             else:
                 os.mkdir(self.table_dir)
-            with open(self.table_file_path, 'wb') as f:
-                print(self.table_name + " table is created")
-                return self.table_file_path
+            for file_path in (self.table_file_path, self.fsm_file_path(self.table_file_path)):
+                discard_pager(file_path)
+                open(file_path, 'wb').close()
+            self.init_table_file(self.table_file_path, page_size)
+            self.commit()
+            print(self.table_name + " table is created")
+            return self.table_file_path
         except FileExistsError:
             print("Table already exists..You cannot create the same table again!")
 
+    # Commit the pages changed by the last statements to the write-ahead logs of the tables, together with the
+    # changes of their indexes. The logs are synced to disk in groups of commits. An index whose log has grown
+    # too long is written out again after them.
+    def commit(self):
+        log_index_changes()
+        commit_all()
+        compact_index_logs()
+
     # Check if the tale exist in the database already by checking the catalog
     def check_if_table_exists(self, table_path):
         return os.path.exists(table_path)
 
-    def values_to_fstring(self, col_dtype, values):
-        fstring = " "
-        for dt in range(0, len(col_dtype)):
-            if col_dtype[dt] in self.struct_format_string.keys():
-                fstring += self.struct_format_string[col_dtype[dt]]
-            elif col_dtype[dt] == "text":
-                fstring += str(len(values[dt])) + "s"
-            fstring += " "
-        fstring = fstring.strip()
-        return fstring
-
-    def schema_to_fstring(self, col_dtype):
-        fstring = " "
-        for dt in range(0, len(col_dtype)):
-            if col_dtype[dt] in self.struct_format_string.keys():
-                fstring += self.struct_format_string[col_dtype[dt]]
-            elif col_dtype[dt] == "text":
-                fstring += "s"
-        fstring = fstring.strip()
-        return fstring
-
-    def string_encoding(self, record):
-        r_values = []
-        for r in record:
-            if type(r) is str:
-                r_values.append(r.encode('utf-8'))
-            else:
-                r_values.append(r)
-        return r_values
-
     def time_to_milli(self, t):
         hours, minutes, seconds = (["0", "0"] + t.split(":"))[-3:]
         hours = int(hours)
@@ -106,6 +123,8 @@ class Table(Page):
 
     def string_from_date_time(self, col_dtype, values):
         for dt in range(0, len(col_dtype)):
+            if values[dt] is None:
+                continue
             if col_dtype[dt] == "year":
                 values[dt] = str(values[dt])
             elif col_dtype[dt] == "time":
@@ -128,98 +147,32 @@ class Table(Page):
                 values[dt] = self.date_time_epoch_to_bytes(values[dt], "datetime")
         return values
 
-    def explicit_type_conv(self, col_dtype, values):
-        if len(col_dtype) == len(values):
-            for dt in range(0, len(col_dtype)):
-                if col_dtype[dt] == "float":
-                    values[dt] == float(values[dt])
-                elif col_dtype[dt] == "int":
-                    values[dt] == int(values[dt])
-        else:
-            print("Error while type conversion")
-        return values
-
-    def insert_into_table(self, table_name, values):
+    def insert_into_table(self, table_name, values, commit=True):
         self.__init__(table_name)
         table_exists = self.check_if_table_exists(self.table_file_path)
         if not table_exists:
             print(self.table_name + " is not exists in the DavisBase...Please create a table first")
             return False
         # print("Table is existing")
-        root_node = self.get_root_node(self.table_file_path)
-        # print("returned root node is", root_node)
-
         col_dtype, col_constraint, column_names = self.scheme_dtype_constraint()
         dtype_wo_pri = col_dtype[1:]
-        for val in range(0, len(values)):
-            if dtype_wo_pri[val] == "text":
-                values[val] = (values[val] + ">x")
-
+        codec = get_codec(dtype_wo_pri)
         values = self.date_time_conv(dtype_wo_pri, values)
-        record_payload = self.calculate_payload_size([0] + values)
+        record = codec.encode(values)
         # check the number of pages in the table
-        if record_payload > 512:
-            print("Record size is greater than 512 bytes..Cannot accommodate the record in the table")
-        # Checking if the left-leaf node exists
-        page_number = root_node[-3]
-        page_total_record = root_node[-2]
-        page_last_rowid = root_node[-1]
-        col_dtype, col_constraint, column_names = self.scheme_dtype_constraint()
-        insert_success = False
-        if page_last_rowid == 0 and record_payload < 512:
-            row_id = 1
-            record = self.string_encoding([row_id] + values)
-            page_offset = page_number * self.page_size
-            fstring = self.values_to_fstring(col_dtype, record)
-            record = self.explicit_type_conv(col_dtype, record)
-            #print("Creating1 new record", page_number, page_offset, record, fstring)
-            insert_success, temp_var = self.write_to_page(self.table_file_path, page_number, page_offset, record,
-                                                          fstring,
-                                                          record_payload)
-            if insert_success:
-                root_node_len = len(root_node)
-                if root_node_len == 3:
-                    root_offset = 0
-                self.update_root_node(self.table_file_path, [page_number, page_total_record + 1, row_id], root_offset)
-        else:
-            page_filled_size = self.check_page_size(self.table_file_path, page_number)
-            # print("Filled Page size", page_filled_size)
-            page_size_availability = self.page_size - page_filled_size
-            # print("Page size availability", page_size_availability)
-            if record_payload <= page_size_availability:
-                page_offset = (page_filled_size) + page_number * self.page_size
-                record = self.string_encoding([page_last_rowid + 1] + values)
-                fstring = self.values_to_fstring(col_dtype, record)
-                #print("Creating2 new record", page_number, page_offset, record, fstring)
-                record = self.explicit_type_conv(col_dtype, record)
-                insert_success, temp_var = self.write_to_page(self.table_file_path, page_number, page_offset, record,
-                                                              fstring,
-                                                              record_payload)
-                if insert_success:
-                    root_node_len = len(root_node)
-                    if root_node_len == 3:
-                        root_offset = 0
-                    else:
-                        root_offset = ((root_node_len // 3) - 1) * 12
-                    self.update_root_node(self.table_file_path,
-                                          [page_number, page_total_record + 1, page_last_rowid + 1], root_offset)
-            else:
-                # print("Creating new page")
-                new_page_number = page_number + 1
-                new_page_rowid = page_last_rowid + 1
-                page_total_record = 1
-                page_offset = new_page_number * self.page_size
-                record = self.string_encoding([new_page_rowid] + values)
-                fstring = self.values_to_fstring(col_dtype, record)
-                #print("Creating3 new record", page_number, page_offset, record, fstring)
-                record = self.explicit_type_conv(col_dtype, record)
-                insert_success, temp_var = self.write_to_page(self.table_file_path, new_page_number, page_offset,
-                                                              record,
-                                                              fstring, record_payload)
-                if insert_success:
-                    root_offset = ((len(root_node)) // 3) * 12
-                    self.update_root_node(self.table_file_path,
-                                          [new_page_number, page_total_record, new_page_rowid], root_offset)
+        if len(record) > self.max_record_size(self.table_file_path):
+            print("Record size is greater than " + str(self.max_record_size(self.table_file_path)) +
+                  " bytes..Cannot accommodate the record in the table")
+            return False
+        root_page, last_rowid = self.get_root_node(self.table_file_path)
+        row_id = last_rowid + 1
+        #print("Creating new record", row_id, record)
+        insert_success = self.insert_row(self.table_file_path, row_id, record)
+        if insert_success:
+            self.update_root_node(self.table_file_path, last_rowid=row_id)
+            self.index_rows([[row_id] + values], self.table_indexes(column_names), column_names)
+            if commit:
+                self.commit()
         if insert_success:
             print("Record has been successfully added")
             return True
@@ -227,110 +180,345 @@ class Table(Page):
             print("Error occurred while adding new record")
             return False
 
-    def traverse_tree(self, table_name):
+    # Convert a batch of rows column by column to the values stored on disk. Date and time strings repeat
+    # a lot in bulk loads, so every distinct string is parsed only once per batch.
+    def convert_rows(self, col_dtype, rows):
+        for row in rows:
+            if len(row) != len(col_dtype):
+                print("Expected " + str(len(col_dtype)) + " values but got " + str(len(row)) + ": " + str(row))
+                return None
+        columns = [list(column) for column in zip(*rows)]
+        for dt in range(0, len(col_dtype)):
+            if col_dtype[dt] in ("tinyint", "smallint", "int", "bigint", "long", "year"):
+                columns[dt] = [int(value) for value in columns[dt]]
+            elif col_dtype[dt] in ("float", "double"):
+                columns[dt] = [float(value) for value in columns[dt]]
+            elif col_dtype[dt] in ("time", "date", "datetime"):
+                converted = {}
+                for value in columns[dt]:
+                    if value not in converted and isinstance(value, str):
+                        converted[value] = self.date_time_conv([col_dtype[dt]], [value])[0]
+                columns[dt] = [converted.get(value, value) for value in columns[dt]]
+        return [list(row) for row in zip(*columns)]
+
+    # Encode a batch of rows (without row_id) into records, None if a row cannot be stored
+    def encode_rows(self, col_dtype, rows):
+        try:
+            rows = self.convert_rows(col_dtype[1:], rows)
+        except ValueError as e:
+            print("Invalid value in batch: " + str(e))
+            return None
+        if rows is None:
+            return None
+        codec = get_codec(col_dtype[1:])
+        records = []
+        for values in rows:
+            record = codec.encode(values)
+            if len(record) > self.max_record_size(self.table_file_path):
+                print("Record size is greater than " + str(self.max_record_size(self.table_file_path)) +
+                      " bytes..Cannot accommodate the record in the table")
+                return None
+            records.append(record)
+        return records
+
+    # Insert a batch of rows. Rows are packed into leaf page images in memory, every filled page is written
+    # with a single write and the file header is updated once for the whole batch.
+    def insert_many(self, table_name, rows):
+        self.__init__(table_name)
+        table_exists = self.check_if_table_exists(self.table_file_path)
+        if not table_exists:
+            print(self.table_name + " is not exists in the DavisBase...Please create a table first")
+            return False
+        col_dtype, col_constraint, column_names = self.scheme_dtype_constraint()
+        records = self.encode_rows(col_dtype, rows)
+        if records is None:
+            return False
+        self.append_records(records)
+        self.commit()
+        print(str(len(records)) + " records have been successfully added")
+        return True
+
+    # Append encoded records behind the last rowid of the table
+    def append_records(self, records):
+        root_page, last_rowid = self.get_root_node(self.table_file_path)
+        col_dtype, col_constraint, column_names = self.scheme_dtype_constraint()
+        indexes = self.table_indexes(column_names)
+        if indexes:
+            codec = get_codec(col_dtype[1:])
+            self.index_rows([[row_id] + codec.decode(record, 0)[0] for row_id, record in
+                             enumerate(records, last_rowid + 1)], indexes, column_names)
+        cells = (self.leaf_cell(row_id, record) for row_id, record in enumerate(records, last_rowid + 1))
+        last_rowid = self.append_cells(self.table_file_path, cells)
+        if last_rowid is not None:
+            self.update_root_node(self.table_file_path, last_rowid=last_rowid)
+
+    # Bulk load a CSV file into the table. The file is streamed in chunks of chunk_size rows, each chunk is
+    # type converted as a batch and appended with the bulk page writer. A first line naming the columns is
+    # skipped. Returns the number of rows copied.
+    def copy_from(self, table_name, csv_file_path, chunk_size=10000):
+        self.__init__(table_name)
+        table_exists = self.check_if_table_exists(self.table_file_path)
+        if not table_exists:
+            print(self.table_name + " is not exists in the DavisBase...Please create a table first")
+            return 0
+        if not os.path.isfile(csv_file_path):
+            print(csv_file_path + " does not exist")
+            return 0
+        col_dtype, col_constraint, column_names = self.scheme_dtype_constraint()
+        start_time = time.time()
+        total_rows = 0
+        with open(csv_file_path, newline='') as fh:
+            reader = csv.reader(fh)
+            first_chunk = True
+            while True:
+                rows = list(itertools.islice(reader, chunk_size))
+                if first_chunk and rows and [value.strip().lower() for value in rows[0]] == column_names[1:]:
+                    rows = rows[1:]
+                first_chunk = False
+                if not rows:
+                    break
+                records = self.encode_rows(col_dtype, rows)
+                if records is None:
+                    print("Copy stopped after " + str(total_rows) + " rows")
+                    return total_rows
+                self.append_records(records)
+                self.commit()
+                total_rows += len(records)
+        elapsed = max(time.time() - start_time, 1e-6)
+        print(str(total_rows) + " rows copied into " + self.table_name + " in " + "%.2f" % elapsed + " seconds (" +
+              str(int(total_rows / elapsed)) + " rows/sec)")
+        return total_rows
+
+    # Rowid bounds a condition on the row_id column limits a scan to, (None, None) when it needs a full scan
+    def row_id_range(self, column_index, operator, value, is_not=False):
+        if column_index != 0 or is_not or operator not in ("=", ">", ">=", "<", "<="):
+            return None, None
+        try:
+            row_id = int(value)
+            if row_id != float(value):
+                return None, None
+        except (TypeError, ValueError):
+            return None, None
+        return {"=": (row_id, row_id), ">": (row_id + 1, None), ">=": (row_id, None), "<": (None, row_id - 1),
+                "<=": (None, row_id)}[operator]
+
+    def traverse_tree(self, table_name, low_row_id=None, high_row_id=None):
         self.__init__(table_name)
         table_exists = self.check_if_table_exists(self.table_file_path)
         if not table_exists:
             print(self.table_name + " is not exists in the DavisBase...Please check the table name")
             return False
-        col_dtype, col_constraint, column_names = self.scheme_dtype_constraint()
-        s_fstring = self.schema_to_fstring(col_dtype)
-        root_node = self.get_root_node(self.table_file_path)
+        pages = self.scan_pages_parallel(low_row_id, high_row_id, format_rows=False)
+        if pages is None:
+            pages = self.scan_pages(low_row_id, high_row_id)
         page_records = []
-        for page_no in range(0, len(root_node), 3):
-            #print("for the page number", root_node[page_no], col_dtype, s_fstring)
-            ret_val, record_val = self.read_page(self.table_file_path, col_dtype, int(root_node[page_no]), s_fstring,
-                                                 root_node[page_no + 1])
-            if ret_val:
-                page_records += record_val
-            else:
-                print("Error while traversing through Tree")
-                break
+        for records in pages:
+            page_records += records
         return page_records
 
-    def delete_record(self, table_name, column, operator, value, is_not=False):
+    # Delete the rows matching either the single column condition or a where condition tree
+    def delete_record(self, table_name, column=None, operator=None, value=None, is_not=False, where=None):
         self.__init__(table_name)
         table_exists = self.check_if_table_exists(self.table_file_path)
         if not table_exists:
             print(self.table_name + " is not exists in the DavisBase...Please check the table name")
             return False
         col_dtype, col_constraint, column_names = self.scheme_dtype_constraint()
-        if column not in column_names:
-            return False
-        if operator not in self.accepted_operator:
+        if where is None:
+            if column not in column_names or operator not in self.accepted_operator:
+                return False
+            where = simple_condition(column, operator, value, is_not)
+        compiled = self.compile_where(col_dtype, column_names, where)
+        if compiled is None:
             return False
-        column_index = column_names.index(column)
-        s_fstring = self.schema_to_fstring(col_dtype)
-        root_node = self.get_root_node(self.table_file_path)
-        value = self.date_time_conv([col_dtype[column_index]], [value])[0]
-        page_records = []
-        total_deleted_records = []
-        insert_success = False
-        for page_no in range(0, len(root_node), 3):
-            page_number = root_node[page_no]
-            page_total_recs = root_node[page_no + 1]
-            page_last_rid = root_node[page_no + 2]
-            ret_val, record_val = self.read_page(self.table_file_path, col_dtype, page_number, s_fstring,
-                                                 page_total_recs)
+        matches, condition_columns, low_row_id, high_row_id = compiled
+        codec = get_codec(col_dtype[1:])
+        indexes = self.table_indexes(column_names)
+        page_numbers = self.plan_pages(where, compiled, indexes)
+        if page_numbers is None:
+            page_numbers = list(self.leaf_pages(self.table_file_path, low_row_id, high_row_id))
+        for page_number in page_numbers:
+            ret_val, record_val = self.read_page(self.table_file_path, col_dtype, page_number)
             if ret_val:
-                deleted_records, new_page_records = self.column_condition_check(record_val, operator, value,
-                                                                                column_index, is_not)
+                deleted_records, new_page_records = self.split_records(record_val, matches)
             else:
                 print("Error while traversing through Tree")
                 break
+            self.index_rows(deleted_records, indexes, column_names, remove=True)
 
-            for dr in deleted_records:
-                total_deleted_records.append(dr)
-
-            if len(total_deleted_records) > 0:
-                self.page_clean_bytes(self.table_file_path, page_number)
-                page_offset = page_number * self.page_size
-                for record in new_page_records:
-                    for val in range(0, len(record)):
-                        if col_dtype[val] == "text":
-                            record[val] = (record[val] + ">x")
-                    record = self.string_encoding(record)
-                    fstring = self.values_to_fstring(col_dtype, record)
-                    record_payload = self.calculate_payload_size(record)
-                    #print("wrting to page", page_number, page_offset, record, fstring, record_payload)
-                    record = self.explicit_type_conv(col_dtype, record)
-                    insert_success, page_offset = self.write_to_del_page(self.table_file_path, page_number, page_offset,
-                                                                         record, fstring,
-                                                                         record_payload)
-                if insert_success:
-                    root_node_len = len(root_node)
-                    if root_node_len == 3:
-                        root_offset = 0
-                    else:
-                        root_offset = (page_no // 3) * 12
-                    page_total_recs = len(new_page_records)
-                    #print("updating the root node", page_number, page_total_recs, page_last_rid, root_offset)
-                    self.update_root_node(self.table_file_path, [page_number, page_total_recs, page_last_rid],
-                                          root_offset)
-                else:
+            if len(deleted_records) > 0:
+                cells = [self.leaf_cell(record[0], codec.encode(record[1:])) for record in new_page_records]
+                #print("wrting to page", page_number, cells)
+                if not self.rewrite_page(self.table_file_path, page_number, cells):
                     print("Error while writing into page")
-            else:
-                continue
+                elif not cells:
+                    # an emptied leaf leaves the tree so its page can be reused
+                    leaf, path = self.find_leaf(self.table_file_path, record_val[0][0])
+                    if leaf == page_number:
+                        self.free_leaf(self.table_file_path, page_number, path)
+        self.commit()
         return True
 
-    def calculate_payload_size(self, values):
+    # Rebuild the table file with every leaf packed full, dropping free and sparse pages and truncating the
+    # file. Rows keep their rowids; cells are copied over without decoding them.
+    def vacuum(self, table_name):
+        self.__init__(table_name)
+        table_exists = self.check_if_table_exists(self.table_file_path)
+        if not table_exists:
+            print(self.table_name + " is not exists in the DavisBase...Please check the table name")
+            return False
+        root_page, last_rowid, free_pages = self.read_file_header(self.table_file_path)
+        page_size = self.get_page_size(self.table_file_path)
+        old_pages = -(-self.pager(self.table_file_path).file_size // page_size)
+        sparse_pages = 0
+        for page_number in range(1, old_pages):
+            free_space = self.fsm_free_space(self.table_file_path, page_number)
+            if free_space is not None and free_space >= page_size // 2:
+                sparse_pages += 1
 
-        self.table_desc = {"row_id": {"datatype": "int", "constraints": "pri:not null"},
-                           "person_id": {"datatype": "int", "constraints": "not null"},
-                           "name": {"datatype": "text", "constraints": "not null"},
-                           "dob": {"datatype": "date", "constraints": "not null"},
-                           "email": {"datatype": "text", "constraints": ""},
-                           "dept_no": {"datatype": "int", "constraints": "not null"}}
-        # table_desc = self.table_dtype_constraint()
-        dtype_bytes = []
-        for index, (col, col_cons) in enumerate(self.table_desc.items()):
-            if col_cons["datatype"] in self.dtype_bytes:
-                dtype_bytes.append(self.dtype_bytes[col_cons["datatype"]])
+        vacuum_file_path = os.path.join(self.table_dir, self.table_name + ".vacuum.tbl")
+        for file_path in (vacuum_file_path, self.fsm_file_path(vacuum_file_path)):
+            discard_pager(file_path)
+            open(file_path, 'wb').close()
+        self.init_table_file(vacuum_file_path, page_size)
+        cells = (cell for page_number in self.leaf_pages(self.table_file_path)
+                 for cell in self.read_cells(self.table_file_path, page_number))
+        self.append_cells(vacuum_file_path, cells)
+        self.update_root_node(vacuum_file_path, last_rowid=last_rowid)
+        new_pages = -(-self.pager(vacuum_file_path).file_size // page_size)
+        self.replace_table_file(vacuum_file_path, self.table_file_path)
+        print(self.table_name + " vacuumed: " + str(free_pages) + " free and " + str(sparse_pages) +
+              " sparse pages, " + str(old_pages) + " pages rewritten into " + str(new_pages))
+        return True
 
-            if col_cons["datatype"] == "text":
-                dtype_bytes.append(len(values[index]))
-        payload_size = sum(dtype_bytes)
-        return payload_size
+    # Build an index on column from the rows in the table. From then on every insert, update and delete keeps
+    # it up to date, and the query planner considers it for conditions on the column.
+    def create_index(self, table_name, column):
+        self.__init__(table_name)
+        table_exists = self.check_if_table_exists(self.table_file_path)
+        if not table_exists:
+            print(self.table_name + " is not exists in the DavisBase...Please check the table name")
+            return False
+        col_dtype, col_constraint, column_names = self.scheme_dtype_constraint()
+        if column not in column_names[1:]:
+            print("Cannot index " + str(column) + ", it is not a column of " + self.table_name)
+            return False
+        if column in index_columns(self.table_dir, self.table_name):
+            print("An index on " + self.table_name + "(" + column + ") already exists")
+            return False
+        index = column_names.index(column)
+        elements = [[record[index], record[0]] for records in self.scan_pages(columns={index}) for record in records
+                    if record[index] is not None]
+        # a stable sort leaves the rows of a key in rowid order
+        elements.sort(key=lambda element: element[0])
+        write_tree_to_file(self.table_dir, self.table_name, column, build_tree(elements))
+        print("Index on " + self.table_name + "(" + column + ") created with " + str(len(elements)) + " entries")
+        return True
+
+    # ANALYZE: gather the statistics of every column in one pass over the leaf pages, row and NULL counts, a
+    # distinct count estimate, min, max and an equi-depth histogram, and store them in the catalog for the
+    # planner. Returns the statistics, or False when the table does not exist.
+    def analyze(self, table_name):
+        self.__init__(table_name)
+        table_exists = self.check_if_table_exists(self.table_file_path)
+        if not table_exists:
+            print(self.table_name + " is not exists in the DavisBase...Please check the table name")
+            return False
+        col_dtype, col_constraint, column_names = self.scheme_dtype_constraint()
+        collectors = [ColumnStatistics() for column in column_names]
+        rows = 0
+        for records in self.scan_pages():
+            rows += len(records)
+            for index, collector in enumerate(collectors):
+                collector.add([record[index] for record in records])
+        statistics = {"rows": rows, "columns": {column: collector.result()
+                                                for column, collector in zip(column_names, collectors)}}
+        write_table_statistics(self.data_dir, self.table_name, statistics)
+        print(self.table_name + " analyzed: " + str(rows) + " rows")
+        for column, dtype in zip(column_names, col_dtype):
+            column_statistics = statistics["columns"][column]
+            low, high = self.string_from_date_time([dtype, dtype], [column_statistics["min"], column_statistics["max"]])
+            print(column + ": " + str(column_statistics["nulls"]) + " nulls, about " +
+                  str(column_statistics["distinct"]) + " distinct values from " + str(low) + " to " + str(high))
+        return statistics
+
+    # Index trees of the table by the index of their column
+    def table_indexes(self, column_names):
+        return {column_names.index(column): read_tree_from_file(self.table_dir, self.table_name, column)
+                for column in index_columns(self.table_dir, self.table_name) if column in column_names}
+
+    # Add rows ([row_id] + stored values) to the indexes of the table, or take them out with remove
+    def index_rows(self, rows, indexes, column_names, remove=False):
+        for index, tree in indexes.items():
+            changes = []
+            for row in rows:
+                if row[index] is None:
+                    continue
+                if remove:
+                    tree.remove([row[index], row[0]])
+                else:
+                    tree.insert([row[index], row[0]])
+                changes.append((remove, row[index], row[0]))
+            if changes:
+                tree_changed(self.table_dir, self.table_name, column_names[index], changes)
+
+    # Leaf pages a statement has to read for a where condition tree compiled by compile_where. When the
+    # planner finds an index cheaper than scanning the leaf pages between the rowid bounds, these are the
+    # pages holding the rows the index gives, in rowid order; otherwise None, for the scan.
+    def plan_pages(self, where, compiled, indexes=None):
+        if where is None:
+            return None
+        col_dtype, col_constraint, column_names = self.scheme_dtype_constraint()
+        if indexes is None:
+            indexes = self.table_indexes(column_names)
+        if not indexes:
+            return None
+        matches, condition_columns, low_row_id, high_row_id = compiled
+        root_page, last_rowid = self.get_root_node(self.table_file_path)
+        # the first page of the file is its header
+        table_pages = max(self.page_count(self.table_file_path) - 1, 1)
+        scan_pages = table_pages
+        if last_rowid > 0 and (low_row_id is not None or high_row_id is not None):
+            low = max(1 if low_row_id is None else low_row_id, 1)
+            high = min(last_rowid if high_row_id is None else high_row_id, last_rowid)
+            scan_pages = table_pages * max(high - low + 1, 0) / last_rowid
+        statistics = {index: tree.statistics() for index, tree in indexes.items()}
+        analyzed = table_statistics(self.data_dir, self.table_name)
+        if analyzed is not None:
+            # the histograms and correlations of the last ANALYZE, the counts of the indexes being always up to
+            # date
+            for index in statistics:
+                column_statistics = analyzed["columns"].get(column_names[index], {})
+                for name in ("histogram", "correlation"):
+                    if column_statistics.get(name) is not None:
+                        statistics[index][name] = column_statistics[name]
+        # compile_where has already turned every value of the condition into the type of its column
+        access, rows, cost = choose_access(
+            where, column_names, statistics,
+            {index: tree.depth() for index, tree in indexes.items()},
+            lambda index, value: self.condition_value(col_dtype[index], value), table_pages, scan_pages,
+            last_rowid)
+        if access is None:
+            return None
+        return self.index_leaf_pages(access, indexes[access[1]])
+
+    # Leaf pages holding the rows an index access of the planner finds, each once and in rowid order
+    def index_leaf_pages(self, access, tree):
+        if access[0] == "lookup":
+            row_ids = [row_id for key in access[2] for row_id in tree.search(key)]
+        else:
+            row_ids = [element[1] for element in tree.range(access[2], access[3])]
+        row_ids.sort()
+        page_numbers = []
+        last_row_id = None
+        for row_id in row_ids:
+            if last_row_id is not None and row_id <= last_row_id:
+                continue
+            page_number, path = self.find_leaf(self.table_file_path, row_id)
+            if not page_numbers or page_numbers[-1] != page_number:
+                page_numbers.append(page_number)
+            last_row_id = max(row_id, self.last_row_id(self.table_file_path, page_number) or row_id)
+        return page_numbers
 
     # get the datatype,constraints from the meta-data
     def scheme_dtype_constraint(self):
@@ -350,246 +538,634 @@ class Table(Page):
             self.column_names.append(col)
         return self.table_dtypes, self.table_constraints, self.column_names
 
-    def column_condition_check(self, record_val, cond_operator, value, column_index, is_not=False):
+    # Split records into the ones matching a compiled condition and the others
+    def split_records(self, record_val, matches):
         impacted_records = []
         unimpacted_records = []
-        for rec in range(0, len(record_val)):
-            if cond_operator == "=":
-                if is_not:
-                    if not record_val[rec][column_index] == value:
-                        impacted_records.append(record_val[rec])
-                    else:
-                        unimpacted_records.append(record_val[rec])
-                else:
-                    if record_val[rec][column_index] == value:
-                        impacted_records.append(record_val[rec])
-                    else:
-                        unimpacted_records.append(record_val[rec])
-            if cond_operator == ">":
-                if is_not:
-                    if not record_val[rec][column_index] > value:
-                        impacted_records.append(record_val[rec])
-                    else:
-                        unimpacted_records.append(record_val[rec])
-                else:
-                    if record_val[rec][column_index] > value:
-                        impacted_records.append(record_val[rec])
-                    else:
-                        unimpacted_records.append(record_val[rec])
-            if cond_operator == ">=":
-                if is_not:
-                    if not record_val[rec][column_index] >= value:
-                        impacted_records.append(record_val[rec])
-                    else:
-                        unimpacted_records.append(record_val[rec])
-                else:
-                    if record_val[rec][column_index] >= value:
-                        impacted_records.append(record_val[rec])
-                    else:
-                        unimpacted_records.append(record_val[rec])
-            if cond_operator == "<":
-                if is_not:
-                    if not record_val[rec][column_index] < value:
-                        impacted_records.append(record_val[rec])
-                    else:
-                        unimpacted_records.append(record_val[rec])
-                else:
-                    if record_val[rec][column_index] < value:
-                        impacted_records.append(record_val[rec])
-                    else:
-                        unimpacted_records.append(record_val[rec])
-            if cond_operator == "<=":
-                if is_not:
-                    if not record_val[rec][column_index] <= value:
-                        impacted_records.append(record_val[rec])
-                    else:
-                        unimpacted_records.append(record_val[rec])
-                else:
-                    if record_val[rec][column_index] <= value:
-                        impacted_records.append(record_val[rec])
-                    else:
-                        unimpacted_records.append(record_val[rec])
-            if cond_operator == "<>":
-                if is_not:
-                    if not record_val[rec][column_index] != value:
-                        impacted_records.append(record_val[rec])
-                    else:
-                        unimpacted_records.append(record_val[rec])
-                else:
-                    if record_val[rec][column_index] > value:
-                        impacted_records.append(record_val[rec])
-                    else:
-                        unimpacted_records.append(record_val[rec])
-
+        for record in record_val:
+            if matches(record):
+                impacted_records.append(record)
+            else:
+                unimpacted_records.append(record)
         return impacted_records, unimpacted_records
 
+    # Stored form of a value a condition compares a column of type dtype with. A number compared with a text
+    # column is compared as its text.
+    def condition_value(self, dtype, value):
+        if dtype == "text" and value is not None and not isinstance(value, str):
+            return str(value)
+        if isinstance(value, str) and dtype in ("tinyint", "smallint", "int", "bigint", "long"):
+            return int(value)
+        if isinstance(value, str) and dtype in ("float", "double"):
+            return float(value)
+        return self.date_time_conv([dtype], [value])[0]
+
+    # Compile a where condition tree once per statement. Returns the row predicate, the columns it reads and
+    # the rowid bounds it implies, or None when the condition does not fit the table.
+    def compile_where(self, col_dtype, column_names, where):
+        try:
+            matches, columns = compile_condition(where, column_names,
+                                                 lambda index, value: self.condition_value(col_dtype[index], value))
+        except (ValueError, TypeError) as e:
+            print("Invalid condition: " + str(e))
+            return None
+        low_row_id, high_row_id = self.row_id_bounds(where, column_names[0])
+        return matches, columns, low_row_id, high_row_id
+
+    # Rowid bounds that every row matching a condition tree lies within
+    def row_id_bounds(self, where, row_id_column):
+        if where[0] == "compare" and where[1] == row_id_column:
+            return self.row_id_range(0, where[2], where[3])
+        if where[0] == "between" and where[1] == row_id_column:
+            return self.row_id_range(0, ">=", where[2])[0], self.row_id_range(0, "<=", where[3])[1]
+        if where[0] == "and":
+            bounds = [self.row_id_bounds(where[1], row_id_column), self.row_id_bounds(where[2], row_id_column)]
+            lows = [low for low, high in bounds if low is not None]
+            highs = [high for low, high in bounds if high is not None]
+            return max(lows) if lows else None, min(highs) if highs else None
+        return None, None
+
     def update_matched_records(self, updated_records, set_column, set_value, set_column_index):
         for rec in range(0, len(updated_records)):
             updated_records[rec][set_column_index] = set_value
         return updated_records
 
-    def update_record(self, table_name, set_column, set_value, cond_column, cond_operator, cond_value, is_not=False):
+    # Set one column of the rows matching either the single column condition or a where condition tree
+    def update_record(self, table_name, set_column, set_value, cond_column=None, cond_operator=None, cond_value=None,
+                      is_not=False, where=None):
         self.__init__(table_name)
         table_exists = self.check_if_table_exists(self.table_file_path)
         if not table_exists:
             print(self.table_name + " is not exists in the DavisBase...Please check the table name")
             return False
         col_dtype, col_constraint, column_names = self.scheme_dtype_constraint()
-        if set_column not in column_names and cond_column not in column_names:
+        if set_column not in column_names:
             return False
-        if cond_operator not in self.accepted_operator:
+        if where is None:
+            if cond_column not in column_names or cond_operator not in self.accepted_operator:
+                return False
+            where = simple_condition(cond_column, cond_operator, cond_value, is_not)
+        compiled = self.compile_where(col_dtype, column_names, where)
+        if compiled is None:
             return False
+        matches, condition_columns, low_row_id, high_row_id = compiled
         set_column_index = column_names.index(set_column)
-        cond_column_index = column_names.index(cond_column)
-        s_fstring = self.schema_to_fstring(col_dtype)
-        root_node = self.get_root_node(self.table_file_path)
-        cond_value = self.date_time_conv([col_dtype[cond_column_index]], [cond_value])[0]
-        set_value = self.date_time_conv([col_dtype[set_column_index]], [set_value])[0]
-        deleted_records = []
-        root_last_rid = root_node[-1]
+        codec = get_codec(col_dtype[1:])
+        page_size = self.get_page_size(self.table_file_path)
+        # the new value is checked before any page or index is touched
+        try:
+            if set_value is not None:
+                set_value = self.condition_value(col_dtype[set_column_index], set_value)
+            get_codec([col_dtype[set_column_index]]).encode([set_value])
+        except (ValueError, TypeError, struct.error) as e:
+            print("Invalid value for " + set_column + ": " + str(e))
+            return False
         move_records = []
-        for page_no in range(0, len(root_node), 3):
-            page_number = root_node[page_no]
-            page_total_recs = root_node[page_no + 1]
-            page_last_rid = root_node[page_no + 2]
-            ret_val, record_val = self.read_page(self.table_file_path, col_dtype, int(page_number), s_fstring,
-                                                 page_total_recs)
+        indexes = self.table_indexes(column_names)
+        page_numbers = self.plan_pages(where, compiled, indexes)
+        if page_numbers is None:
+            page_numbers = list(self.leaf_pages(self.table_file_path, low_row_id, high_row_id))
+        # every matched record is updated and encoded before any page or index is touched, a record that no
+        # longer fits a page fails the whole statement
+        max_record_size = self.max_record_size(self.table_file_path)
+        page_updates = []
+        for page_number in page_numbers:
+            ret_val, record_val = self.read_page(self.table_file_path, col_dtype, int(page_number))
 
             if ret_val:
-                #print("column condition checking", record_val, cond_operator, cond_value, cond_column_index, is_not)
-                updated_records, n_page_records = self.column_condition_check(record_val, cond_operator, cond_value,
-                                                                              cond_column_index, is_not)
+                old_records, n_page_records = self.split_records(record_val, matches)
             else:
                 print("Error while traversing through Tree")
                 break
-            #print("updated records are ", updated_records)
-            #print("Old records are ", n_page_records)
-            if len(updated_records) > 0:
-                # print("checking for the udpated recorsd", updated_records, set_column, set_value, set_column_index)
-                updated_records = self.update_matched_records(updated_records, set_column, set_value, set_column_index)
-                records_size = 0
-
-                for rec in n_page_records:
-                    records_size += self.calculate_payload_size(rec)
-                for rec in updated_records:
-                    rec_size = self.calculate_payload_size(rec)
-                    if (records_size + rec_size) < self.page_size:
-                        n_page_records.append(rec)
-                        records_size = records_size + rec_size
-                    else:
-                        move_records.append(rec)
-
-                page_offset = page_number * self.page_size
-                for record in n_page_records:
-                    for val in range(0, len(record)):
-                        if col_dtype[val] == "text":
-                            record[val] = (record[val] + ">x")
-                    record = self.string_encoding(record)
-                    fstring = self.values_to_fstring(col_dtype, record)
-                    record_payload = self.calculate_payload_size(record)
-                    #print("wrting to page", page_number, page_offset, record, fstring, record_payload)
-                    insert_success, page_offset = self.write_to_page(self.table_file_path, page_number, page_offset,
-                                                                     record, fstring,
-                                                                     record_payload)
-                if insert_success:
-                    root_node_len = len(root_node)
-                    if root_node_len == 3:
-                        root_offset = 0
-                    else:
-                        root_offset = (page_no // 3) * 12
-                    page_total_recs = len(n_page_records)
-                    # print("updating the root node", page_number, page_total_recs, page_last_rid, root_offset)
-                    self.update_root_node(self.table_file_path, [page_number, page_total_recs, page_last_rid],
-                                          root_offset)
-                    # print("updated root node is", self.get_root_node(self.table_file_path))
+            if len(old_records) > 0:
+                updated_records = self.update_matched_records([list(rec) for rec in old_records], set_column,
+                                                              set_value, set_column_index)
+                updated_cells = [codec.encode(rec[1:]) for rec in updated_records]
+                if any(len(record) > max_record_size for record in updated_cells):
+                    print("Record size is greater than " + str(max_record_size) +
+                          " bytes..Cannot accommodate the record in the table")
+                    return False
+                page_updates.append((page_number, old_records, n_page_records, updated_records, updated_cells))
+        for page_number, old_records, n_page_records, updated_records, updated_cells in page_updates:
+            cells = [(rec[0], codec.encode(rec[1:])) for rec in n_page_records]
+            # records moved to another page are indexed again by the insert that moves them
+            self.index_rows(old_records, indexes, column_names, remove=True)
+            records_size = self.page_header.size
+            for row_id, record in cells:
+                records_size += self.cell_size(len(record))
+            for rec, record in zip(updated_records, updated_cells):
+                rec_size = self.cell_size(len(record))
+                if (records_size + rec_size) <= page_size:
+                    cells.append((rec[0], record))
+                    records_size = records_size + rec_size
+                    self.index_rows([rec], indexes, column_names)
                 else:
-                    print("Error while writing into page")
-            else:
-                # print("no change in this page")
-                continue
-        for record in range(len(move_records)):
+                    move_records.append(rec)
+            cells.sort(key=lambda cell: cell[0])
+
+            #print("wrting to page", page_number, cells)
+            if not self.rewrite_page(self.table_file_path, page_number,
+                                     [self.leaf_cell(row_id, record) for row_id, record in cells]):
+                print("Error while writing into page")
+        for record in move_records:
             record = self.string_from_date_time(col_dtype, record)
-            self.insert_into_table(self.table_name, record[1:])
+            if not self.insert_into_table(self.table_name, record[1:], commit=False):
+                print("Error while moving record " + str(record[0]) + " to another page")
+                self.commit()
+                return False
+        self.commit()
         return True
 
-    def select_from_table(self, table_name, select_columns, cond_column=None, cond_operator=None, cond_value=None,
-                          is_not=None):
+    # Streaming SELECT: rows flow leaf page by leaf page through scan -> filter -> project -> format, so only
+    # one page of rows is held at a time and the first rows are available right away. The condition is either
+    # the single column condition or a where condition tree. order_by is a list of (column, descending) pairs,
+    # limit and offset cut the result down. vectorized picks the NumPy scan for this query, workers the number
+    # of processes of a parallel scan.
+    # Returns a generator of result rows and the names of the selected columns, or (False, None) for a
+    # condition that does not fit the table.
+    def select_rows(self, table_name, select_columns, cond_column=None, cond_operator=None, cond_value=None,
+                    is_not=None, where=None, vectorized=None, workers=None, order_by=None, limit=None, offset=0):
         self.__init__(table_name)
-        all_records = self.traverse_tree(table_name)
-        temp_record = []
         col_dtype, col_constraint, column_names = self.scheme_dtype_constraint()
-        for rec in range(len(all_records)):
-            temp_record.append(self.string_from_date_time(col_dtype, all_records[rec]))
-        all_records.clear()
-        all_records = temp_record.copy()
-        if cond_column is None or cond_operator is None or cond_value is None:
-            selected_records = all_records.copy()
+        if where is None and cond_column is not None and cond_operator is not None and cond_value is not None:
+            if cond_column not in column_names or cond_operator not in self.accepted_operator:
+                return False, None
+            where = simple_condition(cond_column, cond_operator, cond_value, is_not)
+        matches, condition_columns, low_row_id, high_row_id = None, set(), None, None
+        if where is not None:
+            compiled = self.compile_where(col_dtype, column_names, where)
+            if compiled is None:
+                return False, None
+            matches, condition_columns, low_row_id, high_row_id = compiled
+        if select_columns == ['*']:
+            select_column_index = list(range(len(column_names)))
         else:
-            if cond_column not in column_names:
-                return False
-            cond_column_index = column_names.index(cond_column)
-            #print("condition check", all_records, cond_operator, cond_value, cond_column_index, is_not)
-            selected_records, n_page_records = self.column_condition_check(all_records, cond_operator, cond_value,
-                                                                           cond_column_index, is_not)
-        select_column_index = []
+            select_column_index = [column_names.index(col) for col in select_columns if col in column_names]
+        selected_col_names = [column_names[col] for col in select_column_index]
+        order_by = order_by or []
+        if any(column not in column_names for column, descending in order_by):
+            print("Unknown ORDER BY column")
+            return False, None
+        order_indexes = [column_names.index(column) for column, descending in order_by]
+
+        # only the selected columns, the condition columns and the sort columns are decoded
+        scan_columns = None
+        if select_columns != ['*']:
+            scan_columns = set(select_column_index) | condition_columns | set(order_indexes)
+        vectorized = self.use_vectorized(vectorized)
+        page_numbers = self.plan_pages(where, (matches, condition_columns, low_row_id, high_row_id))
+        parallel_pages = None
+        if not vectorized and not order_by and page_numbers is None:
+            parallel_pages = self.scan_pages_parallel(low_row_id, high_row_id, where, scan_columns,
+                                                      None if select_columns == ['*'] else select_column_index,
+                                                      workers)
+        if parallel_pages is not None:
+            # the worker processes filter, project and format the rows themselves
+            return self.limit_rows((row for records in parallel_pages for row in records), limit, offset), \
+                selected_col_names
+        pages = self.matching_pages(where, (matches, condition_columns, low_row_id, high_row_id), scan_columns,
+                                    vectorized, page_numbers)
+        if order_by:
+            # sorted on the stored values, before they are formatted
+            pages = self.order_pages(pages, order_indexes, [descending for column, descending in order_by], limit,
+                                     offset)
+            limit, offset = None, 0
+        if select_columns != ['*']:
+            pages = self.project_pages(pages, select_column_index)
+        pages = self.format_pages(pages, [col_dtype[col] for col in select_column_index])
+        return self.limit_rows((row for records in pages for row in records), limit, offset), selected_col_names
+
+    # Rows of pages in the order of the values at order_indexes, descending telling the direction of each.
+    # With a limit only the first offset + limit rows are kept, in a bounded heap; otherwise the rows go
+    # through an external merge sort that spills sorted runs to data/ beyond sort_memory bytes.
+    def order_pages(self, pages, order_indexes, descending, limit=None, offset=0):
+        key = sort_key(order_indexes, descending)
+        if limit is not None:
+            rows = top_rows((row for records in pages for row in records), key, offset + limit)[offset:]
+        else:
+            rows = itertools.islice(external_sort(pages, key, self.sort_memory, self.data_dir), offset, None)
+        yield from batches(rows)
+
+    # LIMIT and OFFSET on a stream of rows, which stops pulling rows once the limit is reached
+    def limit_rows(self, rows, limit=None, offset=0):
+        if limit is None and not offset:
+            return rows
+        return itertools.islice(rows, offset, None if limit is None else offset + limit)
+
+    # Whether a query runs through the NumPy scan: its own choice or else the session's, when NumPy is there
+    def use_vectorized(self, vectorized=None):
+        if vectorized is None:
+            vectorized = self.vectorized
+        if vectorized and np is None:
+            print("NumPy is not installed, running the query row by row")
+            vectorized = False
+        return vectorized
+
+    # Leaf pages of stored rows matching a where condition tree, already compiled by compile_where (both None
+    # to match every row). Only columns (None for all) are decoded, they have to include the condition columns.
+    # page_numbers, as planned by plan_pages, are read instead of the leaf pages between the rowid bounds.
+    def matching_pages(self, where, compiled, columns=None, vectorized=False, page_numbers=None):
+        col_dtype, col_constraint, column_names = self.scheme_dtype_constraint()
+        matches, condition_columns, low_row_id, high_row_id = compiled or (None, set(), None, None)
+        if vectorized and where is not None and page_numbers is None:
+            matches_mask, condition_columns = compile_mask(
+                where, column_names, lambda index, value: self.condition_value(col_dtype[index], value))
+            return self.scan_pages_vectorized(low_row_id, high_row_id, matches_mask, condition_columns, columns)
+        pages = self.scan_pages(low_row_id, high_row_id, columns, page_numbers)
+        if matches is not None:
+            pages = self.filter_pages(pages, matches)
+        return pages
+
+    # Streaming hash aggregate. select_items are column names, which have to be among the group_by columns,
+    # and (function, column) pairs with function one of count, sum, min, max and avg and column "*" for
+    # count(*). Each leaf page of matching rows is folded into partial aggregates per group which are then
+    # merged into the running totals, so a page of rows and a state per group is all that is held. Returns a
+    # generator of result rows in select_items order, one per group in the order the groups were first seen
+    # unless order_by (pairs of result column name and descending) says otherwise, and the result column
+    # names, or (False, None) when the query does not fit the table.
+    def aggregate_rows(self, table_name, select_items, group_by=None, cond_column=None, cond_operator=None,
+                       cond_value=None, is_not=None, where=None, vectorized=None, order_by=None, limit=None,
+                       offset=0):
+        self.__init__(table_name)
+        col_dtype, col_constraint, column_names = self.scheme_dtype_constraint()
+        group_by = group_by or []
+        if where is None and cond_column is not None and cond_operator is not None and cond_value is not None:
+            if cond_column not in column_names or cond_operator not in self.accepted_operator:
+                return False, None
+            where = simple_condition(cond_column, cond_operator, cond_value, is_not)
+        if any(column not in column_names for column in group_by):
+            print("Unknown GROUP BY column")
+            return False, None
+        aggregates = []
+        result_names = []
+        result_dtypes = []
+        for item in select_items:
+            if isinstance(item, str):
+                if item not in group_by:
+                    print(item + " must appear in GROUP BY or be used in an aggregate function")
+                    return False, None
+                result_names.append(item)
+                result_dtypes.append(col_dtype[column_names.index(item)])
+                continue
+            function, column = item
+            if function not in self.aggregate_functions or (column == "*" and function != "count"):
+                print("Invalid aggregate " + function + "(" + column + ")")
+                return False, None
+            if column != "*" and column not in column_names:
+                print("Unknown column " + column + " in aggregate")
+                return False, None
+            if function in ("sum", "avg") and col_dtype[column_names.index(column)] not in self.numeric_dtypes:
+                print(function + " needs a numeric column, " + column + " is " + col_dtype[column_names.index(column)])
+                return False, None
+            aggregates.append((function, None if column == "*" else column_names.index(column)))
+            result_names.append(function + "(" + column + ")")
+            # min and max are shown the way the column is, the other aggregates are plain numbers
+            result_dtypes.append(col_dtype[column_names.index(column)] if function in ("min", "max") else "double")
+        order_by = order_by or []
+        if any(column not in result_names for column, descending in order_by):
+            print("ORDER BY of an aggregate query has to name one of its result columns")
+            return False, None
+        compiled = None
+        if where is not None:
+            compiled = self.compile_where(col_dtype, column_names, where)
+            if compiled is None:
+                return False, None
+        group_indexes = [column_names.index(column) for column in group_by]
+        scan_columns = set(group_indexes) | {index for function, index in aggregates if index is not None}
+        if compiled is not None:
+            scan_columns |= compiled[1]
+        pages = self.matching_pages(where, compiled, scan_columns, self.use_vectorized(vectorized),
+                                    self.plan_pages(where, compiled))
+        pages = batches(self.aggregate_results(pages, select_items, group_by, group_indexes, aggregates))
+        if order_by:
+            pages = self.order_pages(pages, [result_names.index(column) for column, descending in order_by],
+                                     [descending for column, descending in order_by], limit, offset)
+            limit, offset = None, 0
+        pages = self.format_pages(pages, result_dtypes)
+        return self.limit_rows((row for records in pages for row in records), limit, offset), result_names
+
+    # Result rows of an aggregate query, with the stored values of the group columns, min and max
+    def aggregate_results(self, pages, select_items, group_by, group_indexes, aggregates):
+        groups = {}
+        for records in pages:
+            self.merge_partial_aggregates(groups, self.partial_aggregates(records, group_indexes, aggregates),
+                                          aggregates)
+        if not groups and not group_indexes:
+            # an aggregate over no rows at all still gives one row
+            groups[()] = [[None, 0] for aggregate in aggregates]
+        for key, states in groups.items():
+            results = []
+            for (function, index), (value, count) in zip(aggregates, states):
+                if function == "count":
+                    value = count
+                elif function == "avg" and count:
+                    value = value / count
+                results.append(value)
+            row = []
+            position = 0
+            for item in select_items:
+                if isinstance(item, str):
+                    row.append(key[group_by.index(item)])
+                else:
+                    row.append(results[position])
+                    position += 1
+            yield row
+
+    # Aggregate states of the rows of one page per group: [value, count of non NULL values] for every
+    # aggregate, value being the sum for sum and avg, the extreme for min and max and unused for count
+    def partial_aggregates(self, records, group_indexes, aggregates):
+        groups = {}
+        for record in records:
+            key = tuple([record[index] for index in group_indexes])
+            states = groups.get(key)
+            if states is None:
+                states = groups[key] = [[None, 0] for aggregate in aggregates]
+            for (function, index), state in zip(aggregates, states):
+                value = True if index is None else record[index]
+                if value is None:
+                    continue
+                if function in ("sum", "avg"):
+                    state[0] = value if state[1] == 0 else state[0] + value
+                elif function == "min":
+                    if state[1] == 0 or value < state[0]:
+                        state[0] = value
+                elif function == "max":
+                    if state[1] == 0 or value > state[0]:
+                        state[0] = value
+                state[1] += 1
+        return groups
+
+    # Fold partial aggregate states, as returned by partial_aggregates, into the running ones
+    def merge_partial_aggregates(self, groups, partial_groups, aggregates):
+        for key, partial_states in partial_groups.items():
+            states = groups.get(key)
+            if states is None:
+                groups[key] = partial_states
+                continue
+            for (function, index), state, partial_state in zip(aggregates, states, partial_states):
+                if partial_state[1] == 0:
+                    continue
+                if state[1] == 0:
+                    state[0] = partial_state[0]
+                elif function in ("sum", "avg"):
+                    state[0] += partial_state[0]
+                elif function == "min":
+                    state[0] = min(state[0], partial_state[0])
+                elif function == "max":
+                    state[0] = max(state[0], partial_state[0])
+                state[1] += partial_state[1]
+
+    # SELECT over the join of this table with right_table_name on left_column = right_column. Joined rows are
+    # this table's row followed by the right table's, their columns named <table>.<column>; select_columns,
+    # the where condition tree and order_by may also use bare column names that only one of the tables has.
+    # The table with fewer pages is loaded into the hash table and the other one is streamed past it.
+    # A table cannot be joined with itself, the names of its columns would not tell the two sides apart.
+    # Returns a generator of result rows and the result column names, or (False, None).
+    def join_rows(self, table_name, right_table_name, left_column, right_column, select_columns=None,
+                  where=None, order_by=None, limit=None, offset=0):
+        self.__init__(table_name)
+        right = Table(right_table_name)
+        if select_columns is None:
+            select_columns = ['*']
+        if right.table_name == self.table_name:
+            print("A table cannot be joined with itself")
+            return False, None
+        for table in (self, right):
+            if not self.check_if_table_exists(table.table_file_path):
+                print(table.table_name + " is not exists in the DavisBase...Please check the table name")
+                return False, None
+        col_dtype, col_constraint, column_names = self.scheme_dtype_constraint()
+        right_dtype, right_constraint, right_names = right.scheme_dtype_constraint()
+        joined_names = [table_name + "." + column for column in column_names] + \
+            [right_table_name + "." + column for column in right_names]
+        joined_dtype = list(col_dtype) + list(right_dtype)
+        width = len(column_names)
+
+        def qualified(column):
+            if column in joined_names:
+                return column
+            candidates = [name for name in joined_names if name.split(".", 1)[1] == column]
+            return candidates[0] if len(candidates) == 1 else column
+
+        if left_column not in column_names or right_column not in right_names:
+            print("Unknown join column")
+            return False, None
         if select_columns == ['*']:
-            matched_records = selected_records.copy()
-            selected_col_names = column_names.copy()
+            select_column_index = list(range(len(joined_names)))
         else:
-            for col in select_columns:
-                if col in column_names:
-                    select_column_index.append(column_names.index(col))
-            selected_col_names = []
-            for col in select_column_index:
-                selected_col_names.append(column_names[col])
-            matched_records = []
-
-            for rec in range(len(selected_records)):
-                rec_matched_index = []
-                for ind in select_column_index:
-                    rec_matched_index.append(selected_records[rec][ind])
-                matched_records.append(rec_matched_index)
-        return matched_records, selected_col_names
-
-
-Table = Table("person_details")
-
-print("Table Creation\n")
-Table.create_table("person_details")
-
-print("Table Insert\n")
-Table.insert_into_table("person_details", [100, "Dotty", "07.01.2019", "deastup0@google.nl", 62])
-Table.insert_into_table("person_details", [101, "Aksel", "03.01.2019", "agoldson1@tiny.cc", 20])
-Table.insert_into_table("person_details", [102, "Trixie", "02.02.2019", "tdaniellot6@flickr.com", 17])
-Table.insert_into_table("person_details", [103, "Reggy", "01.02.2019", "rlapid9@mtv.com", 53])
-records, columns = Table.select_from_table("person_details",['*'])
-
-print("Table Record Deletion\n")
-column = "name"
-operator = "="
-value = "Trixie"
-is_not = False
-Table.delete_record("person_details", column, operator, value, is_not)
-records, columns = Table.select_from_table("person_details",['*'])
-print(tabulate(records, headers=columns))
-
-print("Table Record Updation\n")
-set_column = "person_id"
-set_value = 125
-cond_column = "name"
-cond_operator = "="
-cond_value = "Reggy"
-is_not = False
-Table.update_record("person_details", set_column, set_value, cond_column, cond_operator, cond_value, is_not)
-records, columns = Table.select_from_table("person_details",['*'])
-print(tabulate(records, headers=columns))
-
-print("Table Record Selection\n")
-select_columns = ["name","dob"]
-cond_column = "dept_no"
-cond_operator = ">="
-cond_value = 20
-is_not = False
-records, columns = Table.select_from_table("person_details", select_columns, cond_column, cond_operator, cond_value,
-                                           is_not)
-print(tabulate(records, headers=columns))
+            select_columns = [qualified(column) for column in select_columns]
+            if any(column not in joined_names for column in select_columns):
+                print("Unknown or ambiguous column in the select list")
+                return False, None
+            select_column_index = [joined_names.index(column) for column in select_columns]
+        order_by = [(qualified(column), descending) for column, descending in order_by or []]
+        if any(column not in joined_names for column, descending in order_by):
+            print("Unknown or ambiguous ORDER BY column")
+            return False, None
+        matches, condition_columns = None, set()
+        if where is not None:
+            compiled = self.compile_where(joined_dtype, joined_names, rename_columns(where, qualified))
+            if compiled is None:
+                return False, None
+            matches, condition_columns = compiled[:2]
+
+        needed = set(select_column_index) | condition_columns | {joined_names.index(column) for column, descending
+                                                                 in order_by}
+        left_key, right_key = column_names.index(left_column), right_names.index(right_column)
+        left_pages = self.scan_pages(columns={index for index in needed if index < width} | {left_key})
+        right_pages = right.scan_pages(columns={index - width for index in needed if index >= width} | {right_key})
+        left_page_count = self.page_count(self.table_file_path)
+        right_page_count = right.page_count(right.table_file_path)
+        if right_page_count <= left_page_count:
+            build_bytes = right_page_count * right.get_page_size(right.table_file_path)
+            pairs = hash_join(right_pages, left_pages, right_key, left_key, self.join_memory, self.data_dir,
+                              self.join_partitions(build_bytes))
+            rows = (probe_row + build_row for build_row, probe_row in pairs)
+        else:
+            build_bytes = left_page_count * self.get_page_size(self.table_file_path)
+            pairs = hash_join(left_pages, right_pages, left_key, right_key, self.join_memory, self.data_dir,
+                              self.join_partitions(build_bytes))
+            rows = (build_row + probe_row for build_row, probe_row in pairs)
+        pages = batches(rows)
+        if matches is not None:
+            pages = self.filter_pages(pages, matches)
+        if order_by:
+            pages = self.order_pages(pages, [joined_names.index(column) for column, descending in order_by],
+                                     [descending for column, descending in order_by], limit, offset)
+            limit, offset = None, 0
+        pages = self.project_pages(pages, select_column_index)
+        pages = self.format_pages(pages, [joined_dtype[index] for index in select_column_index])
+        return self.limit_rows((row for records in pages for row in records), limit, offset), \
+            [joined_names[index] for index in select_column_index]
+
+    # Partitions to split the inputs of a join into when its build side, build_bytes in the table file, does
+    # not fit join_memory. Decoded rows take up a few times the bytes they take in the file.
+    def join_partitions(self, build_bytes):
+        return min(MAX_PARTITIONS, max(2, math.ceil(4 * build_bytes / self.join_memory)))
+
+    # Rows ([row_id] + values) of every leaf page between the rowid bounds, or of the leaf pages page_numbers,
+    # one list per page. With columns only those columns are decoded.
+    def scan_pages(self, low_row_id=None, high_row_id=None, columns=None, page_numbers=None):
+        table_exists = self.check_if_table_exists(self.table_file_path)
+        if not table_exists:
+            print(self.table_name + " is not exists in the DavisBase...Please check the table name")
+            return
+        col_dtype, col_constraint, column_names = self.scheme_dtype_constraint()
+        if page_numbers is None:
+            page_numbers = self.leaf_pages(self.table_file_path, low_row_id, high_row_id)
+        for page_number in page_numbers:
+            ret_val, records = self.read_page(self.table_file_path, col_dtype, page_number, columns)
+            if not ret_val:
+                print("Error while traversing through Tree")
+                return
+            yield records
+
+    # Vectorized scan and filter: the condition columns of each leaf page are read into NumPy arrays, the
+    # condition is evaluated as one mask over the page and only the matching cells are decoded into rows
+    def scan_pages_vectorized(self, low_row_id, high_row_id, matches_mask, condition_columns, columns=None):
+        table_exists = self.check_if_table_exists(self.table_file_path)
+        if not table_exists:
+            print(self.table_name + " is not exists in the DavisBase...Please check the table name")
+            return
+        col_dtype, col_constraint, column_names = self.scheme_dtype_constraint()
+        for page_number in self.leaf_pages(self.table_file_path, low_row_id, high_row_id):
+            ret_val, arrays = self.read_page_arrays(self.table_file_path, col_dtype, page_number, condition_columns)
+            if not ret_val:
+                print("Error while traversing through Tree")
+                return
+            cell_indexes = np.flatnonzero(matches_mask(arrays)).tolist()
+            if not cell_indexes:
+                continue
+            ret_val, records = self.read_page(self.table_file_path, col_dtype, page_number, columns, cell_indexes)
+            if not ret_val:
+                print("Error while traversing through Tree")
+                return
+            yield records
+
+    # Parallel scan: the leaf pages between the rowid bounds are split into runs of consecutive pages which
+    # worker processes read from the table file, filter, project and (unless format_rows is False) format on
+    # their own. Results come back a run at a time in page order. Returns None when the scan should run
+    # serially instead.
+    def scan_pages_parallel(self, low_row_id=None, high_row_id=None, where=None, columns=None,
+                            select_column_index=None, workers=None, format_rows=True):
+        if workers is None:
+            workers = self.scan_workers or os.cpu_count() or 1
+        if workers < 2 or not self.check_if_table_exists(self.table_file_path):
+            return None
+        pager = self.pager(self.table_file_path)
+        if pager.file_size < self.parallel_scan_min_size:
+            return None
+        # the workers read the file itself, so every committed page has to be in it; a scan never commits, with
+        # changes not committed yet the rows are scanned here
+        if pager.dirty:
+            return None
+        pager.write_back_committed()
+        page_numbers = list(self.leaf_pages(self.table_file_path, low_row_id, high_row_id))
+        if len(page_numbers) * pager.page_size < self.parallel_scan_min_size:
+            return None
+        run_size = -(-len(page_numbers) // (workers * self.parallel_scan_runs))
+        runs = [page_numbers[start:start + run_size] for start in range(0, len(page_numbers), run_size)]
+        return self.parallel_runs(workers, runs, pager.page_size, where, columns, select_column_index, format_rows)
+
+    def parallel_runs(self, workers, runs, page_size, where, columns, select_column_index, format_rows):
+        executor = ProcessPoolExecutor(workers)
+        try:
+            yield from executor.map(scan_leaf_pages, repeat(self.table_name), repeat(self.table_file_path),
+                                    repeat(page_size), runs, repeat(where), repeat(columns),
+                                    repeat(select_column_index), repeat(format_rows))
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    # Keep the rows matching a compiled condition, before anything is formatted
+    def filter_pages(self, pages, matches):
+        for records in pages:
+            matched_records = [record for record in records if matches(record)]
+            if matched_records:
+                yield matched_records
+
+    def project_pages(self, pages, column_indexes):
+        for records in pages:
+            yield [[record[index] for index in column_indexes] for record in records]
+
+    # Turn stored date and time values into their display strings
+    def format_pages(self, pages, col_dtype):
+        if not any(dtype in ("year", "time", "date", "datetime") for dtype in col_dtype):
+            yield from pages
+            return
+        for records in pages:
+            yield [self.string_from_date_time(col_dtype, record) for record in records]
+
+    def select_from_table(self, table_name, select_columns, cond_column=None, cond_operator=None, cond_value=None,
+                          is_not=None, where=None):
+        rows, selected_col_names = self.select_rows(table_name, select_columns, cond_column, cond_operator,
+                                                    cond_value, is_not, where)
+        if rows is False:
+            return False
+        return list(rows), selected_col_names
+
+
+# Worker of a parallel scan: reads its leaf pages straight from the table file through its own read only
+# mmap, never through the pagers, and returns the matching rows, projected and formatted, in page order
+def scan_leaf_pages(table_name, table_file_path, page_size, page_numbers, where, columns, select_column_index,
+                    format_rows=True):
+    table = Table(table_name)
+    col_dtype, col_constraint, column_names = table.scheme_dtype_constraint()
+    rows = []
+    with open(table_file_path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        pages = (table.decode_page(buffer, page_number * page_size, col_dtype, columns)[1]
+                 for page_number in page_numbers)
+        if where is not None:
+            pages = table.filter_pages(pages, table.compile_where(col_dtype, column_names, where)[0])
+        if select_column_index is not None:
+            pages = table.project_pages(pages, select_column_index)
+        else:
+            select_column_index = list(range(len(column_names)))
+        if format_rows:
+            pages = table.format_pages(pages, [col_dtype[col] for col in select_column_index])
+        for records in pages:
+            rows += records
+    return rows
+
+
+if __name__ == "__main__":
+    table = Table("person_details")
+
+    print("Table Creation\n")
+    table.create_table("person_details")
+
+    print("Table Insert\n")
+    table.insert_into_table("person_details", [100, "Dotty", "07.01.2019", "deastup0@google.nl", 62])
+    table.insert_into_table("person_details", [101, "Aksel", "03.01.2019", "agoldson1@tiny.cc", 20])
+    table.insert_into_table("person_details", [102, "Trixie", "02.02.2019", "tdaniellot6@flickr.com", 17])
+    table.insert_into_table("person_details", [103, "Reggy", "01.02.2019", "rlapid9@mtv.com", 53])
+    records, columns = table.select_from_table("person_details",['*'])
+
+    print("Table Record Deletion\n")
+    column = "name"
+    operator = "="
+    value = "Trixie"
+    is_not = False
+    table.delete_record("person_details", column, operator, value, is_not)
+    records, columns = table.select_from_table("person_details",['*'])
+    print(tabulate(records, headers=columns))
+
+    print("Table Record Updation\n")
+    set_column = "person_id"
+    set_value = 125
+    cond_column = "name"
+    cond_operator = "="
+    cond_value = "Reggy"
+    is_not = False
+    table.update_record("person_details", set_column, set_value, cond_column, cond_operator, cond_value, is_not)
+    records, columns = table.select_from_table("person_details",['*'])
+    print(tabulate(records, headers=columns))
+
+    print("Table Record Selection\n")
+    select_columns = ["name","dob"]
+    cond_column = "dept_no"
+    cond_operator = ">="
+    cond_value = 20
+    is_not = False
+    records, columns = table.select_from_table("person_details", select_columns, cond_column, cond_operator, cond_value,
+                                               is_not)
+    print(tabulate(records, headers=columns))
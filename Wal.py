@@ -0,0 +1,205 @@
+import os
+import struct
+import threading
+import time
+import zlib
+
+from IoWorker import get_io_worker
+
+PAGE_FRAME = 1
+COMMIT_FRAME = 2
+
+
+# Write-ahead log shared by the pagers of one table (its .tbl and .fsm files). A commit appends a redo frame
+# for every byte range changed since the last commit, followed by a commit frame, and returns once an fsync
+# of the log covering its frames has finished. Commits made at the same time share that fsync: the first
+# commit to find no fsync under way leads a group, waiting for the commits still being written to join it
+# until group_commit_size commits wait or the oldest is group_commit_delay seconds old, then fsyncs the log
+# once for all of them while the others wait for it. A lone commit does not wait for a group. Once the log
+# outgrows checkpoint_size the logged pages are written to their files and the log starts over. Opening a
+# log replays every complete, committed transaction it still holds.
+class WriteAheadLog:
+    group_commit_size = 64
+    group_commit_delay = 0.2
+    checkpoint_size = 4 * 1024 * 1024
+    # frame kind, length of the file name, byte offset in the file, length of the data, crc32 of the rest
+    # of the frame; followed by the file name and the data
+    frame_header = struct.Struct(">BHQII")
+
+    def __init__(self, wal_file_path):
+        self.wal_file_path = wal_file_path
+        self.directory = os.path.dirname(wal_file_path)
+        self.pagers = []
+        self.recover()
+        self.fh = open(wal_file_path, "ab")
+        # commits written to the log so far, and how many of them an fsync has made durable
+        self.written_commits = 0
+        self.synced_commits = 0
+        self.first_waiting_commit = None
+        # commits under way that have not written their frames yet, and whether a group is being fsynced
+        self.committing = 0
+        self.syncing = False
+        self.lock = threading.Lock()
+        self.synced = threading.Condition(self.lock)
+
+    def frame(self, kind, name, offset, data):
+        name = name.encode("utf-8")
+        header = self.frame_header.pack(kind, len(name), offset, len(data), 0)[:-4]
+        crc = zlib.crc32(data, zlib.crc32(name, zlib.crc32(header)))
+        return header + struct.pack(">I", crc) + name + data
+
+    # Log every page changed since the last commit in all pagers of the log as one transaction, and return
+    # once it is durable
+    def commit(self):
+        with self.lock:
+            self.committing += 1
+        try:
+            frames = bytearray()
+            for pager in self.pagers:
+                name = os.path.basename(pager.file_path)
+                for offset, data in pager.take_dirty_ranges():
+                    frames += self.frame(PAGE_FRAME, name, offset, data)
+            if frames:
+                frames += self.frame(COMMIT_FRAME, "", 0, b"")
+        except BaseException:
+            with self.lock:
+                self.committing -= 1
+                self.synced.notify_all()
+            raise
+        with self.lock:
+            self.committing -= 1
+            if frames:
+                self.fh.write(frames)
+                self.fh.flush()
+                self.written_commits += 1
+                if self.first_waiting_commit is None:
+                    self.first_waiting_commit = time.time()
+            sequence = self.written_commits
+            self.synced.notify_all()
+        if not frames:
+            return False
+        self.wait_for_sync(sequence)
+        if self.fh.tell() >= self.checkpoint_size:
+            self.checkpoint()
+        return True
+
+    # Wait until the first sequence commits written to the log are durable, leading the fsync of a group
+    # when no other commit is doing it
+    def wait_for_sync(self, sequence):
+        with self.lock:
+            while self.synced_commits < sequence and not self.fh.closed:
+                if self.syncing:
+                    self.synced.wait()
+                    continue
+                waiting = self.written_commits - self.synced_commits
+                delay = self.first_waiting_commit + self.group_commit_delay - time.time()
+                if self.committing and waiting < self.group_commit_size and delay > 0:
+                    self.synced.wait(delay)
+                    continue
+                self.syncing = True
+                group = self.written_commits
+                self.lock.release()
+                try:
+                    os.fsync(self.fh.fileno())
+                finally:
+                    self.lock.acquire()
+                    self.syncing = False
+                    self.synced.notify_all()
+                self.synced_commits = group
+                self.first_waiting_commit = time.time() if self.written_commits > group else None
+
+    # Make every commit written so far durable
+    def sync(self):
+        with self.lock:
+            sequence = self.written_commits
+        self.wait_for_sync(sequence)
+
+    # Write all logged pages to their files, make the files durable and empty the log
+    def checkpoint(self):
+        self.sync()
+        if get_io_worker() is not None:
+            get_io_worker().drain()
+        for pager in self.pagers:
+            for page_number in sorted(pager.logged):
+                if page_number not in pager.dirty:
+                    pager.write_back(page_number)
+            pager.fh.flush()
+            os.fsync(pager.fh.fileno())
+        with self.lock:
+            self.fh.truncate(0)
+            self.fh.seek(0)
+
+    # Replay the committed transactions of a log left behind by a crash, ignoring a torn or uncommitted tail
+    def recover(self):
+        if not os.path.exists(self.wal_file_path):
+            return
+        with open(self.wal_file_path, "rb") as fh:
+            data = fh.read()
+        transactions = 0
+        frames = []
+        files = {}
+        position = 0
+        while position + self.frame_header.size <= len(data):
+            kind, name_length, offset, length, crc = self.frame_header.unpack_from(data, position)
+            name_start = position + self.frame_header.size
+            frame_end = name_start + name_length + length
+            if frame_end > len(data):
+                break
+            crc_end = position + self.frame_header.size - 4
+            name = data[name_start:name_start + name_length]
+            if zlib.crc32(data[name_start + name_length:frame_end],
+                          zlib.crc32(name, zlib.crc32(data[position:crc_end]))) != crc:
+                break
+            if kind == PAGE_FRAME:
+                frames.append((name.decode("utf-8"), offset, data[name_start + name_length:frame_end]))
+            elif kind == COMMIT_FRAME:
+                for name, offset, page in frames:
+                    fh = files.get(name)
+                    if fh is None:
+                        file_path = os.path.join(self.directory, name)
+                        fh = open(file_path, "r+b" if os.path.exists(file_path) else "w+b")
+                        files[name] = fh
+                    fh.seek(offset)
+                    fh.write(page)
+                frames = []
+                transactions += 1
+            position = frame_end
+        for fh in files.values():
+            fh.flush()
+            os.fsync(fh.fileno())
+            fh.close()
+        with open(self.wal_file_path, "wb"):
+            pass
+        if transactions > 0:
+            print("Recovered " + str(transactions) + " transactions from " + self.wal_file_path)
+
+    def attach(self, pager):
+        self.pagers.append(pager)
+
+    # Forget a pager that has been closed, the log is removed together with its last pager
+    def detach(self, pager):
+        if pager in self.pagers:
+            self.pagers.remove(pager)
+        if not self.pagers:
+            self.close()
+
+    def close(self):
+        if self.fh.closed:
+            return
+        self.checkpoint()
+        with self.lock:
+            self.fh.close()
+        wals.pop(self.wal_file_path, None)
+        if os.path.exists(self.wal_file_path):
+            os.remove(self.wal_file_path)
+
+
+wals = {}
+
+
+def get_wal(wal_file_path):
+    wal = wals.get(wal_file_path)
+    if wal is None:
+        wal = WriteAheadLog(wal_file_path)
+        wals[wal_file_path] = wal
+    return wal
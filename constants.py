@@ -3,3 +3,9 @@ INDEX_BTREE_LEAF_PAGE = 10
 
 TABLE_BTREE_INTERIOR_PAGE = 5
 TABLE_BTREE_LEAF_PAGE = 13
+
+TABLE_FILE_MAGIC = b"DAVISTBL"
+
+# page sizes a table file can be created with, powers of two in between
+MIN_PAGE_SIZE = 512
+MAX_PAGE_SIZE = 65536
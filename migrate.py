@@ -0,0 +1,92 @@
+import os
+import struct
+import sys
+
+from Codec import get_codec
+from constants import MIN_PAGE_SIZE, TABLE_FILE_MAGIC
+from Pager import discard_pager
+from Table import Table
+
+
+# Yield every (rowid, values) pair stored in a table file of an older format version. Formats 1 to 3 list
+# their data pages in a root node of (page_no, count, last_rowid) triples on page 0 and all use 512 byte
+# pages; formats 1 and 2 store records back to back in each page, format 3 in slotted pages.
+def read_old_rows(table, data, version, col_dtype):
+    # formats 2 and 3 keep the root node right after a 16 byte file header
+    root_offset = 0 if version == 1 else 16
+    root_node = []
+    i = root_offset
+    while i + 12 <= MIN_PAGE_SIZE:
+        node = struct.unpack_from('iii', data, i)
+        if node[0] == 0:
+            break
+        root_node.append(node)
+        i += 12
+    if version < 3:
+        codec = get_codec(col_dtype, version)
+        for page_number, page_total_recs, page_last_rid in root_node:
+            page_offset = page_number * MIN_PAGE_SIZE
+            for rec in range(page_total_recs):
+                record, page_offset = codec.decode(data, page_offset)
+                yield record[0], record[1:]
+    else:
+        codec = get_codec(col_dtype[1:])
+        for page_number, page_total_recs, page_last_rid in root_node:
+            page_offset = page_number * MIN_PAGE_SIZE
+            cells = table.page_header.unpack_from(data, page_offset)[1]
+            for i in range(cells):
+                pointer = table.cell_pointer.unpack_from(data, page_offset + table.page_header.size +
+                                                         i * table.cell_pointer.size)[0]
+                record_size, row_id = table.cell_header.unpack_from(data, page_offset + pointer)
+                yield row_id, codec.decode(data, page_offset + pointer + table.cell_header.size)[0]
+    if root_node:
+        # last rowid handed out, even if the row holding it has been deleted since
+        yield root_node[-1][2], None
+
+
+# One-shot upgrade of a table file written by an older format version to the current one. Rows keep their
+# rowids and are loaded into a fresh B+tree in rowid order.
+def migrate_table(table_name):
+    table = Table(table_name)
+    table_file_path = table.table_file_path
+    if not table.check_if_table_exists(table_file_path):
+        print(table_name + " is not exists in the DavisBase...Please check the table name")
+        return False
+    discard_pager(table_file_path)
+    with open(table_file_path, 'rb') as fh:
+        data = fh.read()
+    if data.startswith(TABLE_FILE_MAGIC):
+        version = struct.unpack_from(">H", data, len(TABLE_FILE_MAGIC))[0]
+    else:
+        version = 1
+    if len(data) == 0 or version == table.format_version:
+        print(table_name + " is already up to date")
+        return True
+
+    col_dtype, col_constraint, column_names = table.scheme_dtype_constraint()
+    codec = get_codec(col_dtype[1:])
+    rows = []
+    last_rowid = 0
+    for row_id, values in read_old_rows(table, data, version, col_dtype):
+        if values is not None:
+            rows.append((row_id, values))
+        last_rowid = max(last_rowid, row_id)
+    rows.sort(key=lambda row: row[0])
+
+    temp_file_path = os.path.splitext(table_file_path)[0] + ".migrating.tbl"
+    for file_path in (temp_file_path, table.fsm_file_path(temp_file_path)):
+        discard_pager(file_path)
+        open(file_path, 'wb').close()
+    table.get_root_node(temp_file_path)
+    for row_id, values in rows:
+        table.insert_row(temp_file_path, row_id, codec.encode(values))
+    table.update_root_node(temp_file_path, last_rowid=last_rowid)
+    table.replace_table_file(temp_file_path, table_file_path)
+    print(table_name + " migrated to file format " + str(table.format_version) + ", " + str(len(rows)) +
+          " records rewritten")
+    return True
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:]:
+        migrate_table(name)
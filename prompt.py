@@ -2,6 +2,8 @@ import re
 
 from core.model import DavisBase, TableColumnsMetadata, data_type_encodings, SelectArgs, Condition, DeleteArgs, \
     UpdateArgs, ColumnDefinition
+from Predicate import literal_value, parse_condition
+from Table import Table
 
 prompt = "davisql> "
 version = "v1.0"
@@ -27,6 +29,10 @@ CREATE = "create"
 SELECT = "select"
 TABLE = "table"
 INDEX = "index"
+COPY = "copy"
+VACUUM = "vacuum"
+ANALYZE = "analyze"
+SET = "set"
 
 davis_base = DavisBase()
 
@@ -83,90 +89,164 @@ def insertHandler(tableName, valueList, columnList=None):
     davis_base.insert(tableName, valueList, columnList)
 
 
-# Method to parse table name, condition1, operator and condition2
-def parseDelete(commandTokens):
-    condition1 = None
-    operator = None
-    condition2 = None
+# Condition tree of the WHERE clause of a query, None when there is none. The clause is taken from the
+# query as typed so quoted values keep their case.
+def parseWhere(queryString):
+    parts = re.split(r"\swhere\s", queryString.replace(";", " "), maxsplit=1, flags=re.IGNORECASE)
+    if len(parts) < 2:
+        return None
+    return parse_condition(parts[1])
+
+
+# Method to parse table name and the WHERE condition of DELETE FROM TABLE <table_name> [WHERE <condition>]
+def parseDelete(commandTokens, rawQueryString=None):
     tableName = commandTokens[3]
-    # print("command tokens", commandTokens)
-    if "where" in commandTokens:
-        condition1 = commandTokens[-3]
-        operator = commandTokens[-2]
-        condition2 = commandTokens[-1]
-    deleteHandler(tableName, condition1, operator, condition2)
+    where = parseWhere(rawQueryString or " ".join(commandTokens))
+    deleteHandler(tableName, where)
 
 
-# Stub method to perform delete action.
-# Use the given tableName, condition1, operator and condition2 to identify and delete records from the table
-def deleteHandler(tableName, condition1=None, operator=None, condition2=None):
-    # print("Table name: " + tableName)
-    # if condition1 and condition2 and operator:
-    #     print("Condition 1: " + condition1)
-    #     print("Operator: " + operator)
-    #     print("Condition 2: " + condition2)
-    davis_base.delete(tableName, condition1, operator, condition2)
-
-
-# Method to parse table name, column names and values to be updated and condition1, operator and condition2
-def parseUpdate(commandTokens):
-    tableName = commandTokens[1]
-    updateValuesDictionary = {}
-    isColumnName = True
-    mostRecentColumnName = ""
-    for i in range(3, len(commandTokens) - 4):
-        if commandTokens[i] == "=":
-            continue
-        if isColumnName:
-            mostRecentColumnName = commandTokens[i]
+# Delete the records of the table matching the condition
+def deleteHandler(tableName, where=None):
+    if where is None:
+        print(ERROR)
+        return
+    Table(tableName).delete_record(tableName, where=where)
+
+
+# Method to parse table name, the column and value to be updated and the WHERE condition of
+# UPDATE <table_name> SET <column> = <value> WHERE <condition>
+def parseUpdate(commandTokens, rawQueryString=None):
+    match = re.match(r"\s*update\s+(?:table\s+)?(\w+)\s+set\s+(\w+)\s*=\s*('(?:[^']|'')*'|[^\s;]+)\s+where\s",
+                     rawQueryString or " ".join(commandTokens), re.IGNORECASE)
+    if match is None:
+        print(ERROR)
+        return
+    setValue = match.group(3)
+    if setValue.startswith("'"):
+        setValue = setValue[1:-1].replace("''", "'")
+    else:
+        setValue = literal_value(setValue)
+    updateHandler(match.group(1).lower(), match.group(2).lower(), setValue, parseWhere(rawQueryString or
+                                                                                       " ".join(commandTokens)))
+
+
+# Set the column to the value in the records of the table matching the condition
+def updateHandler(tableName, setColumn, setValue, where=None):
+    if where is None:
+        print(ERROR)
+        return
+    Table(tableName).update_record(tableName, setColumn, setValue, where=where)
+
+
+# Identifies column names or aggregates, table name, the JOIN table and ON columns, the WHERE condition,
+# the GROUP BY columns, the ORDER BY columns and LIMIT / OFFSET from the entered query, the clauses being
+# taken from the query as typed so quoted values keep their case
+def parseSelect(commandTokens, rawQueryString=None):
+    match = re.match(r"\s*select\s+(.+?)\s+from\s+(\w+)"
+                     r"(?:\s+(?:inner\s+)?join\s+(\w+)\s+on\s+(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+))?"
+                     r"(?:\s+where\s+(.+?))?(?:\s+group\s+by\s+(.+?))?"
+                     r"(?:\s+order\s+by\s+(.+?))?(?:\s+limit\s+(\d+))?(?:\s+offset\s+(\d+))?\s*;?\s*$",
+                     rawQueryString or " ".join(commandTokens), re.IGNORECASE | re.DOTALL)
+    if match is None:
+        print(ERROR)
+        return
+    tableName = match.group(2).lower()
+    where = None
+    if match.group(8) is not None:
+        where = parse_condition(match.group(8))
+        if where is None:
+            return
+    selectItems = []
+    for column in match.group(1).split(","):
+        aggregate = re.match(r"\s*(count|sum|min|max|avg)\s*\(\s*(\*|\w+)\s*\)\s*$", column, re.IGNORECASE)
+        if aggregate is not None:
+            selectItems.append((aggregate.group(1).lower(), aggregate.group(2).lower()))
         else:
-            updateValuesDictionary[mostRecentColumnName] = commandTokens[i]
-        isColumnName = not isColumnName
-    condition1 = commandTokens[-3]
-    operator = commandTokens[-2]
-    condition2 = commandTokens[-1]
-    updateHandler(commandTokens)
-
-
-# Stub method to perform update action. Data to be updated is stored as key / value pairs
-# Key refers to the column name and value refer to the updated value for that particular column
-def updateHandler(commandTokens):
-    # print("Command Tokens" + str(commandTokens))
-
-    # table name, value,
-    # davis_base.update(commandTokens[1], UpdateArgs(0, commandTokens[5], Condition(0, commandTokens[8], commandTokens[9])))
-    davis_base.update(commandTokens[1], commandTokens[3], commandTokens[5], commandTokens[7], commandTokens[8], commandTokens[9])
-
-
-# Identifies column names, table name, conditions from the entered query
-def parseSelect(commandTokens):
-    condition1 = None
-    operator = None
-    condition2 = None
-    columnNames = commandTokens[1].split(',')
-    tableName = commandTokens[3]
-    if "where" in commandTokens:
-        condition1 = commandTokens[5]
-        operator = commandTokens[6]
-        condition2 = commandTokens[7]
-    # print (columnNames, tableName, condition1, operator, condition2)
-    selectHandler(columnNames, tableName, condition1, operator, condition2)
-
-
-# Stub method to perform action based on select command
-# Write your select action here.
-def selectHandler(columnNames, tableName, condition1=None, operator=None, condition2=None):
-    # print("Column names: " + str(columnNames))
-    # print("Table names: " + tableName)
-    # if condition1 and condition2 and operator:
-    #     print("Condition 1: " + condition1)
-    #     print("Operator: " + operator)
-    #     print("Condition 2: " + condition2)
-    result = davis_base.select(tableName, condition1, operator, condition2, columnNames)
+            selectItems.append(column.strip().lower())
+    groupBy = [column.strip().lower() for column in match.group(9).split(",")] if match.group(9) else []
+    orderBy = []
+    for column in match.group(10).split(",") if match.group(10) else []:
+        order = re.match(r"\s*(.+?)(?:\s+(asc|desc))?\s*$", column, re.IGNORECASE)
+        orderBy.append((re.sub(r"\s+", "", order.group(1).lower()), (order.group(2) or "").lower() == "desc"))
+    limit = int(match.group(11)) if match.group(11) else None
+    offset = int(match.group(12)) if match.group(12) else 0
+    if match.group(3) is not None:
+        if groupBy or any(not isinstance(item, str) for item in selectItems):
+            print("GROUP BY and aggregates are not supported with JOIN")
+            return
+        joinTableName = match.group(3).lower()
+        # the ON columns may be written in either order
+        on = {match.group(4).lower(): match.group(5).lower(), match.group(6).lower(): match.group(7).lower()}
+        if tableName not in on or joinTableName not in on:
+            print("The ON condition must compare a column of " + tableName + " with a column of " + joinTableName)
+            return
+        joinHandler(selectItems, tableName, joinTableName, on[tableName], on[joinTableName], where, orderBy, limit,
+                    offset)
+    elif groupBy or any(not isinstance(item, str) for item in selectItems):
+        aggregateHandler(selectItems, tableName, where, groupBy, orderBy, limit, offset)
+    else:
+        selectHandler(selectItems, tableName, where, orderBy, limit, offset)
+
+
+# Print one row per group with its aggregates
+def aggregateHandler(selectItems, tableName, where=None, groupBy=None, orderBy=None, limit=None, offset=0):
+    result, columns = Table(tableName).aggregate_rows(tableName, selectItems, groupBy, where=where,
+                                                      order_by=orderBy, limit=limit, offset=offset)
+    if result is False:
+        print(ERROR)
+        return
+    for r in result:
+        print(str([str(c) for c in r]))
+
+
+# Print the selected records as the scan produces them
+def selectHandler(columnNames, tableName, where=None, orderBy=None, limit=None, offset=0):
+    result, columns = Table(tableName).select_rows(tableName, columnNames, where=where, order_by=orderBy,
+                                                   limit=limit, offset=offset)
+    if result is False:
+        print(ERROR)
+        return
+    for r in result:
+        print(str([str(c) for c in r]))
+
+
+# Print the rows of the join of two tables as the probe side streams past the hash table
+def joinHandler(columnNames, tableName, joinTableName, leftColumn, rightColumn, where=None, orderBy=None,
+                limit=None, offset=0):
+    result, columns = Table(tableName).join_rows(tableName, joinTableName, leftColumn, rightColumn, columnNames,
+                                                 where=where, order_by=orderBy, limit=limit, offset=offset)
+    if result is False:
+        print(ERROR)
+        return
     for r in result:
         print(str([str(c) for c in r]))
 
 
+# Method to parse table name and file path of COPY <table_name> FROM '<file.csv>'. The file path is taken
+# from the query as typed so its case is kept.
+def parseCopy(queryString):
+    match = re.match(r"\s*copy\s+(\w+)\s+from\s+'([^']+)'\s*;?\s*$", queryString, re.IGNORECASE)
+    if match is None:
+        print(ERROR)
+        return
+    copyHandler(match.group(1).lower(), match.group(2))
+
+
+# Bulk load a CSV file into a table
+def copyHandler(tableName, filePath):
+    Table(tableName).copy_from(tableName, filePath)
+
+
+# Gather the column statistics of a table into the catalog
+def analyzeHandler(tableName):
+    Table(tableName).analyze(tableName)
+
+
+# Compact a table and give its free pages back to the file system
+def vacuumHandler(tableName):
+    Table(tableName).vacuum(tableName)
+
+
 # Perform actions to drop a table, given its name.
 def dropTableHandler(tableToBeDropped):
     davis_base.drop_table(tableToBeDropped)
@@ -176,9 +256,18 @@ def showTablesHandler():
     davis_base.show_tables()
 
 
-# Method to create index based on table name
-def createIndexHandler(tableName):
-    print("Create Index Table Name: " + tableName)
+# Method to parse table name and column name of CREATE INDEX [<index_name>] ON <table_name> (<column_name>)
+def parseCreateIndex(queryString):
+    match = re.match(r"\s*create\s+index\s+(?:\w+\s+)?on\s+(\w+)\s*\(\s*(\w+)\s*\)\s*;?\s*$", queryString)
+    if match is None:
+        print(ERROR)
+        return
+    createIndexHandler(match.group(1), match.group(2))
+
+
+# Method to create index based on table name and column name
+def createIndexHandler(tableName, columnName):
+    Table(tableName).create_index(tableName, columnName)
 
 
 # Method to display commands supported in Davisbase
@@ -191,8 +280,33 @@ def help():
     print("SELECT * FROM <table_name>")
     print("Display all records in the table <table_name>.\n")
     print("SELECT <column_list> FROM <table_name> [WHERE <condition>]")
-    print("\tDisplay table records whose optional <condition>")
-    print("\tis <column_name> = <value>.\n")
+    print("\tDisplay table records matching the optional <condition>: comparisons")
+    print("\t<column_name> =|<>|<|<=|>|>= <value>, <column_name> [NOT] IN (<values>),")
+    print("\t<column_name> [NOT] BETWEEN <value> AND <value> and <column_name> IS [NOT] NULL,")
+    print("\tcombined with AND, OR, NOT and parentheses.\n")
+    print("SELECT ... FROM <table_name> [WHERE <condition>] [ORDER BY <column> [ASC|DESC], ...]")
+    print("[LIMIT <count>] [OFFSET <count>]")
+    print("\tReturn the records sorted on the ORDER BY columns, skipping OFFSET records and")
+    print("\treturning at most LIMIT.\n")
+    print("SELECT <column_list and aggregates> FROM <table_name> [WHERE <condition>] [GROUP BY <column_list>]")
+    print("\tAggregate table records with COUNT(*), COUNT, SUM, MIN, MAX and AVG of a column, over")
+    print("\tall matching records or per group of the GROUP BY columns.\n")
+    print("SELECT <column_list> FROM <table_name> [INNER] JOIN <table_name> ON <table>.<column> = <table>.<column>")
+    print("[WHERE <condition>] [ORDER BY ...] [LIMIT <count>] [OFFSET <count>]")
+    print("\tReturn the pairs of records whose ON columns are equal. Columns are named <table>.<column>,")
+    print("\tthe table part may be left out when only one of the tables has the column.\n")
+    print("CREATE INDEX ON <table_name> (<column_name>)")
+    print("\tIndex a column. SELECT, UPDATE and DELETE look rows up through the index when their")
+    print("\tcondition on the column is selective enough to beat scanning the table.\n")
+    print("COPY <table_name> FROM '<file.csv>'")
+    print("\tBulk load the rows of a CSV file into the table.\n")
+    print("ANALYZE <table_name>")
+    print("\tRecord row and NULL counts, distinct counts, min, max and a histogram of every column,")
+    print("\twhich the planner uses to estimate how many rows a condition matches.\n")
+    print("VACUUM <table_name>")
+    print("\tCompact the table file, reclaiming space left by deleted records.\n")
+    print("SET VECTORIZED ON|OFF")
+    print("\tFilter SELECT scans on NumPy column arrays a page at a time (needs NumPy).\n")
     print("DROP TABLE <table_name>")
     print("\tRemove table data (i.e. all records) and its schema.\n")
     print(
@@ -207,23 +321,33 @@ def help():
     print("*" * 80)
 
 
+# SET VECTORIZED ON|OFF switches the NumPy scan on or off for the SELECTs of the session
+def setHandler(commandTokens):
+    if len(commandTokens) != 3 or commandTokens[1] != "vectorized" or commandTokens[2] not in ("on", "off"):
+        print(ERROR)
+        return
+    Table.vectorized = commandTokens[2] == "on"
+
+
 # Method to accept user command and determine the command type
-def parseUserCommand(queryString):
+def parseUserCommand(queryString, rawQueryString=None):
     commandType = queryString.split(" ")[0]
     global isExit
     # DML Cases
     if commandType == SELECT:
         commandTokens = queryString.replace(", ", ",").replace(";", "").split(" ")
-        parseSelect(commandTokens)
+        parseSelect(commandTokens, rawQueryString)
     elif commandType == UPDATE:
         commandTokens = queryString.replace(",", "").replace(";", "").split(" ")
-        parseUpdate(commandTokens)
+        parseUpdate(commandTokens, rawQueryString)
     elif commandType == INSERT:
         commandTokens = queryString.replace(", ", ",").replace(";", "").replace("(", "").replace(")", "").split(" ")
         parseInsert(commandTokens)
     elif commandType == DELETE:
         commandTokens = queryString.replace(";", "").split(" ")
-        parseDelete(commandTokens)
+        parseDelete(commandTokens, rawQueryString)
+    elif commandType == COPY:
+        parseCopy(rawQueryString or queryString)
 
     # DDL Cases
     elif commandType == CREATE:
@@ -233,8 +357,7 @@ def parseUserCommand(queryString):
             columnInformationString = re.findall('\(([^)]+)', queryString)[0].split(", ")
             parseCreateTable(tableName, columnInformationString)
         elif createType == INDEX:
-            tableName = queryString.replace(";", "").split(" ")[-1]
-            createIndexHandler(tableName)
+            parseCreateIndex(queryString)
         else:
             print(ERROR)
     elif commandType == DROP:
@@ -242,6 +365,14 @@ def parseUserCommand(queryString):
         dropTableHandler(tableToBeDropped)
     elif commandType == SHOW:
         showTablesHandler()
+    elif commandType == ANALYZE:
+        tableName = queryString.replace(";", "").split(" ")[-1]
+        analyzeHandler(tableName)
+    elif commandType == VACUUM:
+        tableName = queryString.replace(";", "").split(" ")[-1]
+        vacuumHandler(tableName)
+    elif commandType == SET:
+        setHandler(queryString.replace(";", "").split())
 
     # Miscellaneous commands'
     elif commandType == HELP:
@@ -259,9 +390,10 @@ def main():
 
     splashScreen()
     while not isExit:
-        queryString = input(prompt).strip().lower()
+        rawQueryString = input(prompt).strip()
+        queryString = rawQueryString.lower()
         try:
-            parseUserCommand(queryString)
+            parseUserCommand(queryString, rawQueryString)
         except:
             print("Error while running statement", e)
     print("\nExiting...")
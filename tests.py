@@ -1,8 +1,28 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from core.model import DavisBase, Record, LeafCell, TableLeafPage, DavisTable, TableColumnsMetadata, UpdateArgs, \
     Condition, SelectArgs, DeleteArgs, ColumnDefinition
 from core.datum import Null, TinyInt, SmallInt, Int, Long, Float, Double, Year, Time, DateTime, Date, Text
+from Codec import get_codec
+import Index
+from IoWorker import start_io_worker, stop_io_worker
+from Pager import Pager, discard_pager
+from Planner import estimate_rows, histogram_selectivity
+from Predicate import compile_condition, parse_condition
+from Statistics import ColumnStatistics, table_statistics
+from Wal import get_wal
+from Table import Table
 
 
 class FileIoTests(unittest.TestCase):
@@ -140,5 +160,508 @@ class FileIoTests(unittest.TestCase):
         pass
 
 
+class PagerTests(unittest.TestCase):
+
+    def test_pager_flush(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "t.tbl")
+            open(path, "wb").close()
+            pager = Pager(path, 512, cache_pages=2)
+            for page_number in range(4):
+                pager.write(page_number * 512, bytes([page_number + 1]) * 10)
+            assert len(pager.pages) <= 2
+            assert pager.read(512, 2) == b'\x02\x02'
+            pager.close()
+            assert os.path.getsize(path) == 3 * 512 + 10
+            pager = Pager(path, 512)
+            assert pager.read(3 * 512, 10) == b'\x04' * 10
+            pager.close()
+
+    def test_dirty_ranges(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "t.tbl")
+            open(path, "wb").close()
+            pager = Pager(path, 512)
+            pager.write(0, bytes(1024))
+            pager.flush()
+            pager.write(10, b"ab")
+            pager.write(20, b"cd")
+            pager.write(400, b"ef")
+            pager.write(600, b"gh")
+            assert pager.dirty == {0: [[10, 22], [400, 402]], 1: [[88, 90]]}
+            assert pager.take_dirty_ranges() == [(10, pager.read(10, 12)), (400, b"ef"), (600, b"gh")]
+            assert pager.dirty == {} and pager.logged[0] == [[10, 22], [400, 402]]
+            pager.close()
+
+
+
+class CodecTests(unittest.TestCase):
+
+    def test_round_trip(self):
+        codec = get_codec(["int", "int", "text", "date", "text", "int"])
+        row = [1, 100, 'Dotty', 1561939200, 'deastup0@google.nl', 62]
+        record = codec.encode(row)
+        assert codec.size(row) == len(record)
+        assert codec.decode(b'\x00' + record, 1) == (row, len(record) + 1)
+        assert get_codec(("int", "int", "text", "date", "text", "int")) is codec
+
+    def test_text_length_prefix(self):
+        codec = get_codec(["int", "text", "text"])
+        row = [1, 'a>xb', None]
+        assert codec.encode(row) == b'\x00\x00\x00\x01\x00\x04a>xb\xff\xff'
+        assert codec.decode(codec.encode(row), 0) == (row, 12)
+        legacy = get_codec(["int", "text", "text"], 1)
+        assert legacy.decode(legacy.encode([1, 'ab', 'c']), 0) == ([1, 'ab', 'c'], 11)
+
+    def test_decode_columns(self):
+        codec = get_codec(["int", "int", "text", "date", "text", "int"])
+        record = codec.encode([1, 100, 'Dotty', 1561939200, None, 62])
+        assert codec.column_decoder(frozenset([2, 5]))(record, 0) == [None, None, 'Dotty', None, None, 62]
+        assert codec.column_decoder(frozenset([4]))(record, 0) == [None] * 6
+        assert codec.column_decoder(frozenset(range(6)))(record, 0) == codec.decode(record, 0)[0]
+        assert codec.column_decoder(frozenset([2, 5])) is codec.column_decoder(frozenset([5, 2]))
+
+
+class PredicateTests(unittest.TestCase):
+
+    def test_parse_condition(self):
+        assert parse_condition("a = 1 OR NOT b IN ('x', 'it''s') AND c IS NOT NULL") == \
+            ("or", ("compare", "a", "=", 1), ("and", ("not", ("in", "b", ["x", "it's"])), ("not", ("null", "c"))))
+        assert parse_condition("(a != 2.5 or a between 1 and 07.01.2019) and b not between 1 and 2") == \
+            ("and", ("or", ("compare", "a", "<>", 2.5), ("between", "a", 1, "07.01.2019")),
+             ("not", ("between", "b", 1, 2)))
+        assert parse_condition("a = ") is None
+        assert parse_condition("a in (1, 2") is None
+
+    def test_compile_condition(self):
+        matches, columns = compile_condition(parse_condition("b <> 2 and (c in (1, 3) or d is null)"),
+                                             ["a", "b", "c", "d"])
+        assert columns == {1, 2, 3}
+        assert [matches(row) for row in [[0, 1, 3, 0], [0, 2, 3, None], [0, None, 1, 0], [0, 1, 2, None]]] == \
+            [True, False, False, True]
+        matches, columns = compile_condition(("between", "a", "1", "3"), ["a"], lambda index, value: int(value))
+        assert [matches([value]) for value in [0, 1, 3, 4, None]] == [False, True, True, False, False]
+
+
+class StatisticsTests(unittest.TestCase):
+
+    def test_column_statistics(self):
+        statistics = ColumnStatistics(sample_size=1000)
+        for start in range(0, 50000, 500):
+            statistics.add(list(range(start, start + 500)) + [None])
+        result = statistics.result()
+        assert (result["rows"], result["nulls"], result["min"], result["max"]) == (50000, 100, 0, 49999)
+        assert abs(result["distinct"] - 50000) < 2500
+        histogram = result["histogram"]
+        assert len(histogram) == 33 and histogram == sorted(histogram)
+        assert abs(histogram_selectivity(histogram, None, 24999) - 0.5) < 0.1
+        assert histogram_selectivity(histogram, 60000, None) == 0
+        access = ("range", 1, 10000, 19999)
+        assert abs(estimate_rows(access, result) - 10000) < 2500
+
+
+class TableTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.table = Table("person_details")
+        self.table.create_table("person_details")
+
+    def tearDown(self):
+        discard_pager(self.table.table_file_path)
+        discard_pager(self.table.fsm_file_path(self.table.table_file_path))
+        for column in Index.index_columns(self.table.table_dir, "person_details"):
+            discard_pager(Index.log_file_path(self.table.table_dir, "person_details", column))
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def insert_people(self, count):
+        for i in range(count):
+            self.table.insert_into_table("person_details", [i, "name" + str(i), "07.01.2019", "p" + str(i) + "@x.com",
+                                                            i % 5])
+
+    def test_slotted_page_header(self):
+        self.insert_people(3)
+        page_type, cells, content_start, right_sibling, parent = self.table.read_page_header(
+            self.table.table_file_path, 1)
+        assert page_type == 13 and cells == 3
+        assert self.table.page_free_space(self.table.table_file_path, 1) == \
+            content_start - self.table.page_header.size - 2 * cells
+        ret_val, records = self.table.read_page(self.table.table_file_path, self.table.scheme_dtype_constraint()[0], 1)
+        assert [record[0] for record in records] == [1, 2, 3]
+
+    def test_select_compares_stored_dates(self):
+        for dob in ["12.31.2018", "01.02.2019", "02.15.2017"]:
+            self.table.insert_into_table("person_details", [1, "a", dob, "a@x.com", 1])
+        records, columns = self.table.select_from_table("person_details", ["dob"], "dob", "<", "01.01.2019")
+        assert records == [["12.31.2018"], ["02.15.2017"]]
+        records, columns = self.table.select_from_table("person_details", ["row_id"], "dob", "<>", "12.31.2018")
+        assert records == [[2], [3]]
+
+    def test_compound_conditions(self):
+        self.insert_people(300)
+        where = parse_condition("row_id between 10 and 200 and (dept_no in (1, 3) or name = 'name99') "
+                                "and not person_id >= 100")
+        records, columns = self.table.select_from_table("person_details", ["row_id", "dept_no"], where=where)
+        assert [record[0] for record in records] == [row_id for row_id in range(10, 101)
+                                                     if (row_id - 1) % 5 in (1, 3)] + [100]
+        assert self.table.row_id_bounds(where, "row_id") == (10, 200)
+        self.table.update_record("person_details", "dept_no", 7, where=parse_condition("row_id < 3 or row_id = 300"))
+        records, columns = self.table.select_from_table("person_details", ["row_id"], where=("compare", "dept_no",
+                                                                                              "=", 7))
+        assert records == [[1], [2], [300]]
+        self.table.delete_record("person_details", where=parse_condition("dept_no = 7 or email = 'p5@x.com'"))
+        assert len(self.table.traverse_tree("person_details")) == 296
+        assert self.table.select_rows("person_details", ["*"], where=("compare", "salary", "=", 1)) == (False, None)
+        # numbers compared with a text column are compared as text
+        for vectorized in (False, True) if numpy is not None else (False,):
+            rows, columns = self.table.select_rows("person_details", ["name"], where=parse_condition(
+                "name < 5 or name between 1 and 5 or name = 7"), vectorized=vectorized)
+            assert list(rows) == []
+            rows, columns = self.table.select_rows("person_details", ["row_id"], where=parse_condition("name > 5"),
+                                                   vectorized=vectorized)
+            assert len(list(rows)) == 296
+
+    def test_aggregates(self):
+        self.insert_people(300)
+        rows, columns = self.table.aggregate_rows("person_details", [("count", "*"), "dept_no", ("sum", "person_id"),
+                                                                     ("avg", "person_id"), ("max", "name"),
+                                                                     ("min", "dob")], ["dept_no"],
+                                                  where=parse_condition("row_id <= 10"))
+        assert columns == ["count(*)", "dept_no", "sum(person_id)", "avg(person_id)", "max(name)", "min(dob)"]
+        assert list(rows) == [[2, 0, 5, 2.5, "name5", "07.01.2019"], [2, 1, 7, 3.5, "name6", "07.01.2019"],
+                              [2, 2, 9, 4.5, "name7", "07.01.2019"], [2, 3, 11, 5.5, "name8", "07.01.2019"],
+                              [2, 4, 13, 6.5, "name9", "07.01.2019"]]
+        rows, columns = self.table.aggregate_rows("person_details", [("count", "email"), ("sum", "dept_no")],
+                                                  where=parse_condition("dept_no > 9"))
+        assert list(rows) == [[0, None]]
+        assert self.table.aggregate_rows("person_details", ["name", ("count", "*")], ["dept_no"]) == (False, None)
+        assert self.table.aggregate_rows("person_details", [("sum", "name")]) == (False, None)
+
+    def test_order_by_and_limit(self):
+        self.insert_people(300)
+        order_by = [("dept_no", True), ("name", False)]
+        rows, columns = self.table.select_rows("person_details", ["row_id"], order_by=order_by)
+        in_memory = list(rows)
+        expected = sorted(range(1, 301), key=lambda row_id: (-((row_id - 1) % 5), "name" + str(row_id - 1)))
+        assert in_memory == [[row_id] for row_id in expected]
+        rows, columns = self.table.select_rows("person_details", ["row_id"], order_by=order_by, limit=7, offset=3)
+        assert list(rows) == in_memory[3:10]
+        self.table.update_record("person_details", "email", None, where=parse_condition("row_id in (2, 4)"))
+        rows, columns = self.table.select_rows("person_details", ["email"], order_by=[("email", True)], limit=3)
+        assert list(rows) == [["p9@x.com"], ["p99@x.com"], ["p98@x.com"]]
+        rows, columns = self.table.select_rows("person_details", ["email"], order_by=[("email", True)], offset=297)
+        assert list(rows) == [["p0@x.com"], [None], [None]]
+        self.table.sort_memory = 2000
+        rows, columns = self.table.select_rows("person_details", ["row_id"], order_by=order_by)
+        assert list(rows) == in_memory
+        assert sorted(os.listdir(self.table.data_dir)) == ["person_details"]
+        rows, columns = self.table.select_rows("person_details", ["row_id"], where=parse_condition("row_id > 5"),
+                                               limit=2, offset=1)
+        assert list(rows) == [[7], [8]]
+        rows, columns = self.table.aggregate_rows("person_details", ["dept_no", ("count", "*")], ["dept_no"],
+                                                  order_by=[("dept_no", True)], limit=2)
+        assert list(rows) == [[4, 60], [3, 60]]
+
+    def test_index_scan(self):
+        self.insert_people(300)
+        assert self.table.create_index("person_details", "person_id")
+        assert not self.table.create_index("person_details", "person_id")
+        assert not self.table.create_index("person_details", "row_id")
+        col_dtype, col_constraint, column_names = self.table.scheme_dtype_constraint()
+        selective = parse_condition("person_id = 42")
+        assert len(self.table.plan_pages(selective, self.table.compile_where(col_dtype, column_names, selective))) == 1
+        for condition in ("person_id = 42.0", "person_id in ('42', 43)", "person_id between '41' and 42.5"):
+            where = parse_condition(condition)
+            assert len(self.table.plan_pages(where, self.table.compile_where(col_dtype, column_names, where))) == 1
+        wide = parse_condition("person_id > 5")
+        assert self.table.plan_pages(wide, self.table.compile_where(col_dtype, column_names, wide)) is None
+        rows, columns = self.table.select_rows("person_details", ["row_id", "name"], where=selective)
+        assert list(rows) == [[43, "name42"]]
+        self.table.update_record("person_details", "person_id", 1000, where=parse_condition("person_id in (10, 11)"))
+        self.table.update_record("person_details", "name", "a much longer name " * 3,
+                                 where=parse_condition("person_id between 20 and 22"))
+        self.table.delete_record("person_details", where=parse_condition("person_id < 5"))
+        # a value that cannot be stored leaves the rows and their index entries alone
+        assert self.table.update_record("person_details", "person_id", "abc",
+                                        where=parse_condition("row_id = 50")) is False
+        assert self.table.update_record("person_details", "email", "x" * 600,
+                                        where=parse_condition("person_id = 50")) is False
+        rows, columns = self.table.select_rows("person_details", ["row_id"], where=parse_condition("row_id = 51"))
+        assert list(rows) == [[51]]
+        self.table.insert_many("person_details", [[7, "again", "07.01.2019", None, 1]])
+        rows, columns = self.table.select_rows("person_details", ["person_id"],
+                                               where=parse_condition("person_id in (3, 7, 10, 1000)"))
+        assert sorted(rows) == [[7], [7], [1000], [1000]]
+        # the index holds exactly the rows in the table, also once read back from its file
+        Index.trees.clear()
+        stored = sorted([record[1], record[0]] for record in self.table.traverse_tree("person_details"))
+        assert list(self.table.table_indexes(column_names)[1]) == stored
+
+    def test_index_log(self):
+        self.insert_people(100)
+        assert self.table.create_index("person_details", "person_id")
+        col_dtype, col_constraint, column_names = self.table.scheme_dtype_constraint()
+        index_file_path = Index.index_file_path(self.table.table_dir, "person_details", "person_id")
+        stamp = Index.file_stamp(index_file_path)
+        self.insert_people(20)
+        self.table.delete_record("person_details", where=parse_condition("person_id < 10"))
+        # the statements only appended their changes to the log of the index
+        assert Index.file_stamp(index_file_path) == stamp
+        stored = sorted([record[1], record[0]] for record in self.table.traverse_tree("person_details"))
+        # files as a crash leaves them, the log of the index still in the write-ahead log of the table
+        crashed_dir = os.path.join(self.tmp.name, "crashed")
+        shutil.copytree(self.table.data_dir, os.path.join(crashed_dir, "data"))
+        os.chdir(crashed_dir)
+        crashed = Table("person_details")
+        try:
+            assert list(crashed.table_indexes(column_names)[1]) == stored
+        finally:
+            for file_path in (crashed.table_file_path, crashed.fsm_file_path(crashed.table_file_path),
+                              Index.log_file_path(crashed.table_dir, "person_details", "person_id")):
+                discard_pager(file_path)
+            os.chdir(self.tmp.name)
+        # once the log outgrows the index file the tree is written out again and the log starts over
+        min_log_size = Index.MIN_LOG_SIZE
+        Index.MIN_LOG_SIZE = 0
+        try:
+            self.insert_people(200)
+        finally:
+            Index.MIN_LOG_SIZE = min_log_size
+        assert Index.file_stamp(index_file_path) != stamp
+        pager = Index.log_pager(self.table.table_dir, "person_details", "person_id")
+        generation, length = Index.read_log_header(pager)
+        assert generation > 1 and length < Index.file_stamp(index_file_path)[1]
+        Index.trees.clear()
+        stored = sorted([record[1], record[0]] for record in self.table.traverse_tree("person_details"))
+        assert list(self.table.table_indexes(column_names)[1]) == stored
+
+    def test_analyze(self):
+        self.insert_people(300)
+        self.table.update_record("person_details", "email", None, where=parse_condition("row_id in (2, 4)"))
+        statistics = self.table.analyze("person_details")
+        assert statistics == table_statistics(self.table.data_dir, "person_details")
+        assert statistics["rows"] == 300
+        email, dept_no = statistics["columns"]["email"], statistics["columns"]["dept_no"]
+        assert (email["rows"], email["nulls"], email["min"]) == (298, 2, "p0@x.com")
+        assert (dept_no["distinct"], dept_no["min"], dept_no["max"]) == (5, 0, 4)
+        assert dept_no["histogram"][0] == 0 and dept_no["histogram"][-1] == 4
+        assert statistics["columns"]["person_id"]["correlation"] > 0.99
+        assert self.table.analyze("missing") is False
+
+    def test_hash_join(self):
+        self.insert_people(300)
+        depts = Table("depts")
+        depts.create_table("depts")
+        depts.insert_many("depts", [[i, "dept" + str(i), "01.01.2000", None, 0] for i in range(4)])
+        try:
+            rows, columns = self.table.join_rows("person_details", "depts", "dept_no", "person_id",
+                                                 ["person_details.row_id", "depts.name"],
+                                                 where=parse_condition("person_details.row_id < 100 and depts.name <> 'dept2'"),
+                                                 order_by=[("person_details.row_id", False)])
+            assert columns == ["person_details.row_id", "depts.name"]
+            expected = [[row_id, "dept" + str((row_id - 1) % 5)] for row_id in range(1, 100)
+                        if (row_id - 1) % 5 in (0, 1, 3)]
+            assert list(rows) == expected
+            self.table.join_memory = 100
+            rows, columns = self.table.join_rows("depts", "person_details", "person_id", "dept_no",
+                                                 ["depts.email", "person_details.row_id"])
+            rows = list(rows)
+            assert columns == ["depts.email", "person_details.row_id"] and len(rows) == 240
+            assert sorted(row[1] for row in rows) == [row_id for row_id in range(1, 301) if (row_id - 1) % 5 != 4]
+            assert sorted(os.listdir(self.table.data_dir)) == ["depts", "person_details"]
+            assert self.table.join_rows("person_details", "depts", "dept_no", "person_id", ["name"]) == (False, None)
+            assert self.table.join_rows("person_details", "person_details", "dept_no", "person_id") == (False, None)
+        finally:
+            discard_pager(depts.table_file_path)
+            discard_pager(depts.fsm_file_path(depts.table_file_path))
+
+    def test_parallel_scan(self):
+        self.insert_people(300)
+        where = parse_condition("dept_no in (1, 3) or row_id < 20")
+        rows, columns = self.table.select_rows("person_details", ["name", "dob"], where=where, workers=1)
+        serial = list(rows)
+        self.table.parallel_scan_min_size = 0
+        assert self.table.scan_pages_parallel(workers=1) is None
+        rows, columns = self.table.select_rows("person_details", ["name", "dob"], where=where, workers=3)
+        assert list(rows) == serial
+        self.table.scan_workers = 1
+        records = self.table.traverse_tree("person_details", 10, 250)
+        self.table.scan_workers = 2
+        assert self.table.traverse_tree("person_details", 10, 250) == records
+        # a scan commits nothing: with changes not committed yet it is left to the serial scan, and committed
+        # pages are written back without a checkpoint
+        wal = get_wal(self.table.wal_file_path(self.table.table_file_path))
+        pager = self.table.pager(self.table.table_file_path)
+        pager.pin(1)
+        pager.unpin(1, is_dirty=True)
+        commits = wal.written_commits
+        assert self.table.scan_pages_parallel(workers=2) is None
+        assert wal.written_commits == commits and 1 in pager.dirty
+        wal.commit()
+        assert self.table.traverse_tree("person_details", 10, 250) == records
+        assert os.path.getsize(wal.wal_file_path) > 0 and not pager.logged
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_vectorized_select(self):
+        self.insert_people(300)
+        self.table.update_record("person_details", "email", None, where=parse_condition("dept_no = 2"))
+        for condition in ["dept_no in (1, 4) and not person_id between 50 and 250", "dob < 07.02.2019 or row_id = 5",
+                          "email is null and dept_no >= 2.5", "name = 'name7' or email <> 'p8@x.com'",
+                          "row_id > 100 and person_id in (3, 150.0)"]:
+            where = parse_condition(condition)
+            for columns in (["*"], ["name", "dept_no"]):
+                rows, names = self.table.select_rows("person_details", columns, where=where, vectorized=True)
+                assert list(rows) == self.table.select_from_table("person_details", columns, where=where)[0]
+
+    def test_btree_split(self):
+        self.insert_people(500)
+        root_page, last_rowid = self.table.get_root_node(self.table.table_file_path)
+        assert last_rowid == 500
+        assert self.table.read_page_header(self.table.table_file_path, root_page)[0] == 5
+        leaf, path = self.table.find_leaf(self.table.table_file_path, 250)
+        ret_val, records = self.table.read_page(self.table.table_file_path, self.table.scheme_dtype_constraint()[0],
+                                                leaf)
+        assert 250 in [record[0] for record in records]
+        assert [record[0] for record in self.table.traverse_tree("person_details")] == list(range(1, 501))
+
+    def test_insert_many(self):
+        self.insert_people(2)
+        assert self.table.insert_many("person_details", [[i, "bulk" + str(i), "07.01.2019", None, 1]
+                                                         for i in range(1000)])
+        records = self.table.traverse_tree("person_details")
+        assert [record[0] for record in records] == list(range(1, 1003))
+        assert records[-1][2] == "bulk999" and records[-1][4] is None
+        assert self.table.get_root_node(self.table.table_file_path)[1] == 1002
+
+    def test_copy_from(self):
+        csv_file_path = os.path.join(self.tmp.name, "people.csv")
+        with open(csv_file_path, "w") as fh:
+            fh.write("person_id,name,dob,email,dept_no\n")
+            for i in range(2500):
+                fh.write(str(i) + ',"Last, First' + str(i) + '",07.01.2019,p' + str(i) + "@x.com," + str(i % 5) + "\n")
+        assert self.table.copy_from("person_details", csv_file_path, chunk_size=1000) == 2500
+        records = self.table.traverse_tree("person_details")
+        assert [record[0] for record in records] == list(range(1, 2501))
+        assert records[0][1:] == [0, "Last, First0", records[1][3], "p0@x.com", 0]
+
+    def test_page_size(self):
+        for page_size in (4096, 65536):
+            discard_pager(self.table.table_file_path)
+            discard_pager(self.table.fsm_file_path(self.table.table_file_path))
+            shutil.rmtree(self.table.table_dir)
+            self.table.create_table("person_details", page_size)
+            discard_pager(self.table.table_file_path)
+            assert self.table.get_page_size(self.table.table_file_path) == page_size
+            self.insert_people(300)
+            assert self.table.insert_many("person_details", [[i, "bulk" + str(i), "07.01.2019", None, 1]
+                                                             for i in range(3000)])
+            assert os.path.getsize(self.table.table_file_path) % page_size == 0
+            assert self.table.page_free_space(self.table.table_file_path, 1) < page_size
+            records = self.table.traverse_tree("person_details")
+            assert [record[0] for record in records] == list(range(1, 3301))
+        assert self.table.create_table("other", 1000) is None
+
+    def test_free_pages_and_vacuum(self):
+        path = self.table.table_file_path
+        self.table.insert_many("person_details", [[i, "n" + str(i), "07.01.2019", None, 1] for i in range(2000)])
+        self.table.delete_record("person_details", "row_id", "<=", 1500)
+        free_pages = self.table.read_file_header(path)[2]
+        assert free_pages > 0
+        assert self.table.fsm_free_space(path, self.table.new_page_number(path)) is not None
+        assert self.table.read_file_header(path)[2] == free_pages - 1
+        self.table.flush(path)
+        size = os.path.getsize(path)
+        assert self.table.vacuum("person_details")
+        assert os.path.getsize(path) < size
+        assert [record[0] for record in self.table.traverse_tree("person_details")] == list(range(1501, 2001))
+        assert self.table.get_root_node(path)[1] == 2000
+
+    def test_wal_recovery(self):
+        path = self.table.table_file_path
+        self.table.flush(path)
+        files = [path, self.table.fsm_file_path(path)]
+        stale = [open(file_path, "rb").read() for file_path in files]
+        self.insert_people(50)
+        self.table.delete_record("person_details", "row_id", "<=", 10)
+        get_wal(self.table.wal_file_path(path)).sync()
+        wal = open(self.table.wal_file_path(path), "rb").read()
+        # a crash: the table files never saw the pages, the log holds them plus a torn frame
+        for file_path in files:
+            discard_pager(file_path)
+        for file_path, data in zip(files, stale):
+            with open(file_path, "wb") as fh:
+                fh.write(data)
+        with open(self.table.wal_file_path(path), "wb") as fh:
+            fh.write(wal + wal[:40])
+        assert [record[0] for record in self.table.traverse_tree("person_details")] == list(range(11, 51))
+        assert os.path.getsize(self.table.wal_file_path(path)) == 0
+
+    def test_commit_waits_for_fsync(self):
+        wal = get_wal(self.table.wal_file_path(self.table.table_file_path))
+        fsync = os.fsync
+        started, release = threading.Event(), threading.Event()
+
+        def held_fsync(fd):
+            started.set()
+            release.wait(5)
+            fsync(fd)
+
+        committed = []
+
+        def insert():
+            self.table.insert_into_table("person_details", [1, "name", "07.01.2019", None, 1])
+            committed.append(wal.synced_commits == wal.written_commits)
+
+        with mock.patch("os.fsync", held_fsync):
+            thread = threading.Thread(target=insert)
+            thread.start()
+            assert started.wait(5)
+            time.sleep(wal.group_commit_delay / 2)
+            # the statement is not reported committed while its fsync has not finished
+            assert committed == []
+            release.set()
+            thread.join(5)
+        assert committed == [True]
+
+    def test_io_worker(self):
+        Pager.cache_pages = 8
+        start_io_worker(2, 4)
+        try:
+            self.table.insert_many("person_details", [[i, "n" + str(i), "07.01.2019", None, 1] for i in range(3000)])
+            self.table.delete_record("person_details", "dept_no", "=", 1)
+            self.table.insert_many("person_details", [[i, "m" + str(i), "07.01.2019", None, 2] for i in range(3000)])
+            records = self.table.traverse_tree("person_details")
+            assert [record[0] for record in records] == list(range(3001, 6001))
+        finally:
+            stop_io_worker()
+            Pager.cache_pages = 256
+        self.table.flush(self.table.table_file_path)
+        discard_pager(self.table.table_file_path)
+        assert len(self.table.traverse_tree("person_details")) == 3000
+
+    def test_row_id_range(self):
+        self.insert_people(300)
+        assert self.table.row_id_range(0, ">", 10) == (11, None)
+        assert self.table.row_id_range(0, "=", 10, True) == (None, None)
+        assert self.table.row_id_range(1, "=", 10) == (None, None)
+        assert len(list(self.table.leaf_pages(self.table.table_file_path, 42, 42))) == 1
+        records, columns = self.table.select_from_table("person_details", ["person_id"], "row_id", "<=", 3)
+        assert records == [[0], [1], [2]]
+        self.table.delete_record("person_details", "row_id", ">", 297)
+        assert len(self.table.traverse_tree("person_details")) == 297
+
+    def test_select_rows_streams(self):
+        self.insert_people(300)
+        rows, columns = self.table.select_rows("person_details", ["row_id", "name"], "row_id", ">", 100)
+        assert columns == ["row_id", "name"]
+        assert next(rows)[0] == 101
+        assert [row[0] for row in rows] == list(range(102, 301))
+        records, columns = self.table.select_from_table("person_details", ["*"], "row_id", "<", 4)
+        assert [record[0] for record in records] == [1, 2, 3]
+
+
 if __name__ == '__main__':
     unittest.main()